@@ -0,0 +1,68 @@
+"""
+Cold start benchmark: time `import calibrion_ft` and `run_pipeline --help` in fresh interpreters.
+
+Run from the `calibrion-ft` directory:
+
+    python benchmarks/import_time.py [--runs 10]
+
+Each measurement starts a new Python process, so the numbers include interpreter startup;
+the baseline of an empty interpreter is reported alongside for comparison. Works without
+OpenAI credentials.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+COMMANDS = {
+    "python (baseline)": [sys.executable, "-c", "pass"],
+    "import calibrion_ft": [sys.executable, "-c", "import calibrion_ft"],
+    "import calibrion_ft.run_pipeline": [sys.executable, "-c", "import calibrion_ft.run_pipeline"],
+    "run_pipeline --help": [sys.executable, "-m", "calibrion_ft.run_pipeline", "--help"],
+}
+
+
+def time_command(command: list[str], runs: int, env: dict, cwd: str) -> list[float]:
+    """Return the wall time in milliseconds of every run of a command."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def heavy_modules_loaded(env: dict, cwd: str) -> list[str]:
+    """Return the heavy third-party modules loaded by importing run_pipeline."""
+    code = ("import sys, calibrion_ft.run_pipeline; "
+            "print(' '.join(m for m in ('openai', 'httpx', 'pandas', 'numpy', 'wandb', 'yaml') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=cwd, check=True,
+                            capture_output=True, text=True).stdout
+    return output.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Runs per command")
+    args = parser.parse_args()
+
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(SRC_DIR), os.environ.get("PYTHONPATH")]))}
+    env.pop("OPENAI_API_KEY", None)
+    # An empty working directory, so no secrets/openai_api_key.json is found
+    with tempfile.TemporaryDirectory() as cwd:
+        print(f"{'command':<36}{'median ms':>12}{'min ms':>10}")
+        for label, command in COMMANDS.items():
+            timings = time_command(command, args.runs, env, cwd)
+            print(f"{label:<36}{statistics.median(timings):>12.1f}{min(timings):>10.1f}")
+        print(f"Heavy modules loaded by run_pipeline: {heavy_modules_loaded(env, cwd) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
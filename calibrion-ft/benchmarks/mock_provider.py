@@ -0,0 +1,649 @@
+"""
+Local stand-in for the OpenAI endpoints used by the pipeline, for benchmarks and dry runs.
+
+Implements files, fine-tuning jobs (and their checkpoints), chat completions, responses and
+batches closely enough for the `openai` client to parse the results. Inference requests
+(chat completions, responses) take a latency drawn from a configurable distribution, any
+request fails with HTTP 500 at a configurable rate, and per-model request and token buckets
+answer with HTTP 429 once exhausted. Every answer carries `x-ratelimit-*` headers.
+
+Run standalone and point the pipeline at it with `configure_clients(base_url=...)`:
+
+    python benchmarks/mock_provider.py --port 8000 --latency lognormal --latency-median 0.8 --rpm 500
+
+`GET /_stats` returns the request counters.
+"""
+
+import argparse
+import email
+import email.policy
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "lognormal")
+
+# Characters per token assumed when counting tokens of prompts and responses
+CHARS_PER_TOKEN = 4
+
+
+@dataclass(frozen=True)
+class LatencyModel:
+    """
+    Latency of one inference request.
+
+    Args:
+        distribution: "constant", "uniform" (median ± spread × median) or "lognormal"
+            (median and shape parameter sigma = spread).
+        median_s: Median latency in seconds.
+        spread: Relative half-width of "uniform", sigma of "lognormal". Ignored by "constant".
+        per_token_s: Seconds added per generated token.
+    """
+    distribution: str = "lognormal"
+    median_s: float = 0.5
+    spread: float = 0.5
+    per_token_s: float = 0.0
+
+    def __post_init__(self):
+        if self.distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {self.distribution}, expected one of {LATENCY_DISTRIBUTIONS}")
+
+    def sample(self, rng: random.Random, completion_tokens: int = 0) -> float:
+        if self.distribution == "constant":
+            latency = self.median_s
+        elif self.distribution == "uniform":
+            latency = rng.uniform(self.median_s * (1 - self.spread), self.median_s * (1 + self.spread))
+        else:
+            latency = self.median_s * rng.lognormvariate(0.0, self.spread)
+        return max(0.0, latency) + self.per_token_s * completion_tokens
+
+
+@dataclass
+class MockProviderConfig:
+    """
+    Behaviour of the mock provider.
+
+    Args:
+        latency: Latency of chat completion and responses requests.
+        control_latency_s: Latency of every other request (files, jobs, batches).
+        error_rate: Probability that a request fails with HTTP 500.
+        rate_limit_rpm: Requests per minute per model before HTTP 429. None disables the limit.
+        rate_limit_tpm: Tokens per minute per model before HTTP 429. None disables the limit.
+        training_seconds: Time from creating a fine-tuning job until it succeeds.
+        batch_seconds: Time from creating a batch until it is completed.
+        completion_chars: Length of generated responses to prompts without a known response.
+        responses: Known responses by user prompt, e.g. the expected responses of the test split.
+        seed: Seed of the latency and error draws.
+    """
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    control_latency_s: float = 0.002
+    error_rate: float = 0.0
+    rate_limit_rpm: Optional[int] = None
+    rate_limit_tpm: Optional[int] = None
+    training_seconds: float = 0.0
+    batch_seconds: float = 0.0
+    completion_chars: int = 800
+    responses: dict = field(default_factory=dict)
+    seed: int = 0
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _format_reset(seconds: float) -> str:
+    """Format a reset duration like the provider, e.g. "120ms", "1.5s" or "6m0s"."""
+    if seconds < 1:
+        return f"{int(seconds * 1000)}ms"
+    if seconds < 60:
+        return f"{seconds:.3g}s"
+    return f"{int(seconds // 60)}m{int(seconds % 60)}s"
+
+
+class TokenBucket:
+    """Budget of `limit` units per minute, refilled continuously."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.available = float(limit)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.limit, self.available + (now - self.updated_at) * self.limit / 60.0)
+        self.updated_at = now
+
+    def take(self, amount: int, now: float) -> float:
+        """Take `amount` units and return 0, or return the seconds until they are available."""
+        self._refill(now)
+        amount = min(amount, self.limit)
+        if self.available >= amount:
+            self.available -= amount
+            return 0.0
+        return (amount - self.available) * 60.0 / self.limit
+
+    def reset_seconds(self) -> float:
+        return (self.limit - self.available) * 60.0 / self.limit
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections of concurrent clients, which then retry after a second
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients drop connections on purpose, e.g. the losing request of a hedged query
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockProvider:
+    """
+    Threaded HTTP server that imitates the provider API under `/v1`.
+
+    Args:
+        config: Behaviour of the server.
+        host: Interface to listen on.
+        port: Port to listen on, 0 picks a free one.
+    """
+
+    def __init__(self, config: MockProviderConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockProviderConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._files = {}
+        self._jobs = {}
+        self._batches = {}
+        self._request_buckets = {}
+        self._token_buckets = {}
+        self._counters = Counter()
+        self._endpoints = Counter()
+        self._in_flight = 0
+        self._server = _Server((host, port), _Handler)
+        self._server.provider = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        """Serve in a background thread and return the base URL for the client."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-provider", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockProvider":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def stats(self) -> dict:
+        """Return the request counters: totals, per endpoint and the peak number of concurrent requests."""
+        with self._lock:
+            return {**self._counters, "endpoints": dict(self._endpoints)}
+
+    # Request bookkeeping
+
+    def _begin(self, endpoint: str) -> None:
+        with self._lock:
+            self._counters["requests"] += 1
+            self._endpoints[endpoint] += 1
+            self._in_flight += 1
+            self._counters["peak_in_flight"] = max(self._counters["peak_in_flight"], self._in_flight)
+
+    def _end(self, status: int) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            if status == 429:
+                self._counters["rate_limited"] += 1
+            elif status >= 500:
+                self._counters["server_errors"] += 1
+            elif status >= 400:
+                self._counters["client_errors"] += 1
+
+    def _draw(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _latency(self, completion_tokens: int) -> float:
+        with self._lock:
+            return self.config.latency.sample(self._rng, completion_tokens)
+
+    def _admit(self, model: str, tokens: int) -> tuple[float, dict]:
+        """
+        Charge one request of `tokens` tokens to the buckets of a model.
+
+        Returns:
+            tuple: (seconds to wait if rate limited, else 0; rate limit headers)
+        """
+        now = time.monotonic()
+        headers = {}
+        retry_after = 0.0
+        with self._lock:
+            for kind, limit, buckets, amount in (("requests", self.config.rate_limit_rpm, self._request_buckets, 1),
+                                                 ("tokens", self.config.rate_limit_tpm, self._token_buckets, tokens)):
+                if limit is None:
+                    continue
+                bucket = buckets.setdefault(model, TokenBucket(limit))
+                retry_after = max(retry_after, bucket.take(amount, now))
+                headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(int(bucket.available))
+                headers[f"x-ratelimit-reset-{kind}"] = _format_reset(bucket.reset_seconds())
+        return retry_after, headers
+
+    # Responses
+
+    def _generate(self, prompt: str) -> str:
+        if prompt in self.config.responses:
+            return self.config.responses[prompt]
+        text = f"Mock response to: {prompt[:80]}\n"
+        return (text * (self.config.completion_chars // len(text) + 1))[:self.config.completion_chars]
+
+    def chat_completion(self, body: dict) -> dict:
+        messages = body.get("messages") or []
+        prompt = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        content = self._generate(prompt)
+        prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = count_tokens(content)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": i,
+                         "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}
+                        for i in range(body.get("n") or 1)],
+            "usage": {"prompt_tokens": prompt_tokens,
+                      "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def response(self, body: dict) -> dict:
+        items = body.get("input") or []
+        if isinstance(items, str):
+            items = [{"role": "user", "content": items}]
+        prompt = next((m.get("content") or "" for m in reversed(items) if m.get("role") == "user"), "")
+        content = self._generate(prompt)
+        input_tokens = sum(count_tokens(m.get("content") or "") for m in items)
+        output_tokens = count_tokens(content)
+        return {
+            "id": f"resp_{uuid.uuid4().hex}",
+            "object": "response",
+            "created_at": time.time(),
+            "model": body.get("model"),
+            "status": "completed",
+            "output": [{"type": "message",
+                        "id": f"msg_{uuid.uuid4().hex}",
+                        "status": "completed",
+                        "role": "assistant",
+                        "content": [{"type": "output_text", "text": content, "annotations": []}]}],
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {"input_tokens": input_tokens,
+                      "output_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens},
+        }
+
+    def create_file(self, filename: str, purpose: str, content: bytes) -> dict:
+        file = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self._lock:
+            self._files[file["id"]] = (file, content)
+        return file
+
+    def create_job(self, body: dict) -> dict:
+        job_id = f"ftjob-{uuid.uuid4().hex[:24]}"
+        method = body.get("method") or {}
+        hyperparameters = (method.get("supervised") or {}).get("hyperparameters") or body.get("hyperparameters") or {}
+        job = {
+            "id": job_id,
+            "object": "fine_tuning.job",
+            "created_at": int(time.time()),
+            "model": body.get("model"),
+            "fine_tuned_model": None,
+            "organization_id": "org-mock",
+            "status": "validating_files",
+            "training_file": body.get("training_file"),
+            "validation_file": body.get("validation_file"),
+            "hyperparameters": {"batch_size": hyperparameters.get("batch_size", "auto"),
+                                "learning_rate_multiplier": hyperparameters.get("learning_rate_multiplier", "auto"),
+                                "n_epochs": hyperparameters.get("n_epochs", "auto")},
+            "result_files": [],
+            "seed": body.get("seed") or 0,
+            "trained_tokens": None,
+            "finished_at": None,
+            "estimated_finish": None,
+            "error": None,
+            "metadata": body.get("metadata"),
+        }
+        with self._lock:
+            self._jobs[job_id] = (time.monotonic(), job)
+        return job
+
+    def list_jobs(self, metadata: dict, limit: int) -> dict:
+        with self._lock:
+            job_ids = [job_id for job_id, (_, job) in self._jobs.items()
+                       if all((job["metadata"] or {}).get(key) == value for key, value in metadata.items())]
+        jobs = [self.retrieve_job(job_id) for job_id in reversed(job_ids)][:limit]
+        return {"object": "list", "data": jobs, "has_more": len(job_ids) > limit}
+
+    def retrieve_job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            if job_id not in self._jobs:
+                return None
+            created, job = self._jobs[job_id]
+            remaining = self.config.training_seconds - (time.monotonic() - created)
+            if remaining <= 0 and job["status"] != "succeeded":
+                job.update(status="succeeded",
+                           fine_tuned_model=f"ft:{job['model']}:mock::{job_id[-8:]}",
+                           finished_at=int(time.time()))
+            elif remaining > 0:
+                job.update(status="running", estimated_finish=int(time.time() + remaining))
+            return dict(job)
+
+    def job_checkpoints(self, job_id: str) -> Optional[dict]:
+        job = self.retrieve_job(job_id)
+        if job is None:
+            return None
+        checkpoints = []
+        if job["status"] == "succeeded":
+            n_epochs = job["hyperparameters"]["n_epochs"]
+            loss = random.Random(job_id).uniform(0.2, 1.0)
+            for epoch in range(1, (n_epochs if isinstance(n_epochs, int) else 3) + 1):
+                checkpoints.append({
+                    "id": f"ftckpt-{job_id[-8:]}-{epoch}",
+                    "object": "fine_tuning.job.checkpoint",
+                    "created_at": int(time.time()),
+                    "fine_tuned_model_checkpoint": f"{job['fine_tuned_model']}:ckpt-step-{epoch * 100}",
+                    "fine_tuning_job_id": job_id,
+                    "step_number": epoch * 100,
+                    "metrics": {"step": epoch * 100, "train_loss": loss / epoch, "valid_loss": loss / epoch * 1.1},
+                })
+        return {"object": "list", "data": checkpoints, "has_more": False,
+                "first_id": checkpoints[0]["id"] if checkpoints else None,
+                "last_id": checkpoints[-1]["id"] if checkpoints else None}
+
+    def create_batch(self, body: dict) -> Optional[dict]:
+        with self._lock:
+            if body.get("input_file_id") not in self._files:
+                return None
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body.get("input_file_id"),
+            "completion_window": body.get("completion_window"),
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+            "errors": None,
+        }
+        with self._lock:
+            self._batches[batch["id"]] = (time.monotonic(), batch)
+        return batch
+
+    def retrieve_batch(self, batch_id: str) -> Optional[dict]:
+        with self._lock:
+            if batch_id not in self._batches:
+                return None
+            created, batch = self._batches[batch_id]
+            if batch["status"] != "in_progress" or time.monotonic() - created < self.config.batch_seconds:
+                return dict(batch)
+            _, input_content = self._files[batch["input_file_id"]]
+        outputs = []
+        for line in input_content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            outputs.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200,
+                             "request_id": uuid.uuid4().hex,
+                             "body": self.chat_completion(request["body"])},
+                "error": None,
+            }))
+        output_file = self.create_file(f"{batch_id}_output.jsonl", "batch_output", "\n".join(outputs).encode("utf-8"))
+        with self._lock:
+            batch.update(status="completed",
+                         output_file_id=output_file["id"],
+                         completed_at=int(time.time()),
+                         request_counts={"total": len(outputs), "completed": len(outputs), "failed": 0})
+            return dict(batch)
+
+
+def _parse_multipart(content_type: str, body: bytes) -> dict:
+    """Return {field name: (filename, content bytes)} of a multipart/form-data body."""
+    message = email.message_from_bytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body,
+                                       policy=email.policy.HTTP)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; with Nagle's algorithm the body waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    @property
+    def provider(self) -> MockProvider:
+        return self.server.provider
+
+    def _send(self, status: int, payload, headers: dict = None, content_type: str = "application/json") -> None:
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("x-request-id", f"req_{uuid.uuid4().hex}")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, error_type: str, headers: dict = None) -> int:
+        self._send(status, {"error": {"message": message, "type": error_type, "param": None, "code": None}}, headers)
+        return status
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self) -> None:
+        if self.path == "/_stats":
+            self._send(200, self.provider.stats())
+            return
+        self._dispatch("GET", b"")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST", self._read_body())
+
+    def _dispatch(self, method: str, body: bytes) -> None:
+        path = self.path.split("?", 1)[0]
+        parts = path.strip("/").split("/")
+        if parts[:1] != ["v1"]:
+            self._error(404, f"Unknown path {path}", "invalid_request_error")
+            return
+        parts = parts[1:]
+        endpoint = ".".join(part for part in parts if not part.startswith(("ftjob-", "file-", "batch_"))) or "root"
+        self.provider._begin(endpoint)
+        status = 500
+        try:
+            status = self._route(method, parts, body)
+        finally:
+            self.provider._end(status)
+
+    def _route(self, method: str, parts: list[str], body: bytes) -> int:
+        provider = self.provider
+        config = provider.config
+        inference = method == "POST" and parts in (["chat", "completions"], ["responses"])
+
+        payload = {}
+        if method == "POST" and body and not (self.headers.get("Content-Type") or "").startswith("multipart/"):
+            payload = json.loads(body)
+
+        if not inference:
+            time.sleep(config.control_latency_s)
+        if config.error_rate and provider._draw() < config.error_rate:
+            return self._error(500, "The server had an error while processing your request.", "server_error")
+
+        if inference:
+            if parts == ["chat", "completions"]:
+                result = provider.chat_completion(payload)
+                tokens = result["usage"]["total_tokens"]
+                completion_tokens = result["usage"]["completion_tokens"]
+            else:
+                result = provider.response(payload)
+                tokens = result["usage"]["total_tokens"]
+                completion_tokens = result["usage"]["output_tokens"]
+            retry_after, headers = provider._admit(payload.get("model"), tokens)
+            if retry_after:
+                headers["retry-after-ms"] = str(int(retry_after * 1000))
+                headers["retry-after"] = str(max(1, round(retry_after)))
+                return self._error(429, f"Rate limit reached for {payload.get('model')}", "requests", headers)
+            time.sleep(provider._latency(completion_tokens))
+            self._send(200, result, headers)
+            return 200
+
+        if method == "POST" and parts == ["files"]:
+            fields = _parse_multipart(self.headers["Content-Type"], body)
+            filename, content = fields.get("file", (None, b""))
+            purpose = (fields.get("purpose", (None, b""))[1] or b"").decode("utf-8")
+            self._send(200, provider.create_file(filename or "upload.jsonl", purpose, content))
+            return 200
+        if method == "GET" and len(parts) == 3 and parts[0] == "files" and parts[2] == "content":
+            with provider._lock:
+                found = provider._files.get(parts[1])
+            if found is None:
+                return self._error(404, f"No such File object: {parts[1]}", "invalid_request_error")
+            self._send(200, found[1], content_type="application/octet-stream")
+            return 200
+        if method == "GET" and len(parts) == 2 and parts[0] == "files":
+            with provider._lock:
+                found = provider._files.get(parts[1])
+            if found is None:
+                return self._error(404, f"No such File object: {parts[1]}", "invalid_request_error")
+            self._send(200, found[0])
+            return 200
+
+        if method == "POST" and parts == ["fine_tuning", "jobs"]:
+            self._send(200, provider.create_job(payload))
+            return 200
+        if method == "GET" and parts == ["fine_tuning", "jobs"]:
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            metadata = {key[len("metadata["):-1]: values[0] for key, values in query.items()
+                        if key.startswith("metadata[") and key.endswith("]")}
+            self._send(200, provider.list_jobs(metadata, int(query.get("limit", ["20"])[0])))
+            return 200
+        if method == "GET" and parts[:2] == ["fine_tuning", "jobs"] and len(parts) in (3, 4):
+            if len(parts) == 4 and parts[3] == "checkpoints":
+                result = provider.job_checkpoints(parts[2])
+            else:
+                result = provider.retrieve_job(parts[2])
+            if result is None:
+                return self._error(404, f"Fine-tuning job {parts[2]} not found", "invalid_request_error")
+            self._send(200, result)
+            return 200
+
+        if method == "POST" and parts == ["batches"]:
+            batch = provider.create_batch(payload)
+            if batch is None:
+                return self._error(400, f"No such File object: {payload.get('input_file_id')}", "invalid_request_error")
+            self._send(200, batch)
+            return 200
+        if method == "GET" and len(parts) == 2 and parts[0] == "batches":
+            batch = provider.retrieve_batch(parts[1])
+            if batch is None:
+                return self._error(404, f"No such Batch object: {parts[1]}", "invalid_request_error")
+            self._send(200, batch)
+            return 200
+
+        return self._error(404, f"Unknown endpoint {method} /v1/{'/'.join(parts)}", "invalid_request_error")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of `MockProviderConfig` to an argument parser, see `config_from_args`."""
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="lognormal",
+                        help="Latency distribution of inference requests")
+    parser.add_argument("--latency-median", type=float, default=0.5, help="Median inference latency in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="Relative half-width (uniform) or sigma (lognormal) of the latency")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="Seconds added per generated token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with HTTP 500")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute per model before HTTP 429")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens per minute per model before HTTP 429")
+    parser.add_argument("--training-seconds", type=float, default=0.0, help="Duration of a fine-tuning job")
+    parser.add_argument("--batch-seconds", type=float, default=0.0, help="Duration of a batch")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latency and error draws")
+
+
+def config_from_args(args: argparse.Namespace, responses: dict = None) -> MockProviderConfig:
+    return MockProviderConfig(
+        latency=LatencyModel(distribution=args.latency,
+                             median_s=args.latency_median,
+                             spread=args.latency_spread,
+                             per_token_s=args.latency_per_token),
+        error_rate=args.error_rate,
+        rate_limit_rpm=args.rpm,
+        rate_limit_tpm=args.tpm,
+        training_seconds=args.training_seconds,
+        batch_seconds=args.batch_seconds,
+        responses=responses or {},
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    provider = MockProvider(config_from_args(args), host=args.host, port=args.port)
+    print(f"Mock provider listening on {provider.base_url}")
+    try:
+        provider._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        provider._server.server_close()
+        print(json.dumps(provider.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
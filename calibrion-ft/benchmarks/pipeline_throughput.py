@@ -0,0 +1,468 @@
+"""
+End-to-end throughput benchmark: `run_pipeline` against the local mock provider.
+
+Run from the `calibrion-ft` directory:
+
+    python benchmarks/pipeline_throughput.py --models 2 8 --examples 200 2000 --evaluators 1 4
+    python benchmarks/pipeline_throughput.py --eval-mode async --latency-median 0.8 --rpm 3000
+    python benchmarks/pipeline_throughput.py --compare
+
+Every combination of models × test examples × evaluators is one scenario. A scenario copies
+the package without its state files into a temporary directory, writes a synthetic dataset
+version ("benchmark") and as many synthetic evaluators as requested (each burning
+`--evaluator-cpu-ms` of CPU per datapoint), and runs `run_pipeline` with all caches bypassed
+in a fresh process pointed at a `mock_provider.MockProvider`. The working tree's state
+files are never read or written.
+
+Reported per scenario, in total and for every step: wall time, provider requests per second
+and CPU time; for the whole run the peak RSS (largest of the pipeline process and its
+evaluator workers) and the CPU time of step 4 (evaluator CPU). Every run is appended to
+`benchmarks/results/pipeline_throughput.jsonl` together with the git commit, and `--compare`
+lists the latest run of every scenario against the latest run of an earlier commit, marking
+changes beyond `--threshold` as regressions (non-zero exit status).
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+
+import mock_provider
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_DIR = BENCHMARK_DIR.parent
+PACKAGE_DIR = PROJECT_DIR / "src" / "calibrion_ft"
+RESULTS_PATH = BENCHMARK_DIR / "results" / "pipeline_throughput.jsonl"
+
+DATASET_VERSION = "benchmark"
+BASE_MODEL = "gpt-4.1-mini-2025-04-14"
+TRAINING_EXAMPLES = 20
+
+# Higher is worse for these metrics, lower is worse for requests_per_s
+COMPARED_METRICS = ("wall_s", "requests_per_s", "peak_rss_mb", "evaluator_cpu_s")
+
+EVALUATOR_MODULE = '''"""Synthetic evaluators of the pipeline throughput benchmark."""
+
+import hashlib
+import time
+
+from .base import BaseEvaluator
+
+CPU_SECONDS = {cpu_seconds!r}
+
+
+def _burn(text: str) -> int:
+    """Hash the input until CPU_SECONDS of CPU time are spent and return a deterministic count."""
+    digest = text.encode("utf-8")
+    deadline = time.process_time() + CPU_SECONDS
+    while time.process_time() < deadline:
+        digest = hashlib.sha256(digest).digest()
+    return len(text) % 3
+'''
+
+EVALUATOR_CLASS = '''
+
+class BenchmarkEvaluator{index}(BaseEvaluator):
+    error_keys = ("errors",)
+
+    def name(self) -> str:
+        return "benchmark_evaluator_{index}"
+
+    def required_inputs(self) -> list:
+        return ["html_code", "js_code"]
+
+    def run(self, html_code, js_code) -> dict:
+        return {{"errors": _burn(f"{{html_code}}{{js_code}}")}}
+'''
+
+
+def _ignore_state(directory: str, names: list[str]) -> set[str]:
+    """Leave out state files and caches, and every evaluator except the base class."""
+    ignored = {name for name in names
+               if name == "__pycache__" or (name.startswith("_") and name not in ("__init__.py", "__main__.py"))}
+    if Path(directory).name == "evaluators" and Path(directory).parent.name == "evaluation":
+        ignored |= {name for name in names if name not in ("__init__.py", "base.py")}
+    return ignored
+
+
+def _example(index: int, prompt_chars: int) -> tuple[str, str]:
+    prompt = f"Benchmark request {index}: build a chart view. " + "x" * max(0, prompt_chars - 48)
+    response = (f"```html\n<s-chart id=\"chart-{index}\" type=\"bar\"></s-chart>\n```\n"
+                f"```javascript\nconst chart{index} = document.getElementById(\"chart-{index}\");\n```")
+    return prompt, response
+
+
+def write_dataset(workspace: Path, num_examples: int, prompt_chars: int) -> dict:
+    """
+    Write the training and test split of the "benchmark" dataset version and its versions.yaml.
+
+    Returns:
+        dict: Expected response by user prompt of the test split, served by the mock provider.
+    """
+    dataset_dir = workspace / "training_datasets" / "views" / DATASET_VERSION
+    dataset_dir.mkdir(parents=True)
+    responses = {}
+    for split, count in (("train", TRAINING_EXAMPLES), ("test", num_examples)):
+        with open(dataset_dir / f"{split}.jsonl", "w") as f:
+            for i in range(count):
+                prompt, response = _example(i, prompt_chars)
+                if split == "test":
+                    responses[prompt] = response
+                f.write(json.dumps({"messages": [{"role": "system", "content": "You are a helpful assistant."},
+                                                 {"role": "user", "content": prompt},
+                                                 {"role": "assistant", "content": response}]}) + "\n")
+    with open(workspace / "training_datasets" / "views" / "versions.yaml", "w") as f:
+        f.write(f"datasets:\n"
+                f"  - version: \"{DATASET_VERSION}\"\n"
+                f"    folder: \"{DATASET_VERSION}\"\n"
+                f"    splits:\n"
+                f"      training:\n"
+                f"        file: \"train.jsonl\"\n"
+                f"        cloud:\n"
+                f"          file_id: \"file-benchmark-train\"\n"
+                f"      test:\n"
+                f"        file: \"test.jsonl\"\n"
+                f"        cloud:\n"
+                f"          file_id: \"file-benchmark-test\"\n")
+    return responses
+
+
+def prepare_workspace(workspace: Path, scenario: dict) -> dict:
+    """Copy the package into a workspace, add the synthetic evaluators and dataset, and return the test responses."""
+    package_dir = workspace / "src" / "calibrion_ft"
+    shutil.copytree(PACKAGE_DIR, package_dir, ignore=_ignore_state)
+    source = EVALUATOR_MODULE.format(cpu_seconds=scenario["evaluator_cpu_ms"] / 1000)
+    source += "".join(EVALUATOR_CLASS.format(index=i) for i in range(scenario["evaluators"]))
+    (package_dir / "evaluation" / "evaluators" / "benchmark_evaluators.py").write_text(source)
+    return write_dataset(workspace, scenario["examples"], scenario["prompt_chars"])
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=PROJECT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_scenario(scenario: dict, args: argparse.Namespace) -> dict:
+    """Run one scenario in a fresh workspace and return its result record."""
+    workspace = Path(tempfile.mkdtemp(prefix="calibrion-benchmark-"))
+    try:
+        responses = prepare_workspace(workspace, scenario)
+        with mock_provider.MockProvider(mock_provider.config_from_args(args, responses)) as provider:
+            spec_path = workspace / "spec.json"
+            output_path = workspace / "result.json"
+            spec_path.write_text(json.dumps({"scenario": scenario,
+                                             "base_url": provider.base_url,
+                                             "output_path": str(output_path)}))
+            env = {**os.environ,
+                   "PYTHONPATH": str(workspace / "src"),
+                   "WANDB_MODE": "disabled",
+                   "WANDB_SILENT": "true"}
+            env.pop("OPENAI_API_KEY", None)
+            env.pop("CALIBRION_OPENAI_KEY_FILE", None)
+            with open(workspace / "pipeline.log", "w") as log:
+                # Step 1 asks for confirmation before submitting the jobs
+                completed = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--child", str(spec_path)],
+                                           cwd=workspace, env=env, input="y\n", text=True,
+                                           stdout=log, stderr=subprocess.STDOUT)
+            server_stats = provider.stats()
+
+        if output_path.exists():
+            result = json.loads(output_path.read_text())
+        else:
+            result = {"status": "failed", "error": f"Benchmark process exited with status {completed.returncode}"}
+        if result["status"] != "ok":
+            print(f"  {result['error']}, last lines of {workspace / 'pipeline.log'}:")
+            for line in (workspace / "pipeline.log").read_text().splitlines()[-10:]:
+                print(f"    {line}")
+        return {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git("rev-parse", "--short", "HEAD") or None,
+            "dirty": bool(_git("status", "--porcelain", "--", str(PACKAGE_DIR))),
+            "label": args.label,
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "scenario": scenario,
+            **result,
+            "provider": server_stats,
+        }
+    finally:
+        if args.keep_workspace:
+            print(f"  Workspace kept in {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale
+
+
+def _cpu_seconds() -> float:
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+class _Phase:
+    """Wall time, CPU time and provider requests of one part of the run."""
+
+    def __init__(self, base_url: str):
+        self.stats_url = base_url.rsplit("/v1", 1)[0] + "/_stats"
+
+    def _requests(self) -> int:
+        with urllib.request.urlopen(self.stats_url) as response:
+            return json.load(response).get("requests", 0)
+
+    def __enter__(self) -> "_Phase":
+        self.requests = self._requests()
+        self.cpu = _cpu_seconds()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        wall = time.perf_counter() - self.start
+        requests = self._requests() - self.requests
+        self.result = {"wall_s": round(wall, 3),
+                       "requests": requests,
+                       "requests_per_s": round(requests / wall, 2) if wall else 0.0,
+                       "cpu_s": round(_cpu_seconds() - self.cpu, 3)}
+
+
+def run_child(spec_path: Path) -> None:
+    """Run the pipeline of one scenario inside its workspace; called in the benchmark process."""
+    spec = json.loads(Path(spec_path).read_text())
+    scenario, base_url = spec["scenario"], spec["base_url"]
+
+    from calibrion_ft import step_1_run_ft_jobs, step_2_update_experiments, step_3_eval_run_ft_models, training_configs
+    from calibrion_ft.clients import configure_clients
+    from calibrion_ft.evaluation.core import shutdown_evaluator_pool
+    from calibrion_ft.run_pipeline import run_pipeline
+
+    configure_clients(api_key="benchmark", base_url=base_url)
+    # One configuration per model: the default one plus one per batch size
+    training_configs.llms = [BASE_MODEL]
+    training_configs.batch_sizes = list(range(1, scenario["models"]))
+    training_configs.learning_rate_multipliers = [1.0]
+    training_configs.max_concurrent_jobs = scenario["models"]
+    training_configs.max_estimated_spend = float("inf")
+
+    steps = {}
+    failed_steps = []
+
+    def measured(step: str, function, cleanup=None):
+        def wrapper(*args, **kwargs):
+            phase = _Phase(base_url)
+            try:
+                with phase:
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        if cleanup is not None:
+                            cleanup()
+            except BaseException:
+                failed_steps.append(step)
+                raise
+            finally:
+                steps[step] = phase.result
+        return wrapper
+
+    step_1_run_ft_jobs.run_experiments = measured("1", step_1_run_ft_jobs.run_experiments)
+    step_2_update_experiments.wait_for_experiments = measured("2", step_2_update_experiments.wait_for_experiments)
+    step_3_eval_run_ft_models.eval_run_all_fted_models = measured("3", step_3_eval_run_ft_models.eval_run_all_fted_models)
+    try:
+        from calibrion_ft import step_4_run_evaluation
+    except ImportError:
+        # run_pipeline reports the import error of step 4 itself, which fails the scenario
+        failed_steps.append("4")
+    else:
+        # Evaluator workers are shut down inside the measurement, so their CPU time is counted
+        step_4_run_evaluation.evaluate_all_ft_models = measured("4", step_4_run_evaluation.evaluate_all_ft_models,
+                                                                cleanup=shutdown_evaluator_pool)
+
+    result = {"status": "ok", "error": None}
+    phase = _Phase(base_url)
+    try:
+        with phase:
+            run_pipeline(wandb_project="calibrion-ft-benchmark",
+                         dataset_version=DATASET_VERSION,
+                         skip_steps=[],
+                         eval_mode=scenario["eval_mode"],
+                         cache_mode="bypass",
+                         eval_cache_mode="bypass",
+                         use_scheduler=scenario["use_scheduler"])
+    except BaseException as e:
+        # The step that raised, if it was measured (or could not be imported); None for failures in between
+        result = {"status": "failed", "error": f"{type(e).__name__}: {e}",
+                  "failed_step": failed_steps[0] if failed_steps else None}
+    finally:
+        shutdown_evaluator_pool()
+
+    Path(spec["output_path"]).write_text(json.dumps({
+        **result,
+        **phase.result,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        # Only a completed step 4 has a meaningful evaluator CPU time
+        "evaluator_cpu_s": steps["4"]["cpu_s"] if "4" in steps and "4" not in failed_steps else None,
+        "steps": steps,
+    }))
+
+
+def load_results(path: Path = RESULTS_PATH) -> list[dict]:
+    if not path.exists():
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_result(record: dict, path: Path = RESULTS_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def _scenario_key(record: dict) -> str:
+    return json.dumps(record["scenario"], sort_keys=True)
+
+
+def _scenario_label(scenario: dict) -> str:
+    return (f"{scenario['models']}m×{scenario['examples']}ex×{scenario['evaluators']}ev "
+            f"{scenario['eval_mode']}{' scheduler' if scenario['use_scheduler'] else ''}")
+
+
+def _commit_label(record: dict) -> str:
+    return f"{record['commit'] or 'unknown'}{'+' if record['dirty'] else ''}"
+
+
+def _failure(record: dict) -> str:
+    step = record.get("failed_step")
+    return f"failed{' at step ' + step if step else ''}: {record.get('error')}"
+
+
+def compare(records: list[dict], threshold: float) -> int:
+    """
+    Print the latest successful run of every scenario against the latest one of an earlier commit.
+
+    Failed runs are never compared: their metrics stop at the failing step. A scenario whose
+    latest run failed is listed as failed, and the number of excluded failed runs is printed.
+
+    Returns:
+        int: Number of regressions, i.e. metrics that got worse by more than `threshold` (relative).
+    """
+    regressions = 0
+    by_scenario = {}
+    for record in records:
+        by_scenario.setdefault(_scenario_key(record), []).append(record)
+
+    for all_runs in by_scenario.values():
+        if all_runs[-1].get("status") != "ok":
+            print(f"{_scenario_label(all_runs[-1]['scenario'])}: {_commit_label(all_runs[-1])} "
+                  f"{_failure(all_runs[-1])} (not compared)")
+            continue
+        runs = [run for run in all_runs if run.get("status") == "ok"]
+        excluded = len(all_runs) - len(runs)
+        latest = runs[-1]
+        baseline = next((run for run in reversed(runs[:-1]) if run["commit"] != latest["commit"]), None)
+        print(f"{_scenario_label(latest['scenario'])}: {_commit_label(latest)}"
+              f" vs {_commit_label(baseline) if baseline else '(no earlier commit)'}"
+              f"{f' ({excluded} failed run(s) excluded)' if excluded else ''}")
+        for metric in COMPARED_METRICS:
+            current = latest.get(metric)
+            previous = baseline.get(metric) if baseline else None
+            if current is None:
+                continue
+            line = f"  {metric:<18}{current:>12.2f}"
+            if previous:
+                change = (current - previous) / previous
+                worse = -change if metric == "requests_per_s" else change
+                line += f"{previous:>12.2f}{change:>+10.1%}"
+                if worse > threshold:
+                    line += "  REGRESSION"
+                    regressions += 1
+            print(line)
+    return regressions
+
+
+def _print_result(record: dict) -> None:
+    failed = record["status"] != "ok"
+    if failed:
+        print(f"  {_failure(record)}")
+    print(f"  {'':<10}{'wall s':>10}{'requests':>10}{'req/s':>10}{'cpu s':>10}")
+    for step, phase in sorted(record.get("steps", {}).items()):
+        print(f"  {'step ' + step:<10}{phase['wall_s']:>10.2f}{phase['requests']:>10}"
+              f"{phase['requests_per_s']:>10.1f}{phase['cpu_s']:>10.2f}")
+    if "wall_s" in record:
+        print(f"  {'total' + (' *' if failed else ''):<10}{record['wall_s']:>10.2f}{record['requests']:>10}"
+              f"{record['requests_per_s']:>10.1f}{record['cpu_s']:>10.2f}")
+        evaluator_cpu = "n/a" if record["evaluator_cpu_s"] is None else f"{record['evaluator_cpu_s']:.2f} s"
+        print(f"  peak RSS {record['peak_rss_mb']:.1f} MB, evaluator CPU {evaluator_cpu}, "
+              f"{record['provider'].get('rate_limited', 0)} rate limited, "
+              f"{record['provider'].get('server_errors', 0)} server errors")
+        if failed:
+            print("  * up to the failure only; failed runs are excluded from --compare")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--models", type=int, nargs="+", default=[2], help="Numbers of fine-tuned models")
+    parser.add_argument("--examples", type=int, nargs="+", default=[200], help="Numbers of test examples")
+    parser.add_argument("--evaluators", type=int, nargs="+", default=[2], help="Numbers of synthetic evaluators")
+    parser.add_argument("--evaluator-cpu-ms", type=float, default=2.0, help="CPU time of one evaluator per datapoint")
+    parser.add_argument("--prompt-chars", type=int, default=400, help="Length of the test prompts")
+    parser.add_argument("--eval-mode", choices=["sequential", "async", "batch"], default="async",
+                        help="Execution mode of step 3")
+    parser.add_argument("--use-scheduler", action="store_true", help="Run steps 2-4 per experiment")
+    mock_provider.add_arguments(parser)
+    parser.set_defaults(latency_median=0.05)
+    parser.add_argument("--results", type=Path, default=RESULTS_PATH, help="JSONL file the results are appended to")
+    parser.add_argument("--label", default=None, help="Free-form label stored with the results")
+    parser.add_argument("--keep-workspace", action="store_true", help="Keep the temporary workspaces")
+    parser.add_argument("--compare", action="store_true", help="Only compare the stored results")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    parser.add_argument("--child", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+    if args.compare:
+        sys.exit(1 if compare(load_results(args.results), args.threshold) else 0)
+
+    for models, examples, evaluators in itertools.product(args.models, args.examples, args.evaluators):
+        scenario = {
+            "models": models,
+            "examples": examples,
+            "evaluators": evaluators,
+            "evaluator_cpu_ms": args.evaluator_cpu_ms,
+            "prompt_chars": args.prompt_chars,
+            "eval_mode": args.eval_mode,
+            "use_scheduler": args.use_scheduler,
+            "latency": {"distribution": args.latency, "median_s": args.latency_median,
+                        "spread": args.latency_spread, "per_token_s": args.latency_per_token},
+            "error_rate": args.error_rate,
+            "rpm": args.rpm,
+            "tpm": args.tpm,
+            "training_seconds": args.training_seconds,
+            "batch_seconds": args.batch_seconds,
+        }
+        print(f"Scenario {_scenario_label(scenario)}")
+        record = run_scenario(scenario, args)
+        append_result(record, args.results)
+        _print_result(record)
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
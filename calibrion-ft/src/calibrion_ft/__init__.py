@@ -4,6 +4,8 @@ Calibrion Fine-tuning Package
 This package provides tools for fine-tuning and evaluating language models.
 """
 
-from .logging_config import get_logger, setup_logger, configure_package_logging
+from .logging_config import (get_logger, setup_logger, configure_package_logging,
+                             enable_queue_logging, stop_queue_logging)
 
-__all__ = ["get_logger", "setup_logger", "configure_package_logging"]
\ No newline at end of file
+__all__ = ["get_logger", "setup_logger", "configure_package_logging",
+           "enable_queue_logging", "stop_queue_logging"]
\ No newline at end of file
@@ -0,0 +1,327 @@
+"""
+Batch API execution mode for step 3.
+
+The test split is turned into batch request files (one request per datapoint,
+`custom_id` = "datapoint-<id>"), sharded by the provider's per-batch limits,
+and submitted as one batch per shard and fine-tuned model. Finished batches are
+downloaded and mapped back to datapoint IDs, producing the same result schema
+as the per-request path.
+
+Submitted batch IDs are persisted next to the request files, one at a time as the
+batches are created, so an interrupted run polls the existing batches again instead
+of resubmitting (and re-paying for) them. The state is keyed by model and test file
+(path and content hash), and a resumed run only reuses batches of the same test file.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from .finetuning import _chat_completion_request
+from .instrumentation import get_provider_metrics
+from .jsonl_dataset import JsonlDataset
+from .logging_config import setup_logger
+from .rate_limiter import limited_call
+from .response_cache import get_response_cache
+
+logger = setup_logger(log_level=logging.INFO)
+
+BATCH_DIR = Path(__file__).parent / "_batches"
+
+# Provider limits for a single batch input file
+MAX_REQUESTS_PER_BATCH = 50_000
+MAX_BYTES_PER_BATCH = 200 * 1024 * 1024
+
+# Seconds between two status checks of the submitted batches
+BATCH_POLL_INTERVAL = 60
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+SYSTEM_ROLE_CONTENT = "You are a helpful assistant."
+
+
+def _custom_id(datapoint_id: int) -> str:
+    return f"datapoint-{datapoint_id}"
+
+
+def _datapoint_id(custom_id: str) -> int:
+    return int(custom_id.rsplit("-", 1)[1])
+
+
+def _test_file_state(test_file) -> dict:
+    """Return the test file fields of a batch state: resolved path and content hash (from the line index)."""
+    with JsonlDataset(test_file) as dataset:
+        sha256 = dataset.sha256
+    return {"test_file": str(Path(test_file).resolve()), "sha256": sha256}
+
+
+def _state_prefix(ft_model_id: str, test_state: dict) -> str:
+    """File name prefix of the state and shards of a model on a test file."""
+    key = hashlib.sha256(f"{test_state['test_file']}\n{test_state['sha256']}".encode("utf-8")).hexdigest()[:16]
+    return f"{quote(ft_model_id, safe='')}.{key}"
+
+
+def _save_state(state_path: Path, state: dict) -> None:
+    tmp_path = state_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4)
+    tmp_path.replace(state_path)
+
+
+def _load_state(state_path: Path, test_state: dict):
+    """
+    Return the saved batch state of a model, or None if there is none.
+
+    Raises:
+        ValueError: If the state was saved for another test file.
+    """
+    if not state_path.exists():
+        return None
+    with open(state_path, "r") as f:
+        state = json.load(f)
+    if (state.get("test_file"), state.get("sha256")) != (test_state["test_file"], test_state["sha256"]):
+        raise ValueError(f"Batch state {state_path} belongs to test file {state.get('test_file')} "
+                         f"(sha256 {state.get('sha256')}), not {test_state['test_file']} "
+                         f"(sha256 {test_state['sha256']})")
+    return state
+
+
+def _cache_request(ft_model_id: str, example: dict) -> dict:
+    """Request of a test example as seen by the response cache, identical to the per-request path."""
+    return _chat_completion_request(ft_model_id, example["user_prompt"], SYSTEM_ROLE_CONTENT, 0.0, 1)
+
+
+def build_batch_request(ft_model_id: str, example: dict) -> dict:
+    """
+    Build one line of a batch input file for a test example (temperature 0, one response).
+
+    Args:
+        ft_model_id (str): The ID of the fine-tuned model.
+        example (dict): Test example with "datapoint_id" and "user_prompt".
+
+    Returns:
+        dict: The batch request line.
+    """
+    body = _cache_request(ft_model_id, example)
+    body.pop("endpoint")
+    return {
+        "custom_id": _custom_id(example["datapoint_id"]),
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": body,
+    }
+
+
+def write_batch_shards(ft_model_id: str,
+                       examples: list[dict],
+                       batch_dir: Path = BATCH_DIR,
+                       max_requests: int = MAX_REQUESTS_PER_BATCH,
+                       max_bytes: int = MAX_BYTES_PER_BATCH,
+                       prefix: str = None) -> list[Path]:
+    """
+    Write the batch input files of a model, starting a new shard whenever a limit would be exceeded.
+
+    Args:
+        ft_model_id (str): The ID of the fine-tuned model.
+        examples (list[dict]): Test examples to query.
+        batch_dir (Path): Directory for the batch input files.
+        max_requests (int): Maximum number of requests per shard.
+        max_bytes (int): Maximum size of a shard in bytes.
+        prefix (str): File name prefix of the shards. Defaults to the quoted model ID.
+
+    Returns:
+        list[Path]: Paths of the written shards.
+    """
+    batch_dir = Path(batch_dir)
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    model_prefix = prefix or quote(ft_model_id, safe='')
+
+    shard_paths = []
+    shard_file = None
+    shard_requests = shard_bytes = 0
+    try:
+        for example in examples:
+            line = (json.dumps(build_batch_request(ft_model_id, example), ensure_ascii=False) + "\n").encode("utf-8")
+            if shard_file is None or shard_requests >= max_requests or shard_bytes + len(line) > max_bytes:
+                if shard_file is not None:
+                    shard_file.close()
+                shard_paths.append(batch_dir / f"{model_prefix}.shard-{len(shard_paths):04d}.jsonl")
+                shard_file = open(shard_paths[-1], "wb")
+                shard_requests = shard_bytes = 0
+            shard_file.write(line)
+            shard_requests += 1
+            shard_bytes += len(line)
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+
+    logger.info(f"Wrote {len(shard_paths)} batch shard(s) for model {ft_model_id}")
+    return shard_paths
+
+
+def submit_batch(client, shard_path: Path, ft_model_id: str) -> str:
+    """Upload a batch input file, create the batch and return its ID."""
+    # Passed as a path, so that a retried upload reads the file again
+    input_file = limited_call("files.create", None, client.files.with_raw_response.create,
+                              file=shard_path, purpose="batch")
+    batch = limited_call(
+        "batches.create",
+        None,
+        client.batches.with_raw_response.create,
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata={"ft_model_id": ft_model_id, "shard": shard_path.name},
+    )
+    logger.info(f"Submitted batch {batch.id} for model {ft_model_id} ({shard_path.name})")
+    return batch.id
+
+
+def wait_for_batches(client, batch_ids: list[str], poll_interval: float = BATCH_POLL_INTERVAL) -> dict:
+    """
+    Poll batches until all of them reached a terminal status.
+
+    Returns:
+        dict: Mapping of batch ID to its final Batch object.
+    """
+    finished = {}
+    while True:
+        for batch_id in batch_ids:
+            if batch_id in finished:
+                continue
+            batch = limited_call("batches.retrieve", None, client.batches.with_raw_response.retrieve, batch_id)
+            if batch.status in TERMINAL_BATCH_STATUSES:
+                finished[batch_id] = batch
+                log = logger.info if batch.status == "completed" else logger.error
+                log(f"Batch {batch_id} finished with status {batch.status}")
+        if len(finished) == len(batch_ids):
+            return finished
+        logger.info(f"{len(finished)}/{len(batch_ids)} batches finished, checking again in {poll_interval} seconds...")
+        time.sleep(poll_interval)
+
+
+def iter_batch_responses(client, batch):
+    """
+    Yield (datapoint_id, generated response) for every successful request of a batch.
+
+    Failed requests are logged and skipped, so a resumed run queries them again.
+    The token usage of every successful request is recorded (see `instrumentation`).
+    Expired or cancelled batches still yield the requests that completed before.
+    """
+    if batch.error_file_id:
+        for line in limited_call("files.content", None, client.files.with_raw_response.content,
+                                 batch.error_file_id).text.splitlines():
+            if line.strip():
+                error = json.loads(line)
+                logger.warning(f"Batch {batch.id} request {error.get('custom_id')} failed: {error.get('error')}")
+    if not batch.output_file_id:
+        return
+    for line in limited_call("files.content", None, client.files.with_raw_response.content,
+                             batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        output = json.loads(line)
+        response = output.get("response") or {}
+        if output.get("error") or response.get("status_code") != 200:
+            logger.warning(f"Batch {batch.id} request {output.get('custom_id')} failed: "
+                           f"{output.get('error') or response.get('body')}")
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        get_provider_metrics().record("batch",
+                                      body.get("model"),
+                                      prompt_tokens=usage.get("prompt_tokens", 0),
+                                      completion_tokens=usage.get("completion_tokens", 0))
+        yield _datapoint_id(output["custom_id"]), body["choices"][0]["message"]["content"]
+
+
+def eval_run_models_batch(writers: dict,
+                          examples: list[dict],
+                          test_file,
+                          client=None,
+                          batch_dir: Path = BATCH_DIR,
+                          poll_interval: float = BATCH_POLL_INTERVAL) -> None:
+    """
+    Run fine-tuned models on the test dataset through the Batch API.
+
+    Datapoints that already have a result in the model's writer, or whose response is
+    in the response cache, are not submitted. Batch responses are stored in the response
+    cache and written in datapoint_id order.
+
+    Args:
+        writers (dict): Mapping of ft_model_id to the open EvalRunWriter of that model.
+        examples (list[dict]): Test examples with "datapoint_id", "user_prompt" and "expected_response".
+        test_file: Path of the test file the examples were read from; the batch state is keyed by it.
+        client: OpenAI client used for files and batches. Defaults to the shared client of `clients.get_client`;
+            pass a client with a custom `base_url` to run against a local fake endpoint.
+        batch_dir (Path): Directory for batch input files and submitted batch IDs.
+        poll_interval (float): Seconds between two status checks.
+
+    Raises:
+        ValueError: If the test file changed since the batches of a model were submitted.
+    """
+    if client is None:
+        from .clients import get_client
+
+        client = get_client()
+
+    cache = get_response_cache()
+    examples = {example["datapoint_id"]: example for example in examples}
+    batch_dir = Path(batch_dir)
+    test_state = _test_file_state(test_file)
+
+    model_states = {}
+    for ft_model_id, writer in writers.items():
+        prefix = _state_prefix(ft_model_id, test_state)
+        state_path = batch_dir / f"{prefix}.batches.json"
+        state = _load_state(state_path, test_state)
+        if state is not None:
+            logger.info(f"Reusing {len(state['shards'])} batch shard(s) for model {ft_model_id}")
+        else:
+            pending = []
+            for datapoint_id, example in examples.items():
+                if datapoint_id in writer.completed_ids:
+                    continue
+                cached = cache.get(_cache_request(ft_model_id, example))
+                if cached is not None:
+                    writer.write({**example, "generated_response": cached[0]})
+                else:
+                    pending.append(example)
+            if not pending:
+                logger.info(f"No pending datapoints for model {ft_model_id}")
+                continue
+            shard_paths = write_batch_shards(ft_model_id, pending, batch_dir, prefix=prefix)
+            state = {**test_state, "shards": {shard_path.name: None for shard_path in shard_paths}}
+            _save_state(state_path, state)
+
+        # Each batch ID is saved as soon as the batch exists, so that it is never submitted twice
+        for shard_name, batch_id in state["shards"].items():
+            if batch_id is None:
+                state["shards"][shard_name] = submit_batch(client, batch_dir / shard_name, ft_model_id)
+                _save_state(state_path, state)
+        model_states[ft_model_id] = (state_path, list(state["shards"].values()))
+
+    all_batch_ids = [batch_id for _, batch_ids in model_states.values() for batch_id in batch_ids]
+    finished = wait_for_batches(client, all_batch_ids, poll_interval=poll_interval)
+
+    for ft_model_id, (state_path, batch_ids) in model_states.items():
+        writer = writers[ft_model_id]
+        responses = {}
+        for batch_id in batch_ids:
+            responses.update(iter_batch_responses(client, finished[batch_id]))
+        for datapoint_id in sorted(responses):
+            if datapoint_id in writer.completed_ids:
+                continue
+            if datapoint_id not in examples:
+                logger.warning(f"Batch response for unknown datapoint {datapoint_id} of model {ft_model_id}, skipping")
+                continue
+            example = examples[datapoint_id]
+            cache.put(_cache_request(ft_model_id, example), [responses[datapoint_id]])
+            writer.write({**example, "generated_response": responses[datapoint_id]})
+        logger.info(f"Collected {len(responses)} batch responses for model {ft_model_id}")
+        # The batches are consumed; a later run submits new batches for whatever is still missing
+        state_path.unlink()
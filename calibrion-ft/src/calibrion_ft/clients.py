@@ -0,0 +1,125 @@
+"""
+Lazily built OpenAI clients shared by all pipeline steps.
+
+No credentials are read and the `openai` package is not imported until a client is
+first requested, so importing the package works without secrets. Both clients use the
+pooled HTTP transport of `transport.py` and are built with `max_retries=0`: failed calls
+are retried by `rate_limiter.py`, which also keeps them within the provider's rate limits.
+The API key is taken from the first available source:
+
+1. the key passed to `configure_clients(api_key=...)`
+2. the OPENAI_API_KEY environment variable
+3. the JSON file named by the CALIBRION_OPENAI_KEY_FILE environment variable
+4. `secrets/openai_api_key.json` relative to the working directory
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import weakref
+from pathlib import Path
+from typing import Optional
+
+from .logging_config import setup_logger
+from .transport import build_async_http_client, build_http_client
+
+logger = setup_logger(log_level=logging.INFO)
+
+API_KEY_ENV_VAR = "OPENAI_API_KEY"
+CREDENTIALS_FILE_ENV_VAR = "CALIBRION_OPENAI_KEY_FILE"
+DEFAULT_CREDENTIALS_PATH = Path("secrets/openai_api_key.json")
+
+# Client options that `configure_clients` can override
+DEFAULT_CLIENT_KWARGS = {"max_retries": 0}
+
+_lock = threading.Lock()
+_client = None
+# One async client per event loop: its connections are bound to the loop they were opened in
+_async_clients = weakref.WeakKeyDictionary()
+_api_key: Optional[str] = None
+_client_kwargs: dict = {}
+
+
+def _read_credentials_file(path: Path) -> Optional[str]:
+    with open(path, "r") as f:
+        return json.load(f).get("openai_api_key")
+
+
+def load_api_key() -> str:
+    """
+    Return the OpenAI API key from the first configured credential source.
+
+    Raises:
+        ValueError: If no source provides a key.
+    """
+    if _api_key:
+        return _api_key
+    if os.environ.get(API_KEY_ENV_VAR):
+        return os.environ[API_KEY_ENV_VAR]
+    credentials_path = os.environ.get(CREDENTIALS_FILE_ENV_VAR)
+    if credentials_path:
+        return _read_credentials_file(Path(credentials_path))
+    if DEFAULT_CREDENTIALS_PATH.exists():
+        return _read_credentials_file(DEFAULT_CREDENTIALS_PATH)
+    raise ValueError(f"No OpenAI API key found: set {API_KEY_ENV_VAR}, point {CREDENTIALS_FILE_ENV_VAR} "
+                     f"to a JSON file with an 'openai_api_key' entry, or create {DEFAULT_CREDENTIALS_PATH}")
+
+
+def configure_clients(api_key: Optional[str] = None, **client_kwargs) -> None:
+    """
+    Set the API key and client options (e.g. `base_url`) used for the shared clients.
+    Retries are left to `rate_limiter` unless `max_retries` is passed here. Clients built
+    before are discarded and rebuilt on next use. Connection pool and timeout settings
+    belong to `transport.configure_transport`.
+
+    Args:
+        api_key (str, optional): API key overriding the environment and credential files.
+        **client_kwargs: Keyword arguments passed to `OpenAI` and `AsyncOpenAI`.
+    """
+    global _api_key, _client_kwargs
+    with _lock:
+        _api_key = api_key
+        _client_kwargs = client_kwargs
+    reset_clients()
+
+
+def reset_clients() -> None:
+    """Close and discard the shared clients; they are rebuilt on next use."""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+        # Async clients are bound to the event loop they were used in and are left to the garbage collector
+        _client = None
+        _async_clients.clear()
+
+
+def get_client():
+    """Return the shared `OpenAI` client, building it on first use."""
+    global _client
+    with _lock:
+        if _client is None:
+            from openai import OpenAI
+
+            _client = OpenAI(api_key=load_api_key(), **{"http_client": build_http_client(), **DEFAULT_CLIENT_KWARGS, **_client_kwargs})
+            logger.debug("Created OpenAI client")
+        return _client
+
+
+def get_async_client():
+    """
+    Return the `AsyncOpenAI` client shared by all coroutines of the running event loop,
+    building it on first use in that loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_clients:
+            from openai import AsyncOpenAI
+
+            _async_clients[loop] = AsyncOpenAI(api_key=load_api_key(),
+                                               **{"http_client": build_async_http_client(), **DEFAULT_CLIENT_KWARGS,
+                                                  **_client_kwargs})
+            logger.debug("Created AsyncOpenAI client")
+        return _async_clients[loop]
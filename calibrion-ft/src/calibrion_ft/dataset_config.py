@@ -1,56 +1,225 @@
 from pathlib import Path
+import json
+import logging
+import os
+import threading
 import yaml
 from typing import Dict, Optional
+from .jsonl_dataset import JsonlDataset
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+VIEWS_DIR = Path(__file__).parents[2] / "training_datasets/views"
+VERSIONS_FILE = VIEWS_DIR / "versions.yaml"
+
+# Suffix of the metadata file cached next to each split file
+SPLIT_METADATA_SUFFIX = ".meta.json"
+
+
+def _file_signature(path: Path) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def compute_split_metadata(path: Path, previous: Optional[dict] = None) -> dict:
+    """
+    Return the size, line count, SHA-256 and chat statistics of a split file. The byte offset
+    of every line is kept in the split's `JsonlDataset` index (`<split file>.idx`), which is
+    built here if needed; the SHA-256 is computed during the same scan.
+
+    Args:
+        path (Path): Path of the split file (JSONL).
+        previous (dict, optional): Earlier metadata of the file. Its chat statistics are reused
+            if the content hash did not change, e.g. when only the modification time changed.
+
+    Returns:
+        dict: {"path", "mtime_ns", "size", "line_count", "sha256", "index_path", "chat_stats"},
+        where "chat_stats" are the `JsonlDataset.chat_stats` of the file.
+    """
+    path = Path(path)
+    mtime_ns, size = _file_signature(path)
+    with JsonlDataset(path) as dataset:
+        line_count = len(dataset)
+        index_path = dataset.index_path
+        sha256 = dataset.sha256
+        if previous and previous.get("sha256") == sha256 and "chat_stats" in previous:
+            chat_stats = previous["chat_stats"]
+        else:
+            chat_stats = dataset.chat_stats()
+    return {
+        "path": str(path),
+        "mtime_ns": mtime_ns,
+        "size": size,
+        "line_count": line_count,
+        "sha256": sha256,
+        "index_path": str(index_path),
+        "chat_stats": chat_stats,
+    }
+
+
+class DatasetRegistry:
+    """
+    Dataset versions of a versions.yaml, parsed once and indexed by version.
+
+    The YAML file is parsed again only when its modification time or size changes.
+    Split metadata (line count, content hash, chat statistics) is computed once per split file
+    and cached next to it in `<split file>.meta.json`; line offsets are in the split's `JsonlDataset` index.
+
+    Args:
+        versions_file (Path): Path of the versions.yaml file.
+        views_dir (Path): Directory containing the dataset folders.
+    """
+
+    def __init__(self, versions_file: Path = VERSIONS_FILE, views_dir: Path = VIEWS_DIR):
+        self.versions_file = Path(versions_file)
+        self.views_dir = Path(views_dir)
+        self._signature = None
+        self._by_version = {}
+        self._split_metadata = {}
+        self._lock = threading.RLock()
+
+    def _index(self) -> dict:
+        with self._lock:
+            signature = _file_signature(self.versions_file)
+            if signature != self._signature:
+                with open(self.versions_file, 'r') as f:
+                    versions_data = yaml.safe_load(f)
+                self._by_version = {dataset['version']: dataset for dataset in versions_data['datasets']}
+                self._signature = signature
+                logger.debug(f"Loaded {len(self._by_version)} dataset versions from {self.versions_file}")
+            return self._by_version
+
+    def versions(self) -> list[str]:
+        """Return all dataset versions, in file order."""
+        return list(self._index())
+
+    def get(self, version: str) -> Dict:
+        """
+        Get dataset configuration for a specific version.
+
+        Raises:
+            ValueError: If the version does not exist.
+        """
+        index = self._index()
+        if version not in index:
+            raise ValueError(f"Dataset version {version} not found in versions.yaml")
+        return index[version]
+
+    def split_path(self, version: str, split: str) -> Optional[Path]:
+        """Return the local path of a split ("training" or "test"), or None if the version has no such split."""
+        dataset = self.get(version)
+        split_data = dataset['splits'].get(split)
+        if not split_data:
+            return None
+        # Dots in folder and file names are stored as underscores, except for the extension
+        folder_name = dataset['folder'].replace('.', '_')
+        name, ext = split_data['file'].rsplit('.', 1)
+        return self.views_dir / folder_name / f"{name.replace('.', '_')}.{ext}"
+
+    def files(self, version: str) -> tuple[str, Optional[str], str, Optional[str]]:
+        """Return (training_file, test_file, training_file_oai_id, test_file_oai_id) of a version."""
+        dataset = self.get(version)
+        train_data = dataset['splits']['training']
+        test_data = dataset['splits'].get('test', {})
+        test_path = self.split_path(version, 'test')
+        return (
+            str(self.split_path(version, 'training')),
+            str(test_path) if test_path else None,
+            train_data.get('cloud', {}).get('file_id'),
+            test_data.get('cloud', {}).get('file_id') if test_data else None
+        )
+
+    def split_metadata(self, version: str, split: str) -> dict:
+        """
+        Return the metadata of a split file, see `file_metadata`.
+
+        Raises:
+            ValueError: If the version has no such split.
+        """
+        path = self.split_path(version, split)
+        if path is None:
+            raise ValueError(f"Dataset version {version} has no {split} split")
+        return self.file_metadata(path)
+
+    def file_metadata(self, path: Path) -> dict:
+        """
+        Return the metadata of a dataset file, see `compute_split_metadata`.
+
+        The result is cached in memory and in `<file>.meta.json`, and recomputed when the
+        file's modification time or size changes (chat statistics only if its content did).
+        """
+        with self._lock:
+            path = Path(path)
+            signature = _file_signature(path)
+
+            cached = self._split_metadata.get(path)
+            if cached and (cached["mtime_ns"], cached["size"]) == signature:
+                return cached
+
+            sidecar = path.with_name(path.name + SPLIT_METADATA_SUFFIX)
+            metadata = previous = None
+            if sidecar.exists():
+                try:
+                    with open(sidecar, 'r') as f:
+                        previous = json.load(f)
+                    if (previous["mtime_ns"], previous["size"]) == signature and "chat_stats" in previous:
+                        metadata = previous
+                except (ValueError, KeyError):
+                    previous = None
+            if metadata is None:
+                logger.info(f"Computing metadata of {path}")
+                metadata = compute_split_metadata(path, previous)
+                try:
+                    tmp_path = sidecar.with_suffix(".tmp")
+                    with open(tmp_path, 'w') as f:
+                        json.dump(metadata, f)
+                    tmp_path.replace(sidecar)
+                except OSError as e:
+                    logger.warning(f"Could not write split metadata {sidecar}: {str(e)}")
+
+            self._split_metadata[path] = metadata
+            return metadata
+
+    def split_dataset(self, version: str, split: str) -> JsonlDataset:
+        """Return a random-access `JsonlDataset` of a split file. The caller closes it."""
+        path = self.split_path(version, split)
+        if path is None:
+            raise ValueError(f"Dataset version {version} has no {split} split")
+        return JsonlDataset(path)
+
+
+_dataset_registry: Optional[DatasetRegistry] = None
+
+
+def get_dataset_registry() -> DatasetRegistry:
+    """Return the process-wide dataset registry of VERSIONS_FILE."""
+    global _dataset_registry
+    if _dataset_registry is None:
+        _dataset_registry = DatasetRegistry()
+    return _dataset_registry
+
 
 def get_dataset_config(version: str) -> Dict:
     """
     Get dataset configuration for a specific version from versions.yaml.
-    
+
     Args:
         version (str): Dataset version (e.g., '1.1.small')
-        
+
     Returns:
         dict: Dataset configuration including file paths and cloud IDs
     """
-    versions_file = Path(__file__).parents[2] / "training_datasets/views/versions.yaml"
-    
-    with open(versions_file, 'r') as f:
-        versions_data = yaml.safe_load(f)
-    
-    for dataset in versions_data['datasets']:
-        if dataset['version'] == version:
-            return dataset
-            
-    raise ValueError(f"Dataset version {version} not found in versions.yaml")
+    return get_dataset_registry().get(version)
 
 def get_dataset_files(version: str) -> tuple[str, Optional[str], str, Optional[str]]:
     """
     Get training and test file information for a dataset version.
-    
+
     Args:
         version (str): Dataset version
-        
+
     Returns:
         tuple: (training_file, test_file, training_file_oai_id, test_file_oai_id)
     """
-    dataset = get_dataset_config(version)
-    folder_name = dataset['folder'].replace('.', '_')
-    base_path = Path(__file__).parents[2] / "training_datasets/views" / folder_name
-    
-    train_data = dataset['splits']['training']
-    test_data = dataset['splits'].get('test', {})
-    
-    def convert_filename(filename: str) -> str:
-        """Convert only the filename part, preserving extension"""
-        name, ext = filename.rsplit('.', 1)
-        return f"{name.replace('.', '_')}.{ext}"
-    
-    train_file = convert_filename(train_data['file'])
-    test_file = convert_filename(test_data['file']) if test_data else None
-    
-    return (
-        str(base_path / train_file),
-        str(base_path / test_file) if test_file else None,
-        train_data.get('cloud', {}).get('file_id'),
-        test_data.get('cloud', {}).get('file_id') if test_data else None
-    )
+    return get_dataset_registry().files(version)
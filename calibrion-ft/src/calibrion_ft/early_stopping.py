@@ -0,0 +1,362 @@
+"""
+Sequential early stopping of step 3 for models that are clearly behind.
+
+Instead of running every model on the whole test split and scoring afterwards, inference
+and scoring interleave: all models are queried on the same examples in rounds of
+`round_size`, and the results of a round are scored with the step 4 evaluators while the
+next round is queried. Every model keeps a running estimate of its error rate (the share
+of scored datapoints with at least one error) with a confidence interval, either the
+Wilson score interval or the distribution-free Hoeffding interval.
+
+A model is stopped once it has `min_samples` scored datapoints and the lower bound of its
+error rate is above the upper bound of the best model (the lowest upper bound among the
+models with `min_samples` datapoints). Since the intervals are looked at after every round
+and for every model, each look does not get the full `1 - confidence` error budget: look k
+uses `(1 - confidence) * 6 / (pi^2 * k^2)`, split evenly between the models (Bonferroni).
+These shares sum to at most `1 - confidence` over any number of looks, so the chance that
+any interval of the run misses its error rate, and with it the chance of stopping a model
+that is not behind, stays below `1 - confidence`. No further requests are sent for a stopped model;
+since the next round is already in flight when a round is scored, a model is queried on at
+most one round after the round that showed it to be dominated.
+
+Scored results go to the evaluator result cache, so step 4 does not evaluate them again.
+The outcome per model, including `stopped_early` and the number of examples it saw, is
+written to `_ft_models_eval_runs/_early_stopping.json` after every round and logged to W&B
+by step 4.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import threading
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass
+from itertools import islice
+from pathlib import Path
+from statistics import NormalDist
+from typing import Optional
+
+from .eval_run_store import EVAL_RUNS_DIR, EvalRunWriter, iter_eval_run_results
+from .evaluation.aggregation import error_categories
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+EARLY_STOPPING_PATH = EVAL_RUNS_DIR / "_early_stopping.json"
+
+BOUNDS = ("wilson", "hoeffding")
+
+DEFAULT_CONFIDENCE = 0.95
+# Scored datapoints a model needs before it can be stopped or serve as the best model
+DEFAULT_MIN_SAMPLES = 200
+# Examples queried per model between two stopping decisions
+DEFAULT_ROUND_SIZE = 100
+
+
+def wilson_interval(errors: int, n: int, confidence: float = DEFAULT_CONFIDENCE) -> tuple[float, float]:
+    """Return the Wilson score interval of an error rate of `errors` out of `n` at the given confidence."""
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = errors / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def hoeffding_interval(errors: int, n: int, confidence: float = DEFAULT_CONFIDENCE) -> tuple[float, float]:
+    """Return the Hoeffding interval of an error rate of `errors` out of `n` at the given confidence."""
+    if n == 0:
+        return 0.0, 1.0
+    p = errors / n
+    half_width = math.sqrt(math.log(2 / (1 - confidence)) / (2 * n))
+    return max(0.0, p - half_width), min(1.0, p + half_width)
+
+
+@dataclass
+class EarlyStopping:
+    """
+    Settings of sequential early stopping, passed to `run_pipeline` or `eval_run_all_fted_models`.
+
+    Args:
+        confidence: Confidence level of the error rate intervals, e.g. 0.95.
+        min_samples: Scored datapoints a model needs before it can be stopped.
+        round_size: Examples queried per model between two stopping decisions.
+        bound: "wilson" (Wilson score interval) or "hoeffding" (Hoeffding's inequality,
+            wider but free of distribution assumptions).
+    """
+    confidence: float = DEFAULT_CONFIDENCE
+    min_samples: int = DEFAULT_MIN_SAMPLES
+    round_size: int = DEFAULT_ROUND_SIZE
+    bound: str = "wilson"
+
+    def __post_init__(self):
+        if not 0 < self.confidence < 1:
+            raise ValueError(f"Confidence must be between 0 and 1, got {self.confidence}")
+        if self.bound not in BOUNDS:
+            raise ValueError(f"Unknown bound {self.bound}, expected one of {BOUNDS}")
+        if self.min_samples < 1 or self.round_size < 1:
+            raise ValueError("min_samples and round_size must be positive")
+
+    def interval(self, errors: int, n: int, confidence: float = None) -> tuple[float, float]:
+        """Return the interval of an error rate at `confidence`, by default the configured confidence level."""
+        bound = wilson_interval if self.bound == "wilson" else hoeffding_interval
+        return bound(errors, n, confidence or self.confidence)
+
+    def look_confidence(self, look: int, models: int) -> float:
+        """Return the confidence level of every interval at stopping decision number `look` (from 1) between `models` models."""
+        return 1 - (1 - self.confidence) * 6 / (math.pi ** 2 * look ** 2 * models)
+
+
+class EarlyStoppingMonitor:
+    """
+    Running error rate estimates of several models and the stopping decisions between them.
+
+    The monitor is shared between the event loop that queries the models and the thread that
+    scores a round, so its state is only read and changed under a lock.
+
+    Args:
+        ft_model_ids: The models that are compared.
+        settings: Confidence level, minimum sample size and bound.
+    """
+
+    def __init__(self, ft_model_ids: list[str], settings: EarlyStopping):
+        self.settings = settings
+        self.examples_seen = dict.fromkeys(ft_model_ids, 0)
+        self.scored = dict.fromkeys(ft_model_ids, 0)
+        self.errors = dict.fromkeys(ft_model_ids, 0)
+        self.stopped = {}
+        # Stopping decisions made so far, each one a look at the intervals of all models
+        self.looks = 0
+        self._lock = threading.RLock()
+
+    def add_seen(self, ft_model_id: str, count: int) -> None:
+        """Count examples of a model that have a response, whether or not they can be scored."""
+        with self._lock:
+            self.examples_seen[ft_model_id] += count
+
+    def add(self, ft_model_id: str, has_error: bool) -> None:
+        """Add one scored datapoint of a model."""
+        with self._lock:
+            self.scored[ft_model_id] += 1
+            self.errors[ft_model_id] += int(has_error)
+
+    def confidence(self) -> float:
+        """Return the confidence level of the intervals at the latest look (the first look before any)."""
+        return self.settings.look_confidence(max(self.looks, 1), len(self.scored))
+
+    def interval(self, ft_model_id: str) -> tuple[float, float]:
+        with self._lock:
+            return self.settings.interval(self.errors[ft_model_id], self.scored[ft_model_id], self.confidence())
+
+    def active(self) -> list[str]:
+        """Return the models that are still queried."""
+        with self._lock:
+            return [ft_model_id for ft_model_id in self.scored if ft_model_id not in self.stopped]
+
+    def best(self) -> Optional[str]:
+        """Return the model with the lowest upper bound among those with `min_samples` scored datapoints."""
+        with self._lock:
+            candidates = [ft_model_id for ft_model_id, n in self.scored.items() if n >= self.settings.min_samples]
+            return min(candidates, key=lambda ft_model_id: self.interval(ft_model_id)[1], default=None)
+
+    def update(self) -> list[str]:
+        """
+        Stop every active model that is dominated by the best model.
+
+        Every call that can stop a model (some model has `min_samples` scored datapoints) counts
+        as a look and narrows the confidence budget of the following ones, see `EarlyStopping.look_confidence`.
+
+        Returns:
+            list[str]: The models stopped by this call.
+        """
+        with self._lock:
+            if not any(n >= self.settings.min_samples for n in self.scored.values()):
+                return []
+            self.looks += 1
+            best = self.best()
+            best_upper = self.interval(best)[1]
+            newly_stopped = []
+            for ft_model_id in self.active():
+                if ft_model_id == best or self.scored[ft_model_id] < self.settings.min_samples:
+                    continue
+                lower = self.interval(ft_model_id)[0]
+                if lower > best_upper:
+                    self.stopped[ft_model_id] = best
+                    newly_stopped.append(ft_model_id)
+                    logger.info(f"Stopping model {ft_model_id} after {self.examples_seen[ft_model_id]} examples: "
+                                f"error rate {self.errors[ft_model_id] / self.scored[ft_model_id]:.3f} "
+                                f"(lower bound {lower:.3f}) is above the upper bound {best_upper:.3f} of {best} "
+                                f"at look {self.looks} (confidence {self.confidence():.5f})")
+            return newly_stopped
+
+    def status(self, ft_model_id: str) -> dict:
+        """Return the outcome of one model as stored in `_early_stopping.json`."""
+        with self._lock:
+            return self._status(ft_model_id)
+
+    def _status(self, ft_model_id: str) -> dict:
+        n = self.scored[ft_model_id]
+        lower, upper = self.interval(ft_model_id)
+        return {
+            "stopped_early": ft_model_id in self.stopped,
+            "examples_seen": self.examples_seen[ft_model_id],
+            "examples_scored": n,
+            "errors": self.errors[ft_model_id],
+            "error_rate": self.errors[ft_model_id] / n if n else None,
+            "error_rate_lower": lower,
+            "error_rate_upper": upper,
+            "interval_confidence": self.confidence(),
+            "dominated_by": self.stopped.get(ft_model_id),
+        }
+
+    def write(self, path: Path = EARLY_STOPPING_PATH) -> None:
+        """Write the settings and the status of every model, keeping the entries of other models in the file."""
+        path = Path(path)
+        statuses = load_early_stopping_status(path)
+        with self._lock:
+            statuses.update({ft_model_id: self._status(ft_model_id) for ft_model_id in self.scored})
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"settings": asdict(self.settings), "models": statuses}, f, indent=4)
+        tmp_path.replace(path)
+
+
+def load_early_stopping_status(path: Path = EARLY_STOPPING_PATH) -> dict:
+    """Return the early stopping status of every model in `_early_stopping.json`, or {} if there is none."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)["models"]
+
+
+def _has_error(result: dict, evaluator_registry) -> bool:
+    return any(count > 0 for count in error_categories(result, evaluator_registry).values())
+
+
+def _score_round(round_results: dict, evaluator_registry, monitor: EarlyStoppingMonitor, last: bool) -> None:
+    from .step_4_run_evaluation import iter_scored_datapoints
+
+    for ft_model_id, results in round_results.items():
+        monitor.add_seen(ft_model_id, len(results))
+        for _, result in iter_scored_datapoints(results, evaluator_registry):
+            monitor.add(ft_model_id, _has_error(result, evaluator_registry))
+    # After the last round there is nothing left to save by stopping a model
+    if not last:
+        monitor.update()
+    monitor.write()
+
+
+async def _run_rounds(writers: dict,
+                      examples,
+                      previous_results: dict,
+                      evaluator_registry,
+                      monitor: EarlyStoppingMonitor,
+                      max_concurrency: int,
+                      max_concurrency_per_model: int) -> None:
+    from .step_3_eval_run_ft_models import query_examples_async
+
+    loop = asyncio.get_running_loop()
+    global_semaphore = asyncio.Semaphore(max_concurrency)
+    scoring = None
+    round_number = 0
+    next_examples = list(islice(examples, monitor.settings.round_size))
+    while next_examples:
+        round_examples = next_examples
+        active = monitor.active()
+        if not active:
+            break
+        next_examples = list(islice(examples, monitor.settings.round_size))
+        round_number += 1
+
+        round_results = {}
+        queries = []
+        for ft_model_id in active:
+            previous = previous_results[ft_model_id]
+            # Results of an interrupted run are scored again (from the evaluator cache) instead of re-queried
+            results = [previous[example["datapoint_id"]] for example in round_examples
+                       if example["datapoint_id"] in previous]
+            round_results[ft_model_id] = results
+
+            def on_result(result: dict, writer=writers[ft_model_id], results=results) -> None:
+                writer.write(result)
+                results.append(result)
+
+            queries.append(query_examples_async(ft_model_id,
+                                                [example for example in round_examples
+                                                 if example["datapoint_id"] not in previous],
+                                                global_semaphore,
+                                                on_result,
+                                                max_concurrency_per_model=max_concurrency_per_model))
+        await asyncio.gather(*queries)
+
+        # Round n is scored while round n + 1 is queried
+        if scoring is not None:
+            await scoring
+        scoring = loop.run_in_executor(None, _score_round, round_results, evaluator_registry, monitor,
+                                       not next_examples)
+        logger.info(f"Early stopping round {round_number}: {len(active)} model(s) queried on "
+                    f"{len(round_examples)} examples")
+    if scoring is not None:
+        await scoring
+
+
+def eval_run_fted_models_early_stopping(ft_model_ids: list[str],
+                                        test_file: str,
+                                        settings: EarlyStopping = None,
+                                        evaluator_registry=None,
+                                        max_concurrency: int = None,
+                                        max_concurrency_per_model: int = None,
+                                        resume: bool = True) -> dict:
+    """
+    Run the fine-tuned models on the test split in rounds and stop the ones that are clearly behind.
+
+    Results are appended to the JSONL file of every model (see `eval_run_store`) as they
+    arrive, like in the other modes of step 3.
+
+    Args:
+        ft_model_ids (list[str]): IDs of the fine-tuned models to compare.
+        test_file (str): Path to the test dataset file.
+        settings (EarlyStopping): Confidence level, minimum sample size, round size and bound.
+        evaluator_registry: Evaluators used for scoring. Defaults to the evaluators of step 4.
+        max_concurrency (int): Maximum number of in-flight requests across all models.
+        max_concurrency_per_model (int): Maximum number of in-flight requests per model.
+        resume (bool): Keep existing results; they are scored again instead of re-queried.
+
+    Returns:
+        dict: Mapping of ft_model_id to its status, see `EarlyStoppingMonitor.status`.
+    """
+    from .jsonl_dataset import JsonlDataset
+    from .step_3_eval_run_ft_models import DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY_PER_MODEL
+    from .step_4_run_evaluation import SKIP_EVALUATORS, get_evaluator_registry
+
+    settings = settings or EarlyStopping()
+    if evaluator_registry is None:
+        evaluator_registry = get_evaluator_registry(exclude=SKIP_EVALUATORS)
+    monitor = EarlyStoppingMonitor(ft_model_ids, settings)
+    logger.info(f"Starting evaluation of {len(ft_model_ids)} model(s) with early stopping ({settings.bound} bound, "
+                f"confidence {settings.confidence}, at least {settings.min_samples} samples)")
+
+    with JsonlDataset(test_file) as dataset, ExitStack() as stack:
+        writers = {ft_model_id: stack.enter_context(EvalRunWriter(ft_model_id, resume=resume))
+                   for ft_model_id in ft_model_ids}
+        previous_results = {ft_model_id: {result["datapoint_id"]: result
+                                          for result in iter_eval_run_results(ft_model_id)} if resume else {}
+                            for ft_model_id in ft_model_ids}
+        asyncio.run(_run_rounds(writers,
+                                dataset.iter_examples(),
+                                previous_results,
+                                evaluator_registry,
+                                monitor,
+                                max_concurrency=max_concurrency or DEFAULT_MAX_CONCURRENCY,
+                                max_concurrency_per_model=max_concurrency_per_model or DEFAULT_MAX_CONCURRENCY_PER_MODEL))
+
+    statuses = {ft_model_id: monitor.status(ft_model_id) for ft_model_id in ft_model_ids}
+    stopped = [ft_model_id for ft_model_id, status in statuses.items() if status["stopped_early"]]
+    logger.info(f"Early stopping: {len(stopped)} of {len(ft_model_ids)} model(s) stopped, "
+                f"{sum(status['examples_seen'] for status in statuses.values())} examples queried in total")
+    return statuses
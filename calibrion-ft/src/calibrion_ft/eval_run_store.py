@@ -0,0 +1,185 @@
+"""
+Append-only JSONL storage for step 3 evaluation runs.
+
+Every fine-tuned model gets its own JSONL file in `_ft_models_eval_runs/`.
+Each line is one datapoint result with the same schema as the entries of the
+former `_ft_models_eval_runs.json`:
+
+    {"datapoint_id": 1, "user_prompt": "...", "expected_response": "...", "generated_response": "..."}
+
+Results are appended as soon as they arrive, so an interrupted run can be
+resumed by skipping the datapoint IDs that are already on disk.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import quote, unquote
+
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+EVAL_RUNS_DIR = Path(__file__).parent / "_ft_models_eval_runs"
+
+# Results are flushed after every write but fsynced only every this many writes
+FSYNC_EVERY = 50
+
+
+def eval_run_path(ft_model_id: str, runs_dir: Path = EVAL_RUNS_DIR) -> Path:
+    """Return the JSONL file of a fine-tuned model. Model IDs are percent-encoded (they contain ':')."""
+    return Path(runs_dir) / f"{quote(ft_model_id, safe='')}.jsonl"
+
+
+def list_eval_run_models(runs_dir: Path = EVAL_RUNS_DIR) -> list[str]:
+    """Return the IDs of all fine-tuned models that have an evaluation run file, sorted."""
+    runs_dir = Path(runs_dir)
+    if not runs_dir.exists():
+        return []
+    return sorted(unquote(path.stem) for path in runs_dir.glob("*.jsonl"))
+
+
+def _iter_lines(path: Path) -> Iterator[tuple[int, dict]]:
+    """Yield the byte offset and the parsed result of every complete line of a run file, in file order."""
+    with open(path, "rb") as f:
+        line_number = 0
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                return
+            line_number += 1
+            if not line.endswith(b"\n"):
+                logger.warning(f"Ignoring incomplete line {line_number} in {path}")
+                return
+            yield offset, json.loads(line)
+
+
+def iter_eval_run_results(ft_model_id: str, runs_dir: Path = EVAL_RUNS_DIR) -> Iterator[dict]:
+    """
+    Stream the datapoint results of a fine-tuned model, sorted by datapoint_id.
+
+    Results are appended in completion order, which differs from datapoint order when
+    queries run concurrently. The file is first indexed (datapoint_id and byte offset of
+    every line), then read in datapoint order, so only the index is held in memory.
+    A truncated last line, left behind by a crash in the middle of a write, is ignored.
+
+    Args:
+        ft_model_id (str): The ID of the fine-tuned model.
+        runs_dir (Path): Directory containing the evaluation run files.
+
+    Yields:
+        dict: One datapoint result per line.
+    """
+    path = eval_run_path(ft_model_id, runs_dir)
+    if not path.exists():
+        return
+    index = [(result["datapoint_id"], offset) for offset, result in _iter_lines(path)]
+    index.sort()
+    with open(path, "rb") as f:
+        for _, offset in index:
+            if f.tell() != offset:
+                f.seek(offset)
+            yield json.loads(f.readline())
+
+
+def load_eval_run_results(ft_model_id: str, runs_dir: Path = EVAL_RUNS_DIR) -> list[dict]:
+    """Load all datapoint results of a fine-tuned model, sorted by datapoint_id."""
+    return list(iter_eval_run_results(ft_model_id, runs_dir))
+
+
+def completed_datapoint_ids(ft_model_id: str, runs_dir: Path = EVAL_RUNS_DIR) -> set[int]:
+    """Return the datapoint IDs that already have a result for a fine-tuned model."""
+    path = eval_run_path(ft_model_id, runs_dir)
+    if not path.exists():
+        return set()
+    return {res["datapoint_id"] for _, res in _iter_lines(path)}
+
+
+class EvalRunWriter:
+    """
+    Append-only writer for the results of one fine-tuned model.
+
+    Use as a context manager. On open, a truncated last line from a previous crash
+    is removed, so appended results always start on a fresh line.
+
+    Args:
+        ft_model_id: The ID of the fine-tuned model.
+        runs_dir: Directory containing the evaluation run files.
+        resume: Keep existing results and append to them. If False, the file is truncated.
+        fsync_every: Number of writes between two fsync calls.
+    """
+
+    def __init__(self,
+                 ft_model_id: str,
+                 runs_dir: Path = EVAL_RUNS_DIR,
+                 resume: bool = True,
+                 fsync_every: int = FSYNC_EVERY):
+        self.ft_model_id = ft_model_id
+        self.path = eval_run_path(ft_model_id, runs_dir)
+        self.resume = resume
+        self.fsync_every = fsync_every
+        self.completed_ids: set[int] = set()
+        self._file = None
+        self._unsynced = 0
+
+    def __enter__(self) -> "EvalRunWriter":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.resume and self.path.exists():
+            self._drop_incomplete_line()
+            self.completed_ids = completed_datapoint_ids(self.ft_model_id, self.path.parent)
+            if self.completed_ids:
+                logger.info(f"Resuming model {self.ft_model_id}: {len(self.completed_ids)} datapoints already done")
+            self._file = open(self.path, "a", encoding="utf-8")
+        else:
+            self._file = open(self.path, "w", encoding="utf-8")
+
+    def _drop_incomplete_line(self) -> None:
+        with open(self.path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b"\n":
+                return
+            # Scan backwards for the last complete line
+            position = end
+            while position > 0:
+                chunk_start = max(0, position - 65536)
+                f.seek(chunk_start)
+                newline = f.read(position - chunk_start).rfind(b"\n")
+                if newline != -1:
+                    position = chunk_start + newline + 1
+                    break
+                position = chunk_start
+            f.truncate(position)
+            logger.warning(f"Removed incomplete trailing line from {self.path}")
+
+    def write(self, result: dict) -> None:
+        """Append one datapoint result and flush it to the OS."""
+        self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.completed_ids.add(result["datapoint_id"])
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self._fsync()
+
+    def _fsync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            self._fsync()
+            self._file.close()
+            self._file = None
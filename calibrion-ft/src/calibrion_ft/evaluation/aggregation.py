@@ -0,0 +1,176 @@
+"""
+Streaming aggregation of evaluator results.
+
+Evaluator results are folded into plain counters per error category as they arrive,
+instead of building a DataFrame per datapoint. Per-datapoint counts are kept column-wise
+(one list per category) for drill-down, and DataFrames are only built once at the end.
+"""
+
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from ..logging_config import setup_logger
+from .registry import EvaluatorRegistry
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = setup_logger(log_level=logging.INFO)
+
+DATAPOINT_ID_COLUMN = "datapoint_id"
+
+
+def error_categories(result: dict, evaluator_registry: dict) -> Counter:
+    """
+    Return the error counts per category of the results of all evaluators on one datapoint.
+
+    Only plain dicts are involved, so folding a datapoint never builds a DataFrame.
+
+    Args:
+        result (dict): Evaluator name to result dictionary, as returned by `run_evaluators`.
+        evaluator_registry (dict): The evaluators that produced the results, an `EvaluatorRegistry`
+            (whose evaluators are not instantiated here) or a dict of evaluator instances.
+    """
+    counts = Counter()
+    for name, evaluator_result in result.items():
+        if isinstance(evaluator_registry, EvaluatorRegistry):
+            evaluator = evaluator_registry.evaluator_class(name)
+        else:
+            evaluator = evaluator_registry[name]
+        counts.update(evaluator.error_categories(evaluator_result, name))
+    return counts
+
+
+class ErrorAggregator:
+    """
+    Aggregate the error categories of evaluator results, datapoint by datapoint.
+
+    Categories come from `error_categories()`, and are kept in the order they first appear.
+    A category that first appears late is backfilled with zeros for the datapoints seen before it.
+
+    Args:
+        evaluator_registry (dict): The evaluators whose results are aggregated, see `error_categories`.
+    """
+
+    def __init__(self, evaluator_registry: dict):
+        self.evaluator_registry = evaluator_registry
+        self.totals = Counter()
+        self.num_datapoints = 0
+        self._columns = {DATAPOINT_ID_COLUMN: []}
+
+    def add(self, datapoint_id, result: dict) -> None:
+        """
+        Fold the results of all evaluators on one datapoint into the counters.
+
+        Args:
+            datapoint_id: ID of the datapoint.
+            result (dict): Evaluator name to result dictionary, as returned by `run_evaluators`.
+        """
+        counts = error_categories(result, self.evaluator_registry)
+        self.totals.update(counts)
+
+        for category in counts:
+            if category not in self._columns:
+                self._columns[category] = [0] * self.num_datapoints
+        self._columns[DATAPOINT_ID_COLUMN].append(datapoint_id)
+        for category, column in self._columns.items():
+            if category != DATAPOINT_ID_COLUMN:
+                column.append(counts.get(category, 0))
+        self.num_datapoints += 1
+
+    def summary(self) -> "pd.DataFrame":
+        """
+        Return the total count of every category, in the order the categories first appeared.
+
+        Returns:
+            pd.DataFrame: Columns "Category" and "Count", or None if no datapoint was added.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if not self.num_datapoints:
+            return None
+        categories = [category for category in self._columns if category != DATAPOINT_ID_COLUMN]
+        return pd.DataFrame({
+            "Category": categories,
+            "Count": np.array([self.totals[category] for category in categories], dtype=np.int64),
+        })
+
+    def datapoint_columns(self) -> dict:
+        """Return the per-datapoint counts column-wise: "datapoint_id" plus one int64 array per category."""
+        import numpy as np
+
+        return {category: np.asarray(column) if category == DATAPOINT_ID_COLUMN else np.asarray(column, dtype=np.int64)
+                for category, column in self._columns.items()}
+
+    def write_datapoints(self, path: Path) -> Path:
+        """
+        Write the per-datapoint counts as Parquet, or as CSV next to it if no Parquet engine is installed.
+
+        Args:
+            path (Path): Target path, with a ".parquet" suffix.
+
+        Returns:
+            Path: The path actually written.
+        """
+        import pandas as pd
+
+        return write_datapoint_frame(pd.DataFrame(self.datapoint_columns()), path)
+
+
+def write_datapoint_frame(frame: "pd.DataFrame", path: Path) -> Path:
+    """
+    Write per-datapoint counts as Parquet, or as CSV next to it if no Parquet engine is installed.
+
+    Returns:
+        Path: The path actually written.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        frame.to_parquet(path, index=False)
+    except ImportError:
+        path = path.with_suffix(".csv")
+        logger.debug(f"No Parquet engine installed, writing {path} instead")
+        frame.to_csv(path, index=False)
+    return path
+
+
+def read_datapoint_frame(path: Path) -> "pd.DataFrame":
+    """Read per-datapoint counts written by `write_datapoint_frame`, or None if neither file exists."""
+    import pandas as pd
+
+    path = Path(path)
+    if path.exists():
+        return pd.read_parquet(path)
+    if path.with_suffix(".csv").exists():
+        return pd.read_csv(path.with_suffix(".csv"))
+    return None
+
+
+def merge_datapoint_frames(frames: list["pd.DataFrame"]) -> tuple["pd.DataFrame", "pd.DataFrame"]:
+    """
+    Merge the per-datapoint counts of disjoint sets of datapoints, e.g. of several shards.
+
+    Categories missing from a frame count as zero.
+
+    Returns:
+        tuple: (per-datapoint counts sorted by datapoint ID, total count per category as
+        returned by `ErrorAggregator.summary`), or (None, None) if there are no datapoints.
+    """
+    import numpy as np
+    import pandas as pd
+
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return None, None
+    merged = pd.concat(frames, ignore_index=True).sort_values(DATAPOINT_ID_COLUMN, ignore_index=True)
+    categories = [column for column in merged.columns if column != DATAPOINT_ID_COLUMN]
+    merged[categories] = merged[categories].fillna(0).astype(np.int64)
+    summary = pd.DataFrame({
+        "Category": categories,
+        "Count": np.array([merged[category].sum() for category in categories], dtype=np.int64),
+    })
+    return merged[[DATAPOINT_ID_COLUMN, *categories]], summary
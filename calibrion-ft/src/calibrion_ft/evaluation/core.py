@@ -1,12 +1,24 @@
+import atexit
 import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from ..logging_config import setup_logger
+from .memo import EvaluatorResultCache
+from .registry import EvaluatorMetadata, EvaluatorRegistry
 
 logger = setup_logger(log_level=logging.INFO)
 
+# Number of inputs sent to a worker at once by run_evaluators_on_batch when no evaluator
+# declares a preferred batch size
+DEFAULT_CHUNK_SIZE = 16
+
 
 def run_evaluators(evaluator_registry: dict,
                    input: dict,
-                   skip_evaluators: list[str] = []) -> dict:
+                   skip_evaluators: list[str] = [],
+                   result_cache: EvaluatorResultCache = None) -> dict:
     """
     Run all evaluators passed by the evaluator_registry on the provided input.
 
@@ -19,6 +31,8 @@ def run_evaluators(evaluator_registry: dict,
                 "js_code": "def foo(): return None"
             }
         skip_evaluators (list[str], optional): List of evaluator names to skip. Defaults to [].
+        result_cache (EvaluatorResultCache, optional): Cache of evaluator results, see
+            `run_evaluators_on_batch`. None evaluates everything.
     
     Returns:
         dict: A dictionary containing the results from evaluators.
@@ -29,17 +43,27 @@ def run_evaluators(evaluator_registry: dict,
     
     for name, evaluator in evaluator_registry.items():
         if name in skip_evaluators:
-            logger.info(f"Skipping evaluator: {name}")
+            logger.debug("Skipping evaluator: %s", name)
             continue
             
-        logger.info(f"Preparing evaluator: {name}")
+        logger.debug("Preparing evaluator: %s", name)
         required_keys = evaluator.required_inputs()
         if all(k in input for k in required_keys):
             input_subset = {k: input[k] for k in required_keys}
-            logger.debug(f"Running evaluator: {name} - with required keys: {input_subset.keys()}")
+            memo_key = None
+            if result_cache is not None and result_cache.mode != "bypass":
+                memo_key = EvaluatorResultCache.make_key(name, str(evaluator.version()), input_subset)
+                hits = result_cache.get_many([memo_key])
+                if memo_key in hits:
+                    results[name] = hits[memo_key]
+                    logger.debug("Evaluator %s result served from cache.", name)
+                    continue
+            logger.debug("Running evaluator: %s - with required keys: %s", name, input_subset.keys())
             try:
                 results[name] = evaluator.run(**input_subset)
-                logger.info(f"Evaluator {name} completed successfully.")
+                logger.debug("Evaluator %s completed successfully.", name)
+                if memo_key is not None:
+                    result_cache.put_many([(memo_key, name, str(evaluator.version()), results[name])])
             except Exception as e:
                 logger.error(f"Error running evaluator {name}: {str(e)}")
                 raise
@@ -50,25 +74,322 @@ def run_evaluators(evaluator_registry: dict,
     return results
 
 
+class EvaluatorError(Exception):
+    """
+    Failure of one evaluator on one datapoint of a batch.
+
+    Only the message of the original exception is kept, so the error can be sent
+    back from a worker process.
+    """
+
+    def __init__(self, index: int, evaluator_name: str, message: str):
+        super().__init__(index, evaluator_name, message)
+        self.index = index
+        self.evaluator_name = evaluator_name
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"Evaluator {self.evaluator_name} failed on input {self.index}: {self.message}"
+
+
+def _run_evaluator_on_chunk(name: str, evaluator, chunk: list[tuple[int, dict]]) -> list:
+    """
+    Run one evaluator on a chunk of (index, input) pairs through its run_batch().
+
+    Returns one result per input, or an EvaluatorError for inputs the evaluator failed on.
+    If run_batch() fails as a whole on several inputs, they are re-run one by one to find the
+    failing ones; a failure on a single input is recorded as is.
+    """
+    required_keys = evaluator.required_inputs()
+    results = [None] * len(chunk)
+    runnable = []
+    for position, (index, input) in enumerate(chunk):
+        if all(k in input for k in required_keys):
+            runnable.append(position)
+        else:
+            results[position] = EvaluatorError(index, name, f"ValueError: Missing required inputs for evaluator {name}: {required_keys}")
+
+    batch_size = evaluator.preferred_batch_size or len(runnable) or 1
+    for start in range(0, len(runnable), batch_size):
+        positions = runnable[start:start + batch_size]
+        input_subsets = [{k: chunk[position][1][k] for k in required_keys} for position in positions]
+        try:
+            batch_results = evaluator.run_batch(input_subsets)
+            if len(batch_results) != len(input_subsets):
+                raise ValueError(f"run_batch returned {len(batch_results)} results for {len(input_subsets)} inputs")
+        except Exception as e:
+            if len(positions) == 1:
+                batch_results = [e]
+            else:
+                logger.debug("run_batch of evaluator %s failed, running inputs one by one: %s", name, e)
+                batch_results = []
+                for input_subset in input_subsets:
+                    try:
+                        batch_results.append(evaluator.run(**input_subset))
+                    except Exception as e:
+                        batch_results.append(e)
+        for position, result in zip(positions, batch_results):
+            if isinstance(result, Exception):
+                result = EvaluatorError(chunk[position][0], name, f"{type(result).__name__}: {str(result)}")
+            results[position] = result
+    return results
+
+
+# Registry of a worker process, set once by the pool initializer
+_worker_registry = None
+
+
+def _init_worker(evaluator_registry: dict) -> None:
+    global _worker_registry
+    _worker_registry = evaluator_registry
+
+
+def _run_chunk(chunk: list[tuple[int, dict, tuple]], evaluator_registry: dict = None) -> list[dict]:
+    """Run the evaluators named in each (index, input, evaluator names) item of a chunk."""
+    if evaluator_registry is None:
+        evaluator_registry = _worker_registry
+    results = [{} for _ in chunk]
+    # Evaluator-major, so every evaluator sees the whole chunk in as few run_batch() calls as possible
+    for name, evaluator in evaluator_registry.items():
+        positions = [position for position, (_, _, names) in enumerate(chunk) if name in names]
+        if not positions:
+            continue
+        evaluator_chunk = [chunk[position][:2] for position in positions]
+        for position, evaluator_result in zip(positions, _run_evaluator_on_chunk(name, evaluator, evaluator_chunk)):
+            results[position][name] = evaluator_result
+    return results
+
+
+def _selected_evaluators(evaluator_registry: dict, skip_evaluators: list[str]) -> dict:
+    if isinstance(evaluator_registry, EvaluatorRegistry):
+        return evaluator_registry.select(exclude=skip_evaluators)
+    return {name: evaluator for name, evaluator in evaluator_registry.items() if name not in skip_evaluators}
+
+
+# Process pool kept alive across calls with the same evaluators, so that its workers import
+# and instantiate every evaluator once instead of once per call
+_process_pool = None
+_process_pool_key = None
+# Evaluators of the shared pool, referenced so that the instance ids in its key stay unique
+_process_pool_evaluators = None
+_process_pool_lock = threading.Lock()
+_atexit_registered = False
+
+
+def _pool_key(selected: dict) -> tuple:
+    """Identify the evaluators of a pool: by spec for an EvaluatorRegistry, by instance for a plain dict."""
+    if isinstance(selected, EvaluatorRegistry):
+        return tuple(selected.specs.values())
+    return tuple((name, id(evaluator)) for name, evaluator in selected.items())
+
+
+def _shared_process_pool(selected: dict, max_workers: int) -> ProcessPoolExecutor:
+    global _process_pool, _process_pool_key, _process_pool_evaluators, _atexit_registered
+    key = (_pool_key(selected), max_workers)
+    with _process_pool_lock:
+        if not _atexit_registered:
+            atexit.register(shutdown_evaluator_pool)
+            _atexit_registered = True
+        if _process_pool_key != key:
+            if _process_pool is not None:
+                _process_pool.shutdown()
+            _process_pool = ProcessPoolExecutor(max_workers=max_workers,
+                                                initializer=_init_worker,
+                                                initargs=(selected,))
+            _process_pool_key = key
+            _process_pool_evaluators = selected
+        return _process_pool
+
+
+def shutdown_evaluator_pool() -> None:
+    """
+    Shut down the process pool shared by `run_evaluators_on_batch` calls, if any.
+    Called at the end of step 4 and at interpreter exit.
+    """
+    global _process_pool, _process_pool_key, _process_pool_evaluators
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+        _process_pool = None
+        _process_pool_key = None
+        _process_pool_evaluators = None
+
+
+def _evaluator_attributes(selected: dict, name: str):
+    """Return what to read the class attributes of an evaluator from: its class for an EvaluatorRegistry, which
+    does not instantiate it in this process, or the instance of a plain dict."""
+    if isinstance(selected, EvaluatorRegistry):
+        return selected.evaluator_class(name)
+    return selected[name]
+
+
+def _metadata(selected: dict) -> dict[str, EvaluatorMetadata]:
+    """Return the version and required inputs of every selected evaluator, cached by an EvaluatorRegistry."""
+    if isinstance(selected, EvaluatorRegistry):
+        return {name: selected.metadata(name) for name in selected}
+    return {name: EvaluatorMetadata.of(evaluator) for name, evaluator in selected.items()}
+
+
+def _select_executor(selected: dict) -> str:
+    return "thread" if selected and all(_evaluator_attributes(selected, name).releases_gil
+                                        for name in selected) else "process"
+
+
+def _chunk_sizes(selected: dict, chunk_size: int = None) -> dict[str, int]:
+    """Return the chunk size of every selected evaluator: `chunk_size` if given, else its preferred batch size."""
+    return {name: chunk_size or _evaluator_attributes(selected, name).preferred_batch_size or DEFAULT_CHUNK_SIZE
+            for name in selected}
+
+
+def _make_chunks(work: list[tuple[int, dict, tuple]], chunk_sizes: dict[str, int]) -> list[list[tuple[int, dict, tuple]]]:
+    """
+    Split the work into chunks of the chunk size of its evaluators.
+
+    Evaluators with the same chunk size share their chunks, so an input is sent once to them;
+    an evaluator with a larger preferred batch size gets chunks of its own.
+    """
+    chunks = []
+    for size in sorted(set(chunk_sizes.values())):
+        names = {name for name, name_size in chunk_sizes.items() if name_size == size}
+        group_work = [(index, input, tuple(name for name in pending if name in names)) for index, input, pending in work]
+        group_work = [item for item in group_work if item[2]]
+        chunks.extend(group_work[i:i + size] for i in range(0, len(group_work), size))
+    return chunks
+
+
+def _memo_keys(metadata: dict[str, EvaluatorMetadata], inputs: list[dict]) -> list[dict]:
+    """Return, per input, the result cache key of every selected evaluator whose required inputs are present."""
+    keys = []
+    for input in inputs:
+        input_keys = {}
+        for name, evaluator_metadata in metadata.items():
+            required = evaluator_metadata.required_inputs
+            if all(k in input for k in required):
+                input_subset = {k: input[k] for k in required}
+                input_keys[name] = EvaluatorResultCache.make_key(name, evaluator_metadata.version, input_subset)
+        keys.append(input_keys)
+    return keys
+
+
 def run_evaluators_on_batch(evaluator_registry: dict,
                             inputs: list[dict],
-                            skip_evaluators: list[str] = []) -> list[dict]:
+                            skip_evaluators: list[str] = [],
+                            max_workers: int = None,
+                            chunk_size: int = None,
+                            executor: str = "auto",
+                            return_exceptions: bool = False,
+                            result_cache: EvaluatorResultCache = None) -> list[dict]:
     """
     Run all evaluators passed by the evaluator_registry on the provided batch of inputs.
 
+    Inputs are split into chunks per evaluator that are evaluated in parallel. By default a
+    process pool is used; if every selected evaluator declares `releases_gil`, a thread pool
+    is used instead. The process pool is kept alive across calls with the same evaluators (the
+    same specs of an `EvaluatorRegistry`, the same instances of a plain dict), so each worker
+    loads the selected evaluators once. Within a chunk, each evaluator receives its inputs through run_batch(),
+    split by its `preferred_batch_size`. Results are returned in the order of the inputs.
+
+    With a `result_cache`, cached results are looked up before dispatching and only the
+    (input, evaluator) pairs without a cached result are evaluated.
+
     Args:
         evaluator_registry (dict): A dictionary of evaluator instances.
         inputs (list[dict]): A list of dictionaries containing input data for the evaluators.
-        skip_evaluators (list[str], optional): List of evaluator names to skip. Defaults to None.
+        skip_evaluators (list[str], optional): List of evaluator names to skip. Defaults to [].
+        max_workers (int, optional): Number of workers. Defaults to the number of CPUs.
+            1 evaluates in the calling thread.
+        chunk_size (int, optional): Number of inputs sent to a worker at once, for every evaluator.
+            Defaults to the `preferred_batch_size` of each evaluator, or DEFAULT_CHUNK_SIZE if it declares
+            none; evaluators with the same chunk size share their chunks. "auto" evaluates serially
+            if all the work fits in one chunk.
+        executor (str, optional): "auto", "process", "thread" or "serial".
+        return_exceptions (bool, optional): If True, an evaluator that fails on an input yields an
+            EvaluatorError as its result for that input and the other results are kept. If False,
+            the first failure (in input order) is raised as EvaluatorError.
+        result_cache (EvaluatorResultCache, optional): Cache of evaluator results keyed by evaluator
+            name, evaluator version and required inputs. None evaluates everything.
     
     Returns:
         list[dict]: A list of dictionaries containing the results from evaluators for each input.
     """
+    if executor not in ("auto", "process", "thread", "serial"):
+        raise ValueError(f"Unknown executor: {executor}")
+
+    selected = _selected_evaluators(evaluator_registry, skip_evaluators)
+    all_names = tuple(selected)
+    cached = [{} for _ in inputs]
+    memo_keys = None
+    if result_cache is not None and result_cache.mode != "bypass":
+        metadata = _metadata(selected)
+        memo_keys = _memo_keys(metadata, inputs)
+        hits = result_cache.get_many([key for input_keys in memo_keys for key in input_keys.values()])
+        cached = [{name: hits[key] for name, key in input_keys.items() if key in hits} for input_keys in memo_keys]
+
+    # (input index, evaluator name) pairs that reuse the result of an identical earlier pair of this batch
+    duplicates = {}
+    if memo_keys is not None:
+        first_index = {}
+        for index, input_keys in enumerate(memo_keys):
+            for name, key in input_keys.items():
+                if name in cached[index]:
+                    continue
+                if key in first_index:
+                    duplicates[(index, name)] = first_index[key]
+                else:
+                    first_index[key] = index
+
+    work = [(index, input, tuple(name for name in all_names
+                                 if name not in cached[index] and (index, name) not in duplicates))
+            for index, input in enumerate(inputs)]
+    work = [item for item in work if item[2]]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = _make_chunks(work, _chunk_sizes(selected, chunk_size))
+    if executor == "auto":
+        executor = "serial" if max_workers == 1 or len(chunks) <= 1 else _select_executor(selected)
+    logger.debug("Running evaluators on %d of %d inputs in %d chunks (%s)", len(work), len(inputs), len(chunks), executor)
+
+    run_chunk = partial(_run_chunk, evaluator_registry=selected)
+    if not chunks:
+        chunk_results = []
+    elif executor == "serial":
+        chunk_results = list(map(run_chunk, chunks))
+    elif executor == "thread":
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            chunk_results = list(pool.map(run_chunk, chunks))
+    else:
+        pool = _shared_process_pool(selected, max_workers)
+        chunk_results = list(pool.map(_run_chunk, chunks))
+
+    computed_by_index = {}
+    for chunk, chunk_result in zip(chunks, chunk_results):
+        for (index, _, _), result in zip(chunk, chunk_result):
+            computed_by_index.setdefault(index, {}).update(result)
     results = []
-    for i, input in enumerate(inputs):
-        logger.debug(f"Running evaluators for input {i}")
-        result = run_evaluators(evaluator_registry, input, skip_evaluators)
+    for index in range(len(inputs)):
+        computed_result = computed_by_index.get(index, {})
+        result = {}
+        for name in all_names:
+            if name in cached[index]:
+                result[name] = cached[index][name]
+            elif (index, name) in duplicates:
+                value = computed_by_index[duplicates[(index, name)]][name]
+                result[name] = EvaluatorError(index, name, value.message) if isinstance(value, EvaluatorError) else value
+            else:
+                result[name] = computed_result[name]
         results.append(result)
 
-    return results
+    if memo_keys is not None:
+        result_cache.put_many([(memo_keys[index][name], name, metadata[name].version, value)
+                               for index, result in computed_by_index.items()
+                               for name, value in result.items()
+                               if not isinstance(value, EvaluatorError) and name in memo_keys[index]])
 
+    if not return_exceptions:
+        for result in results:
+            for value in result.values():
+                if isinstance(value, EvaluatorError):
+                    logger.error(str(value))
+                    raise value
+
+    return results
@@ -1,15 +1,49 @@
+import numbers
 from abc import ABC, abstractmethod
+from typing import Optional
+
+def _error_count(value) -> Optional[int]:
+    """Return the errors counted by one result field: an integer as is, a list its items, None for anything else."""
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    return None
+
 
 class BaseEvaluator(ABC):
+    # Set to True if run() spends its time outside the GIL (C extensions, subprocesses, I/O).
+    # If all evaluators of a run release the GIL, batches are evaluated in a thread pool
+    # instead of a process pool.
+    releases_gil: bool = False
+
+    # Number of inputs this evaluator prefers to receive per run_batch() call, e.g. a few
+    # thousand for vectorized evaluators. None means no preference.
+    preferred_batch_size: int = None
+
+    # Result fields that count errors, reported by the default error_categories(). None counts
+    # every integer and list field of a result.
+    error_keys: tuple = None
+
     @abstractmethod
     def name(self) -> str:
         """Unique name for this evaluator."""
         pass
 
+    def version(self) -> str:
+        """
+        Version of this evaluator's results. Bump it whenever a change to the evaluator
+        changes its results, so memoized results of the previous version are not reused.
+        Read from the class by the registry (see `registry.EvaluatorMetadata`), so it should
+        not depend on instance state.
+        """
+        return "1"
+
     def required_inputs(self) -> list:
         """
         Return a list of required input keys.
         e.g., ['html'], or ['expected', 'generated']
+        Like version(), read from the class by the registry.
         """
         return []
 
@@ -19,4 +53,37 @@ class BaseEvaluator(ABC):
         """Run the evaluation and return a result dictionary."""
         pass
 
+    @classmethod
+    def error_categories(cls, result: dict, name: str) -> dict:
+        """
+        Map one result of this evaluator to error counts per category, used by step 4 to aggregate results.
+        A classmethod, so that the parent process aggregates results without instantiating the evaluator.
+
+        Every field of the result is reported as "<evaluator name> <field>", an integer counting as
+        is and a list its items, like the rows of `evaluation_utilities.format_eval_results`; other
+        fields are left out. Setting `error_keys` reports only the listed fields, booleans and
+        missing ones counting zero. Override (as a classmethod) to report other categories.
+
+        Args:
+            result (dict): One result of this evaluator.
+            name (str): The evaluator's name.
+        """
+        keys = cls.error_keys if cls.error_keys is not None else list(result)
+        categories = {}
+        for key in keys:
+            count = _error_count(result.get(key))
+            if count is not None:
+                categories[f"{name} {key}"] = count
+            elif cls.error_keys is not None:
+                categories[f"{name} {key}"] = 0
+        return categories
+
+    def run_batch(self, inputs: list[dict]) -> list[dict]:
+        """
+        Run the evaluation on several inputs and return one result dictionary per input, in order.
+        Each input holds the required input keys. Override to share setup cost or vectorize
+        the work across inputs; the default calls run() once per input.
+        """
+        return [self.run(**input_data) for input_data in inputs]
+
 
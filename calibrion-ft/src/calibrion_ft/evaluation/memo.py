@@ -0,0 +1,240 @@
+"""
+Persistent memoization of evaluator results.
+
+Results are stored in a SQLite database keyed by the SHA-256 hash of the evaluator
+name, the evaluator version and the required inputs the evaluator was run on. Identical
+generated code, whether produced by several fine-tuned variants or by re-running
+step 4, is therefore evaluated once per evaluator version. Bumping the `version()` of
+one evaluator invalidates only the entries of that evaluator.
+
+Results are stored pickled, so a cached result has the same types as a freshly computed
+one (tuples, non-string keys and numpy scalars survive). Entries written as JSON by
+earlier versions are still read.
+"""
+
+import hashlib
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from ..logging_config import setup_logger
+from ..response_cache import CACHE_MODES
+
+logger = setup_logger(log_level=logging.INFO)
+
+DEFAULT_MEMO_PATH = Path(__file__).parent.parent / "_evaluator_results.sqlite"
+
+# Least recently used entries beyond this are evicted
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+# Eviction is checked every this many writes instead of on every write
+EVICTION_INTERVAL = 1000
+
+# Maximum number of keys looked up in a single SELECT (SQLite limits bound parameters)
+LOOKUP_BATCH_SIZE = 500
+
+
+def _dump_result(result: Any) -> bytes:
+    return pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_result(stored) -> Any:
+    # Entries of earlier versions are JSON text, pickled entries are blobs
+    if isinstance(stored, str):
+        return json.loads(stored)
+    return pickle.loads(stored)
+
+
+class EvaluatorResultCache:
+    """
+    SQLite-backed cache of evaluator results with LRU eviction and hit/miss counters.
+
+    Args:
+        path: Path of the SQLite database file.
+        mode: One of "read_write", "read_only", "refresh" or "bypass", as for the response cache.
+        max_entries: Maximum number of entries kept, least recently used evicted first.
+            None disables eviction.
+    """
+
+    def __init__(self,
+                 path: Path = DEFAULT_MEMO_PATH,
+                 mode: str = "read_write",
+                 max_entries: Optional[int] = DEFAULT_MAX_ENTRIES):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}. Expected one of {CACHE_MODES}")
+        self.path = Path(path)
+        self.mode = mode
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS evaluator_results ("
+                " key TEXT PRIMARY KEY,"
+                " evaluator TEXT NOT NULL,"
+                " version TEXT NOT NULL,"
+                " result BLOB NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_evaluator_results_accessed_at "
+                               "ON evaluator_results (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(evaluator_name: str, evaluator_version: str, input_subset: dict) -> str:
+        """Return the content address of an evaluator run: SHA-256 of name, version and canonical JSON inputs."""
+        canonical = json.dumps([evaluator_name, evaluator_version, input_subset],
+                               sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict:
+        """
+        Return the cached results for the given keys as a dict of key to result; missing keys are left out.
+
+        Always empty in "refresh" and "bypass" modes.
+        """
+        if self.mode in ("refresh", "bypass"):
+            if self.mode == "refresh":
+                with self._lock:
+                    self.misses += len(keys)
+            return {}
+
+        unique_keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(unique_keys), LOOKUP_BATCH_SIZE):
+                batch = unique_keys[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(f"SELECT key, result FROM evaluator_results WHERE key IN ({placeholders})",
+                                    batch).fetchall()
+                found.update((key, _load_result(result)) for key, result in rows)
+            if found and self.mode == "read_write":
+                now = time.time()
+                conn.executemany("UPDATE evaluator_results SET accessed_at = ? WHERE key = ?",
+                                 [(now, key) for key in found])
+                conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, entries: list[tuple[str, str, str, Any]]) -> None:
+        """
+        Store (key, evaluator name, evaluator version, result) entries. No-op in "read_only" and "bypass" modes.
+        Results that cannot be pickled are not stored.
+        """
+        if self.mode in ("read_only", "bypass") or not entries:
+            return
+
+        rows = []
+        now = time.time()
+        for key, evaluator_name, evaluator_version, result in entries:
+            try:
+                rows.append((key, evaluator_name, evaluator_version, _dump_result(result), now))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                logger.debug("Result of evaluator %s cannot be pickled, not memoized", evaluator_name)
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO evaluator_results (key, evaluator, version, result, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+            previous_writes = self.writes
+            self.writes += len(rows)
+            if self.writes // EVICTION_INTERVAL != previous_writes // EVICTION_INTERVAL:
+                self._evict(conn)
+
+    def evict(self) -> int:
+        """Apply size-based eviction now and return the number of evicted entries."""
+        with self._lock:
+            return self._evict(self._connection())
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        if self.max_entries is None:
+            return 0
+        evicted = conn.execute(
+            "DELETE FROM evaluator_results WHERE key IN ("
+            " SELECT key FROM evaluator_results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        conn.commit()
+        self.evictions += evicted
+        if evicted:
+            logger.debug(f"Evicted {evicted} entries from evaluator result cache {self.path}")
+        return evicted
+
+    def stats(self) -> dict:
+        """Return the hit/miss/write/eviction counters of this cache instance."""
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def log_stats(self) -> None:
+        """Log the counters of this cache instance."""
+        if self.mode == "bypass":
+            return
+        stats = self.stats()
+        logger.info(
+            f"Evaluator result cache ({stats['mode']}): {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.1%} hit rate), {stats['writes']} writes, {stats['evictions']} evictions"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_result_cache: Optional[EvaluatorResultCache] = None
+
+
+def configure_result_cache(path: Path = DEFAULT_MEMO_PATH,
+                           mode: str = "read_write",
+                           max_entries: Optional[int] = DEFAULT_MAX_ENTRIES) -> EvaluatorResultCache:
+    """
+    Replace the process-wide evaluator result cache used by step 4.
+
+    Args:
+        path: Path of the SQLite database file.
+        mode: One of "read_write", "read_only", "refresh" or "bypass".
+        max_entries: Maximum number of cached results, None for unbounded.
+
+    Returns:
+        The newly configured EvaluatorResultCache.
+    """
+    global _result_cache
+    if _result_cache is not None:
+        _result_cache.close()
+    _result_cache = EvaluatorResultCache(path=path, mode=mode, max_entries=max_entries)
+    return _result_cache
+
+
+def get_result_cache() -> EvaluatorResultCache:
+    """Return the process-wide evaluator result cache, creating a default one on first use."""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = EvaluatorResultCache()
+    return _result_cache
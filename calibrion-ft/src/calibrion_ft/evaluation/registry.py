@@ -1,20 +1,255 @@
+import ast
 import importlib
-import pkgutil
 import inspect
-from evaluation.evaluators.base import BaseEvaluator
-import evaluation.evaluators
+import logging
+import pkgutil
+from collections.abc import Mapping
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+from pathlib import Path
+from typing import Iterable, Optional
+
+from ..logging_config import setup_logger
+from . import evaluators
+from .evaluators.base import BaseEvaluator
+
+logger = setup_logger(log_level=logging.INFO)
+
+# Entry point group under which other packages register evaluators, e.g. in their pyproject.toml:
+#   [project.entry-points."calibrion_ft.evaluators"]
+#   my_evaluator = "my_package.evaluators:MyEvaluator"
+ENTRY_POINT_GROUP = "calibrion_ft.evaluators"
+
+
+@dataclass(frozen=True)
+class EvaluatorSpec:
+    """Where to find an evaluator, known without importing its module."""
+    name: str
+    module: str
+    class_name: str
+    source: str = "builtin"
+
+    def load_class(self) -> type[BaseEvaluator]:
+        """Import the evaluator's module and return the evaluator class, without instantiating it."""
+        cls = getattr(importlib.import_module(self.module), self.class_name)
+        if not (inspect.isclass(cls) and issubclass(cls, BaseEvaluator)):
+            raise TypeError(f"{self.module}:{self.class_name} is not a BaseEvaluator subclass")
+        return cls
+
+    def load(self) -> BaseEvaluator:
+        """Import the evaluator's module and instantiate the evaluator."""
+        instance = self.load_class()()
+        if self.name and instance.name() != self.name:
+            logger.warning(f"Evaluator {self.module}:{self.class_name} is registered as {self.name} "
+                           f"but reports the name {instance.name()}")
+        return instance
+
+
+def _call_on_class(evaluator_class: type[BaseEvaluator], method: str):
+    """Call a method of an evaluator that returns a constant with the class in place of an instance."""
+    function = inspect.getattr_static(evaluator_class, method)
+    if isinstance(function, (classmethod, staticmethod)):
+        return getattr(evaluator_class, method)()
+    return function(evaluator_class)
+
+
+@dataclass(frozen=True)
+class EvaluatorMetadata:
+    """What the parent process needs to know about an evaluator to memoize its results."""
+    version: str
+    required_inputs: tuple
 
+    @classmethod
+    def of(cls, evaluator: BaseEvaluator) -> "EvaluatorMetadata":
+        return cls(str(evaluator.version()), tuple(evaluator.required_inputs()))
 
-def get_evaluator_registry():
+    @classmethod
+    def of_class(cls, evaluator_class: type[BaseEvaluator]) -> "EvaluatorMetadata":
+        """
+        Read the metadata from an evaluator class without instantiating it.
+
+        Raises:
+            Exception: Whatever version() or required_inputs() raise when they use instance state.
+        """
+        return cls(str(_call_on_class(evaluator_class, "version")),
+                   tuple(_call_on_class(evaluator_class, "required_inputs")))
+
+
+def _literal_name(class_node: ast.ClassDef) -> Optional[str]:
+    """Return the string literal returned by the class's name() method, if it is one."""
+    for node in class_node.body:
+        if isinstance(node, ast.FunctionDef) and node.name == "name":
+            for statement in node.body:
+                if (isinstance(statement, ast.Return)
+                        and isinstance(statement.value, ast.Constant)
+                        and isinstance(statement.value.value, str)):
+                    return statement.value.value
+    return None
+
+
+def _base_names(class_node: ast.ClassDef) -> set[str]:
+    return {base.id if isinstance(base, ast.Name) else base.attr
+            for base in class_node.bases if isinstance(base, (ast.Name, ast.Attribute))}
+
+
+def _discover_module(module_name: str, path: Path) -> list[EvaluatorSpec]:
     """
-    Dynamically discover and register all evaluators in the evaluation.evaluators package.
+    Find the evaluators of one module by parsing its source.
+
+    A class counts as an evaluator if it derives from BaseEvaluator, directly or through
+    another class of the same module. If its name() does not return a string literal,
+    the module is imported to ask the evaluator for its name.
     """
-    registry = {}
-    for _, modname, _ in pkgutil.iter_modules(evaluation.evaluators.__path__):
-        module = importlib.import_module(f"evaluation.evaluators.{modname}")
-        for name, obj in inspect.getmembers(module):
-            if inspect.isclass(obj) and issubclass(obj, BaseEvaluator) and obj is not BaseEvaluator:
-                instance = obj()
-                registry[instance.name()] = instance
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+    classes = {node.name: node for node in tree.body if isinstance(node, ast.ClassDef)}
+    evaluator_classes = set()
+    changed = True
+    while changed:
+        changed = False
+        for class_name, node in classes.items():
+            bases = _base_names(node)
+            if class_name not in evaluator_classes and ("BaseEvaluator" in bases or bases & evaluator_classes):
+                evaluator_classes.add(class_name)
+                changed = True
+
+    specs = []
+    for class_name in sorted(evaluator_classes):
+        node = classes[class_name]
+        if any(isinstance(decorator, ast.Name) and decorator.id == "abstractmethod"
+               for item in node.body if isinstance(item, ast.FunctionDef) for decorator in item.decorator_list):
+            continue
+        name = _literal_name(node)
+        if name is None:
+            logger.debug(f"Evaluator name of {module_name}:{class_name} is not a literal, importing the module")
+            name = EvaluatorSpec("", module_name, class_name).load().name()
+        specs.append(EvaluatorSpec(name, module_name, class_name))
+    return specs
 
+
+def discover_evaluators() -> list[EvaluatorSpec]:
+    """
+    Return the specs of the evaluators in the evaluation.evaluators package and of the
+    evaluators registered under the ENTRY_POINT_GROUP entry point group, without importing them.
+    """
+    specs = []
+    for module_info in pkgutil.iter_modules(evaluators.__path__):
+        if module_info.name == "base" or module_info.ispkg:
+            continue
+        module_name = f"{evaluators.__name__}.{module_info.name}"
+        path = Path(module_info.module_finder.path) / f"{module_info.name}.py"
+        try:
+            specs.extend(_discover_module(module_name, path))
+        except Exception as e:
+            logger.exception(f"Could not discover evaluators in {module_name}: {str(e)}")
+
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        module_name, _, class_name = entry_point.value.partition(":")
+        specs.append(EvaluatorSpec(entry_point.name, module_name.strip(), class_name.strip(), source="entry_point"))
+    return specs
+
+
+class EvaluatorRegistry(Mapping):
+    """
+    Read-only mapping of evaluator name to evaluator instance that instantiates lazily.
+
+    An evaluator's module is imported and the evaluator instantiated on first access only,
+    then reused. Registries returned by `select()` share the instances and the cached
+    metadata of the registry they were selected from, so selecting per batch does not
+    instantiate the evaluators again. Pickling keeps the specs but drops the instances,
+    so a registry sent to a worker process is instantiated once in that worker instead of
+    being serialized.
+
+    Args:
+        specs (Iterable[EvaluatorSpec]): The evaluators of the registry. On duplicate names the
+            first spec wins, so built-in evaluators cannot be replaced by entry points.
+    """
+
+    def __init__(self, specs: Iterable[EvaluatorSpec]):
+        self.specs = {}
+        for spec in specs:
+            if spec.name in self.specs:
+                logger.warning(f"Duplicate evaluator name {spec.name} from {spec.module}:{spec.class_name}, ignored")
+                continue
+            self.specs[spec.name] = spec
+        self._instances = {}
+        self._metadata = {}
+
+    def __getitem__(self, name: str) -> BaseEvaluator:
+        spec = self.specs[name]
+        if name not in self._instances:
+            logger.debug(f"Loading evaluator {name} from {spec.module}:{spec.class_name}")
+            self._instances[name] = spec.load()
+        return self._instances[name]
+
+    def evaluator_class(self, name: str) -> type[BaseEvaluator]:
+        """Return the class of an evaluator, e.g. to read `releases_gil`, without instantiating it."""
+        if name in self._instances:
+            return type(self._instances[name])
+        return self.specs[name].load_class()
+
+    def metadata(self, name: str) -> EvaluatorMetadata:
+        """
+        Return the version and required inputs of an evaluator, read from its class and cached.
+
+        The evaluator is only instantiated if its version() or required_inputs() cannot be
+        called on the class, e.g. because they read attributes set in __init__.
+        """
+        if name not in self._metadata:
+            if name in self._instances:
+                self._metadata[name] = EvaluatorMetadata.of(self._instances[name])
+            else:
+                try:
+                    self._metadata[name] = EvaluatorMetadata.of_class(self.evaluator_class(name))
+                except Exception as e:
+                    logger.debug(f"Could not read the metadata of evaluator {name} from its class, "
+                                 f"instantiating it: {str(e)}")
+                    self._metadata[name] = EvaluatorMetadata.of(self[name])
+        return self._metadata[name]
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    def __len__(self) -> int:
+        return len(self.specs)
+
+    def __contains__(self, name) -> bool:
+        return name in self.specs
+
+    def __getstate__(self) -> dict:
+        return {"specs": self.specs, "_instances": {}, "_metadata": {}}
+
+    def select(self, include: Iterable[str] = None, exclude: Iterable[str] = None) -> "EvaluatorRegistry":
+        """
+        Return a registry restricted to the given evaluators, sharing the instances and metadata of this one.
+
+        Args:
+            include (Iterable[str], optional): Names of the evaluators to keep. None keeps all.
+            exclude (Iterable[str], optional): Names of the evaluators to drop.
+        """
+        include = None if include is None else set(include)
+        exclude = set(exclude or [])
+        unknown = (include or set()) - self.specs.keys()
+        if unknown:
+            raise KeyError(f"Unknown evaluators: {sorted(unknown)}")
+        selected = EvaluatorRegistry(spec for name, spec in self.specs.items()
+                                     if (include is None or name in include) and name not in exclude)
+        selected._instances = self._instances
+        selected._metadata = self._metadata
+        return selected
+
+
+def get_evaluator_registry(include: Iterable[str] = None, exclude: Iterable[str] = None) -> EvaluatorRegistry:
+    """
+    Discover all evaluators in the evaluation.evaluators package and the ENTRY_POINT_GROUP entry points.
+
+    Evaluators are only imported and instantiated when they are first used.
+
+    Args:
+        include (Iterable[str], optional): Names of the evaluators to keep. None keeps all.
+        exclude (Iterable[str], optional): Names of the evaluators to drop.
+    """
+    registry = EvaluatorRegistry(discover_evaluators())
+    if include is not None or exclude is not None:
+        registry = registry.select(include=include, exclude=exclude)
+    logger.debug(f"Evaluator registry: {list(registry)}")
     return registry
@@ -0,0 +1,245 @@
+"""
+Transactional store of fine-tuning experiments.
+
+Experiments are kept in a SQLite database (`_experiments.sqlite`), one row per experiment,
+with indexes on the experiment ID, `ft_job_id` and `ft_model_id`. Every change is a single
+row update in its own transaction, so a submitted job is recorded the moment it is created
+and steps, the scheduler and workers can read and write concurrently. Like the work queue,
+the database uses SQLite's rollback journal instead of WAL, which does not work across
+machines on a network filesystem.
+
+Each row holds the same dictionary as the entries of the former `_experiments.json`,
+which can still be imported and exported:
+
+    python -m calibrion_ft.experiment_store export _experiments.json
+    python -m calibrion_ft.experiment_store import _experiments.json
+
+A new database is initialized from `_experiments.json` if that file exists.
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+DEFAULT_STORE_PATH = Path(__file__).parent / "_experiments.sqlite"
+EXPERIMENTS_JSON_PATH = Path(__file__).parent / "_experiments.json"
+
+# Seconds a connection waits for a lock held by another process
+SQLITE_TIMEOUT = 60.0
+
+
+class ExperimentStore:
+    """
+    SQLite-backed experiments, keyed by experiment ID and kept in insertion order.
+
+    Args:
+        path: Path of the SQLite database file.
+        json_path: JSON file imported when the database is created.
+    """
+
+    def __init__(self, path: Path = DEFAULT_STORE_PATH, json_path: Optional[Path] = EXPERIMENTS_JSON_PATH):
+        self.path = Path(path)
+        self.json_path = Path(json_path) if json_path else None
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None, check_same_thread=False)
+            # Also switches databases created in WAL mode back to the rollback journal
+            conn.execute("PRAGMA journal_mode=DELETE")
+            # The schema is created and the legacy JSON imported in one write transaction, so
+            # that of several processes opening a new database only one imports it
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                created = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'experiments'"
+                                       ).fetchone() is None
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS experiments ("
+                    " position INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " id TEXT NOT NULL UNIQUE,"
+                    " ft_job_id TEXT,"
+                    " ft_model_id TEXT,"
+                    " data TEXT NOT NULL,"
+                    " updated_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_experiments_ft_job_id ON experiments (ft_job_id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_experiments_ft_model_id ON experiments (ft_model_id)")
+                imported = None
+                if created and self.json_path and self.json_path.exists():
+                    with open(self.json_path, "r") as f:
+                        experiments = json.load(f)
+                    imported = conn.executemany(
+                        "INSERT OR IGNORE INTO experiments (id, ft_job_id, ft_model_id, data, updated_at)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        [self._row(exp_id, data) for exp_id, data in experiments.items()]).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                conn.close()
+                raise
+            if imported is not None:
+                logger.info(f"Imported {imported} experiments from {self.json_path} into {self.path}")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _row(exp_id: str, data: dict) -> tuple:
+        return exp_id, data.get("ft_job_id"), data.get("ft_model_id"), json.dumps(data), time.time()
+
+    def _write_all(self, conn: sqlite3.Connection, experiments: dict) -> None:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM experiments")
+            conn.executemany(
+                "INSERT INTO experiments (id, ft_job_id, ft_model_id, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [self._row(exp_id, data) for exp_id, data in experiments.items()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _query(self, sql: str, parameters=()) -> list:
+        with self._lock:
+            return self._connection().execute(sql, parameters).fetchall()
+
+    def all(self) -> dict:
+        """Return all experiments as {experiment ID: experiment}, in insertion order."""
+        return {exp_id: json.loads(data)
+                for exp_id, data in self._query("SELECT id, data FROM experiments ORDER BY position")}
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM experiments")[0][0]
+
+    def get(self, exp_id: str) -> Optional[dict]:
+        """Return one experiment, or None if it does not exist."""
+        rows = self._query("SELECT data FROM experiments WHERE id = ?", (exp_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def find_by_ft_model_id(self, ft_model_id: str) -> Optional[tuple[str, dict]]:
+        """Return (experiment ID, experiment) of the experiment that produced a fine-tuned model, or None."""
+        rows = self._query("SELECT id, data FROM experiments WHERE ft_model_id = ? ORDER BY position LIMIT 1",
+                           (ft_model_id,))
+        return (rows[0][0], json.loads(rows[0][1])) if rows else None
+
+    def find_by_ft_job_id(self, ft_job_id: str) -> Optional[tuple[str, dict]]:
+        """Return (experiment ID, experiment) of the experiment of a fine-tuning job, or None."""
+        rows = self._query("SELECT id, data FROM experiments WHERE ft_job_id = ? ORDER BY position LIMIT 1",
+                           (ft_job_id,))
+        return (rows[0][0], json.loads(rows[0][1])) if rows else None
+
+    def add(self, exp_id: str, experiment: dict) -> None:
+        """Insert a new experiment, or replace the experiment with the same ID."""
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO experiments (id, ft_job_id, ft_model_id, data, updated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET ft_job_id = excluded.ft_job_id, ft_model_id = excluded.ft_model_id,"
+                " data = excluded.data, updated_at = excluded.updated_at",
+                self._row(exp_id, experiment))
+
+    def update(self, exp_id: str, **fields) -> dict:
+        """
+        Set fields of one experiment in a single transaction and return the updated experiment.
+
+        Raises:
+            KeyError: If the experiment does not exist.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT data FROM experiments WHERE id = ?", (exp_id,)).fetchone()
+                if row is None:
+                    raise KeyError(f"Experiment {exp_id} not found in {self.path}")
+                experiment = {**json.loads(row[0]), **fields}
+                conn.execute("UPDATE experiments SET ft_job_id = ?, ft_model_id = ?, data = ?, updated_at = ? WHERE id = ?",
+                             (*self._row(exp_id, experiment)[1:], exp_id))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return experiment
+
+    def replace_all(self, experiments: dict) -> None:
+        """Replace all experiments in one transaction, e.g. with `{}` at the start of a new sweep."""
+        with self._lock:
+            self._write_all(self._connection(), experiments)
+
+    def import_json(self, path: Path = EXPERIMENTS_JSON_PATH) -> int:
+        """Replace all experiments with the content of a JSON file in the `_experiments.json` format."""
+        with open(path, "r") as f:
+            experiments = json.load(f)
+        self.replace_all(experiments)
+        logger.info(f"Imported {len(experiments)} experiments from {path}")
+        return len(experiments)
+
+    def export_json(self, path: Path = EXPERIMENTS_JSON_PATH) -> int:
+        """Write all experiments to a JSON file in the `_experiments.json` format."""
+        path = Path(path)
+        experiments = self.all()
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(experiments, f, indent=4)
+        tmp_path.replace(path)
+        logger.info(f"Exported {len(experiments)} experiments to {path}")
+        return len(experiments)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_store: Optional[ExperimentStore] = None
+_store_lock = threading.Lock()
+
+
+def configure_experiment_store(path: Path = DEFAULT_STORE_PATH,
+                               json_path: Optional[Path] = EXPERIMENTS_JSON_PATH) -> ExperimentStore:
+    """Replace the process-wide experiment store, e.g. to point it at another database."""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+        _store = ExperimentStore(path, json_path)
+        return _store
+
+
+def get_experiment_store() -> ExperimentStore:
+    """Return the process-wide experiment store, creating it with default settings on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ExperimentStore()
+        return _store
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Import or export the experiment store as JSON.")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", type=Path, nargs="?", default=EXPERIMENTS_JSON_PATH, help="JSON file")
+    parser.add_argument("--store", type=Path, default=DEFAULT_STORE_PATH, help="Path of the experiment database")
+    args = parser.parse_args(argv)
+
+    store = ExperimentStore(args.store, json_path=None)
+    try:
+        if args.command == "import":
+            store.import_json(args.path)
+        else:
+            store.export_json(args.path)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,35 @@
-from openai import OpenAI
-import json
 import logging
+from .clients import get_async_client, get_client
+from .hedging import get_hedger
 from .logging_config import setup_logger
+from .rate_limiter import limited_call
+from .response_cache import get_response_cache
 
 logger = setup_logger(log_level=logging.DEBUG)
 
-with open('secrets/openai_api_key.json', 'r') as f:
-    credentials = json.load(f)
 
-client = OpenAI(
-  api_key=credentials.get('openai_api_key'),
-)
+def _chat_completion_request(model_id, user_query, system_role_content, temperature, num_responses):
+    """Build the part of a chat completion request that identifies its response in the cache."""
+    return {
+        "endpoint": "chat.completions",
+        "model": model_id,
+        "n": num_responses,
+        "temperature": temperature,
+        "messages": [
+            {"role": "system", "content": system_role_content},
+            {"role": "user", "content": user_query}],
+    }
+
+
+def _is_cacheable(temperature):
+    """Only deterministic (temperature 0) requests are served from the response cache."""
+    return temperature == 0
 
 
 def run_finetuning(training_file,
                    model,
                    ft_method_config=None,
+                   metadata=None,
                    ):
 
     logger.debug(f"Training file: {training_file}")
@@ -26,8 +40,13 @@ def run_finetuning(training_file,
         kwargs["method"] = ft_method_config
         logger.debug("Overriding default fine-tuning method config with custom config.")
         logger.debug(f"Fine-tuning method config: {ft_method_config}")
+    if metadata is not None:
+        kwargs["metadata"] = metadata
 
-    response = client.fine_tuning.jobs.create(
+    response = limited_call(
+        "fine_tuning.jobs.create",
+        model,
+        get_client().fine_tuning.jobs.with_raw_response.create,
         training_file=training_file,
         model=model,
         **kwargs
@@ -35,6 +54,26 @@ def run_finetuning(training_file,
     return response
 
 
+def find_finetuning_jobs(metadata: dict, limit: int = 10) -> list:
+    """
+    Return the fine-tuning jobs created with the given metadata, newest first.
+
+    Args:
+        metadata (dict): Metadata key-value pairs the jobs were created with.
+        limit (int): Maximum number of jobs returned.
+    """
+    page = limited_call(
+        "fine_tuning.jobs.list",
+        None,
+        get_client().fine_tuning.jobs.with_raw_response.list,
+        metadata=metadata,
+        limit=limit,
+    )
+    # Not every provider applies the metadata filter, so it is checked here as well
+    return [job for job in page.data
+            if all((job.metadata or {}).get(key) == value for key, value in metadata.items())]
+
+
 def query_fted_model_chat_completion(model_id,
                      user_query,
                      system_role_content="You are a helpful assistant.",
@@ -43,6 +82,10 @@ def query_fted_model_chat_completion(model_id,
                      ):
     """
     Query the fine-tuned model with a user query and return the response.
+    Temperature 0 requests are served from and stored in the response cache (see `response_cache`).
+    Latency, token usage and rate-limit headers of the call are recorded (see `instrumentation`).
+    The call waits for the rate limits of the model and is retried on transient errors (see `rate_limiter`);
+    slow temperature 0 calls can be hedged with a duplicate request (see `hedging`).
     
     Args:
         model_id (str): The ID of the fine-tuned model.
@@ -56,18 +99,75 @@ def query_fted_model_chat_completion(model_id,
         list: A list of responses from the model. The size of the list is equal to num_responses.
 
     """
-    completion = client.chat.completions.create(
+    request = _chat_completion_request(model_id, user_query, system_role_content, temperature, num_responses)
+    cache = get_response_cache() if _is_cacheable(temperature) else None
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            return cached
+
+    completion = get_hedger().call(
+        "chat.completions",
+        model_id,
+        get_client().chat.completions.with_raw_response.create,
+        temperature,
         model=model_id,
         n=num_responses,
         temperature=temperature,
-        messages=[
-            {"role": "system", "content": system_role_content},
-            {"role": "user", "content": user_query}],
+        messages=request["messages"],
             # response_format={"type": "json_object"}
             )
     responses = []
     for i in range(num_responses):
         responses.append(completion.choices[i].message.content)
+
+    if cache is not None:
+        cache.put(request, responses)
+    return responses
+
+
+async def query_fted_model_chat_completion_async(model_id,
+                                                 user_query,
+                                                 system_role_content="You are a helpful assistant.",
+                                                 temperature=0.0,
+                                                 num_responses=1,
+                                                 ):
+    """
+    Async counterpart of `query_fted_model_chat_completion` using the shared AsyncOpenAI client.
+
+    Args:
+        model_id (str): The ID of the fine-tuned model.
+        user_query (str): The user's query.
+        system_role_content (str): The system role content for the prompt.
+        temperature (float): Sampling temperature. Must be between 0 and 2.
+        num_responses (int): The number of responses to generate. Default is 1.
+
+    Returns:
+        list: A list of responses from the model. The size of the list is equal to num_responses.
+    """
+    request = _chat_completion_request(model_id, user_query, system_role_content, temperature, num_responses)
+    cache = get_response_cache() if _is_cacheable(temperature) else None
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            return cached
+
+    completion = await get_hedger().call_async(
+        "chat.completions",
+        model_id,
+        get_async_client().chat.completions.with_raw_response.create,
+        temperature,
+        model=model_id,
+        n=num_responses,
+        temperature=temperature,
+        messages=request["messages"],
+            )
+    responses = []
+    for i in range(num_responses):
+        responses.append(completion.choices[i].message.content)
+
+    if cache is not None:
+        cache.put(request, responses)
     return responses
 
 
@@ -92,13 +192,32 @@ def query_fted_model_responses(model_id,
     Returns:
         list: A list of responses from the model. The size of the list is equal to num_responses.
     """
-    response = client.responses.create(
-        model=model_id,
-        temperature=temperature,
-        input=[
+    request = {
+        "endpoint": "responses",
+        "model": model_id,
+        "temperature": temperature,
+        "input": [
             {"role": "system", "content": system_role_content},
             {"role": "user", "content": user_query}],
+    }
+    cache = get_response_cache() if _is_cacheable(temperature) else None
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            return cached
+
+    response = get_hedger().call(
+        "responses",
+        model_id,
+        get_client().responses.with_raw_response.create,
+        temperature,
+        model=model_id,
+        temperature=temperature,
+        input=request["input"],
             )
+
+    if cache is not None:
+        cache.put(request, response.output_text)
     return response.output_text
 
 
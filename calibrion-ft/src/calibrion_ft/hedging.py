@@ -0,0 +1,311 @@
+"""
+Per-request deadlines and hedged requests for model queries.
+
+A deadline bounds a model query as a whole: waiting for the rate limits, every attempt and
+the backoff between retries by `rate_limiter` all end `deadline_s` seconds after the query
+started. Each attempt gets the remaining time as its timeout, and a query that cannot be
+answered in time fails instead of costing the full read timeout of the transport per retry.
+
+Hedging sends a second, identical request when the first one has not answered after the
+`delay_percentile` (p95) latency of its model, and uses whichever answer arrives first.
+It only applies to temperature 0 queries, whose answers are interchangeable. A hedge is
+only sent if the rate limiter can take it right away, and hedges are capped at
+`max_hedge_ratio` of the eligible requests, so hedging never makes a caller wait for
+quota or pushes a slow provider further over its limits. Hedges do not count against the
+concurrency limits of step 3, and both requests share the deadline of the query. The
+losing request is left to finish in the background, so that the latency a won hedge saved
+can be measured.
+
+The hedge delay counts from when the first request has its quota: the caller waits for the
+rate limits itself and then starts the request. Synchronous queries run both requests on
+threads of their own, so there is no pool that caps how many queries are hedged at once or
+that requests queue in.
+
+Hedge counters (sent, won, skipped, latency saved) are logged at the end of step 3.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Optional
+
+from .instrumentation import get_provider_metrics
+from .logging_config import setup_logger
+from .rate_limiter import call_within_limits, call_within_limits_async, get_rate_limiter
+
+logger = setup_logger(log_level=logging.INFO)
+
+# Latency percentile of a model after which a hedge is sent
+DEFAULT_DELAY_PERCENTILE = 95
+
+# Lower bound of the hedge delay in seconds, so that fast models are not hedged on jitter
+DEFAULT_MIN_DELAY = 1.0
+
+# Timed calls of a model needed before its latency percentile is trusted
+DEFAULT_MIN_SAMPLES = 20
+
+# Maximum share of eligible requests that get a hedge
+DEFAULT_MAX_HEDGE_RATIO = 0.1
+
+
+def _in_thread(function, *args) -> Future:
+    """Run `function(*args)` on a new daemon thread and return a future of its result."""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="hedged-request", daemon=True).start()
+    return future
+
+
+class Hedger:
+    """
+    Deadlines and hedging of model queries, with counters of how hedging worked out.
+
+    Args:
+        enabled: Send hedges for temperature 0 queries. Deadlines apply either way.
+        deadline_s: Seconds a query may take in total, retries included. None for no deadline.
+        delay_percentile: Latency percentile of the model after which a hedge is sent.
+        min_delay_s: Lower bound of the hedge delay in seconds.
+        min_samples: Timed calls of a model needed before it is hedged.
+        max_hedge_ratio: Maximum share of eligible requests that get a hedge.
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 deadline_s: Optional[float] = None,
+                 delay_percentile: float = DEFAULT_DELAY_PERCENTILE,
+                 min_delay_s: float = DEFAULT_MIN_DELAY,
+                 min_samples: int = DEFAULT_MIN_SAMPLES,
+                 max_hedge_ratio: float = DEFAULT_MAX_HEDGE_RATIO):
+        if deadline_s is not None and deadline_s <= 0:
+            raise ValueError(f"deadline_s must be positive, got {deadline_s}")
+        if not 0 <= max_hedge_ratio <= 1:
+            raise ValueError(f"max_hedge_ratio must be between 0 and 1, got {max_hedge_ratio}")
+        self.enabled = enabled
+        self.deadline_s = deadline_s
+        self.delay_percentile = delay_percentile
+        self.min_delay_s = min_delay_s
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self._lock = threading.Lock()
+        self.eligible = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped_ratio = 0
+        self.skipped_rate_limit = 0
+        self.latency_saved_s = 0.0
+        self.saved_measured = 0
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Return the seconds after which a query of a model is hedged, or None if its latency is not known yet."""
+        latency, timed = get_provider_metrics().model_latency(model, self.delay_percentile)
+        if latency is None or timed < self.min_samples:
+            return None
+        return max(self.min_delay_s, latency)
+
+    def _deadline(self) -> Optional[float]:
+        return time.monotonic() + self.deadline_s if self.deadline_s is not None else None
+
+    def _count_eligible(self) -> None:
+        with self._lock:
+            self.eligible += 1
+
+    def _take_hedge(self, model: str, estimated_tokens: int) -> bool:
+        """Return True if a hedge may be sent now, having taken it from the rate limits of the model."""
+        return self._reserve_hedge() and self._hedge_acquired(get_rate_limiter().try_acquire(model, estimated_tokens))
+
+    async def _take_hedge_async(self, model: str, estimated_tokens: int) -> bool:
+        """Async counterpart of `_take_hedge`."""
+        return (self._reserve_hedge()
+                and self._hedge_acquired(await get_rate_limiter().try_acquire_async(model, estimated_tokens)))
+
+    def _reserve_hedge(self) -> bool:
+        # The hedge is reserved before the rate limits are asked, so that concurrent queries cannot exceed the ratio
+        with self._lock:
+            if self.hedged + 1 > self.max_hedge_ratio * self.eligible:
+                self.skipped_ratio += 1
+                return False
+            self.hedged += 1
+            return True
+
+    def _hedge_acquired(self, wait: float) -> bool:
+        """Keep a reserved hedge if the rate limits took it without a wait, else give the reservation back."""
+        if wait > 0:
+            with self._lock:
+                self.hedged -= 1
+                self.skipped_rate_limit += 1
+            return False
+        return True
+
+    def _record_winner(self, hedge_won: bool) -> None:
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def _saving_recorder(self, hedge_answered_at: float):
+        """Return a done callback for a primary attempt beaten by its hedge that records the latency saved."""
+        def done(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            with self._lock:
+                self.latency_saved_s += time.perf_counter() - hedge_answered_at
+                self.saved_measured += 1
+        return done
+
+    def call(self, endpoint: str, model: str, call, temperature: float, /, **kwargs):
+        """
+        Make a model query through `rate_limiter.call_within_limits` with the deadline and,
+        for temperature 0 queries, a hedge after the hedge delay of the model. The first request
+        is sent from a thread of its own once the caller has taken its quota, so that the caller
+        can return the hedge's answer while the first request is still running.
+
+        Returns:
+            The parsed response of the first attempt that succeeded.
+        """
+        deadline = self._deadline()
+        delay = self.hedge_delay(model) if self.enabled and temperature == 0 else None
+        if self.enabled and temperature == 0:
+            self._count_eligible()
+        if delay is None:
+            return call_within_limits(endpoint, model, call, (), kwargs, deadline=deadline)
+
+        limiter = get_rate_limiter()
+        estimated_tokens = limiter.estimate_tokens(model, kwargs)
+        limiter.acquire(model, estimated_tokens, deadline)
+        primary = _in_thread(call_within_limits, endpoint, model, call, (), kwargs, estimated_tokens, True, deadline)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge(model, estimated_tokens):
+            return primary.result()
+        hedge = _in_thread(call_within_limits, endpoint, model, call, (), kwargs, estimated_tokens, True, deadline)
+
+        pending = {primary, hedge}
+        errors = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                self._record_winner(future is hedge)
+                if future is hedge:
+                    primary.add_done_callback(self._saving_recorder(time.perf_counter()))
+                return future.result()
+        raise errors[0]
+
+    async def call_async(self, endpoint: str, model: str, call, temperature: float, /, **kwargs):
+        """Async counterpart of `call`."""
+        deadline = self._deadline()
+        delay = self.hedge_delay(model) if self.enabled and temperature == 0 else None
+        if self.enabled and temperature == 0:
+            self._count_eligible()
+        if delay is None:
+            return await call_within_limits_async(endpoint, model, call, (), kwargs, deadline=deadline)
+
+        limiter = get_rate_limiter()
+        estimated_tokens = limiter.estimate_tokens(model, kwargs)
+        await limiter.acquire_async(model, estimated_tokens, deadline)
+        primary = asyncio.ensure_future(call_within_limits_async(endpoint, model, call, (), kwargs,
+                                                                 estimated_tokens, True, deadline))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not await self._take_hedge_async(model, estimated_tokens):
+                return await primary
+            hedge = asyncio.ensure_future(call_within_limits_async(endpoint, model, call, (), kwargs,
+                                                                   estimated_tokens, True, deadline))
+            pending.add(hedge)
+            errors = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    self._record_winner(task is hedge)
+                    if task is hedge:
+                        primary.add_done_callback(self._saving_recorder(time.perf_counter()))
+                    # The loser keeps running in the background
+                    for loser in pending:
+                        _background_tasks.add(loser)
+                        loser.add_done_callback(_background_tasks.discard)
+                    pending = set()
+                    return task.result()
+            raise errors[0]
+        except asyncio.CancelledError:
+            for task in pending:
+                task.cancel()
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "eligible": self.eligible,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.eligible if self.eligible else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "skipped_ratio": self.skipped_ratio,
+                "skipped_rate_limit": self.skipped_rate_limit,
+                "latency_saved_s": self.latency_saved_s,
+                "mean_latency_saved_s": self.latency_saved_s / self.saved_measured if self.saved_measured else None,
+            }
+
+    def log_stats(self) -> None:
+        """Log the hedge counters, if hedging is enabled."""
+        if not self.enabled:
+            return
+        stats = self.stats()
+        mean_saved = (f"{stats['mean_latency_saved_s']:.2f}s per measured win"
+                      if stats["mean_latency_saved_s"] is not None else "n/a")
+        logger.info(f"Hedging: {stats['hedged']} hedges for {stats['eligible']} requests "
+                    f"({stats['hedge_rate']:.1%}), {stats['hedge_wins']} won by the hedge, "
+                    f"{stats['skipped_ratio'] + stats['skipped_rate_limit']} skipped "
+                    f"({stats['skipped_rate_limit']} for the rate limits), "
+                    f"latency saved {stats['latency_saved_s']:.1f}s ({mean_saved})")
+
+
+# Losing attempts of async hedged queries, referenced until they finish
+_background_tasks = set()
+
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+
+def configure_hedging(enabled: bool = True,
+                      deadline_s: Optional[float] = None,
+                      delay_percentile: float = DEFAULT_DELAY_PERCENTILE,
+                      min_delay_s: float = DEFAULT_MIN_DELAY,
+                      min_samples: int = DEFAULT_MIN_SAMPLES,
+                      max_hedge_ratio: float = DEFAULT_MAX_HEDGE_RATIO) -> Hedger:
+    """
+    Replace the process-wide hedger used by the `finetuning` query functions. See `Hedger` for the arguments.
+
+    Returns:
+        The newly configured Hedger.
+    """
+    global _hedger
+    with _hedger_lock:
+        _hedger = Hedger(enabled=enabled,
+                         deadline_s=deadline_s,
+                         delay_percentile=delay_percentile,
+                         min_delay_s=min_delay_s,
+                         min_samples=min_samples,
+                         max_hedge_ratio=max_hedge_ratio)
+        return _hedger
+
+
+def get_hedger() -> Hedger:
+    """Return the process-wide hedger, creating one without hedging or deadlines on first use."""
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger()
+        return _hedger
@@ -0,0 +1,430 @@
+"""
+Latency, token and rate-limit instrumentation of provider calls.
+
+Every provider call goes through `instrumented_call` (or `instrumented_call_async`), which
+requests the raw HTTP response to read the token usage, the number of retries the client
+took and the `x-ratelimit-*` headers, and times the call including its retries. Counters
+are kept per model and per endpoint:
+
+- requests, errors, rate-limited (429) errors and retries
+- a latency histogram with fixed, log-spaced buckets (p50/p95/p99 are read from it)
+- prompt and completion tokens, tokens per second and the estimated cost
+- the rate-limit headroom: the lowest share of remaining requests and tokens seen
+
+The counters of every process are added to `_provider_metrics.json`, which also holds a
+readable summary. Fixed buckets make the histograms of several processes (e.g. work queue
+workers) mergeable. Writers hold a lock file (`_provider_metrics.json.lock`) while they read,
+merge and replace the file. The file covers one run: `ProviderMetrics.start_run` starts it over when a
+pipeline run or a work queue submission starts querying models.
+"""
+
+import bisect
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where only the writers of one process are serialized
+    fcntl = None
+
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+METRICS_PATH = Path(__file__).parent / "_provider_metrics.json"
+
+# Upper bounds of the latency histogram buckets in seconds, 25% apart from 10 ms to 10 min;
+# percentiles read from the histogram are accurate to about 12%
+LATENCY_BUCKETS = [0.01 * 1.25 ** i for i in range(int(math.log(60000) / math.log(1.25)) + 2)]
+
+PERCENTILES = (50, 95, 99)
+
+
+def _empty_stats() -> dict:
+    return {
+        "requests": 0,
+        "errors": 0,
+        "rate_limited": 0,
+        "retries": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "latency_sum": 0.0,
+        "latency_min": None,
+        "latency_max": None,
+        "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+        "request_headroom": None,
+        "token_headroom": None,
+        "first_started_at": None,
+        "last_finished_at": None,
+    }
+
+
+def _min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def merge_stats(a: dict, b: dict) -> dict:
+    """Return the combined counters of two stats dictionaries."""
+    merged = {key: a[key] + b[key] for key in ("requests", "errors", "rate_limited", "retries",
+                                                "prompt_tokens", "completion_tokens", "latency_sum")}
+    merged["latency_buckets"] = [x + y for x, y in zip(a["latency_buckets"], b["latency_buckets"])]
+    for key in ("latency_min", "request_headroom", "token_headroom", "first_started_at"):
+        merged[key] = _min(a[key], b[key])
+    for key in ("latency_max", "last_finished_at"):
+        merged[key] = _max(a[key], b[key])
+    return merged
+
+
+def _subtract_stats(a: dict, b: dict) -> dict:
+    """Return the counters added to `a` since the snapshot `b`; min/max values are kept from `a`."""
+    delta = dict(a)
+    for key in ("requests", "errors", "rate_limited", "retries", "prompt_tokens", "completion_tokens", "latency_sum"):
+        delta[key] = a[key] - b[key]
+    delta["latency_buckets"] = [x - y for x, y in zip(a["latency_buckets"], b["latency_buckets"])]
+    return delta
+
+
+def latency_percentile(stats: dict, percentile: float) -> Optional[float]:
+    """Return a latency percentile in seconds from the histogram, interpolated within its bucket."""
+    timed = sum(stats["latency_buckets"])
+    if not timed:
+        return None
+    rank = percentile / 100 * timed
+    cumulative = 0
+    for index, count in enumerate(stats["latency_buckets"]):
+        if count and cumulative + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index > 0 else 0.0
+            upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else stats["latency_max"]
+            value = lower + (upper - lower) * (rank - cumulative) / count
+            return min(max(value, stats["latency_min"]), stats["latency_max"])
+        cumulative += count
+    return stats["latency_max"]
+
+
+def base_model(model: str) -> str:
+    """Return the base model of a fine-tuned model ID ("ft:<base>:<org>:<suffix>:<id>"), or the model itself."""
+    if model and model.startswith("ft:"):
+        return model.split(":")[1]
+    return model
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Estimate the inference cost in USD from `training_configs.llm_inference_prices`, or None if unknown."""
+    from .training_configs import llm_inference_prices
+
+    prices = llm_inference_prices.get(base_model(model))
+    if prices is None:
+        return None
+    input_price, output_price = prices
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def summarize(stats: dict, model: str = None) -> dict:
+    """Return the readable summary of a stats dictionary."""
+    summary = {
+        "requests": stats["requests"],
+        "errors": stats["errors"],
+        "rate_limited": stats["rate_limited"],
+        "retries": stats["retries"],
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": stats["completion_tokens"],
+    }
+    timed = sum(stats["latency_buckets"])
+    summary["latency_mean_s"] = stats["latency_sum"] / timed if timed else None
+    for percentile in PERCENTILES:
+        summary[f"latency_p{percentile}_s"] = latency_percentile(stats, percentile)
+    summary["output_tokens_per_second"] = (stats["completion_tokens"] / stats["latency_sum"]
+                                           if stats["latency_sum"] else None)
+    wall_time = (stats["last_finished_at"] - stats["first_started_at"]
+                 if stats["first_started_at"] is not None and stats["last_finished_at"] is not None else 0)
+    summary["throughput_tokens_per_second"] = ((stats["prompt_tokens"] + stats["completion_tokens"]) / wall_time
+                                               if wall_time > 0 else None)
+    summary["cost_usd"] = estimate_cost(model, stats["prompt_tokens"], stats["completion_tokens"]) if model else None
+    summary["request_headroom"] = stats["request_headroom"]
+    summary["token_headroom"] = stats["token_headroom"]
+    return summary
+
+
+def _header_ratio(headers, remaining_header: str, limit_header: str) -> Optional[float]:
+    try:
+        return int(headers[remaining_header]) / int(headers[limit_header])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _retries_taken(raw_response) -> int:
+    retries = getattr(raw_response, "retries_taken", None)
+    if retries is None:
+        # The client sends the number of the attempt with every request
+        retries = raw_response.http_request.headers.get("x-stainless-retry-count", 0)
+    return int(retries)
+
+
+# Serializes the writers of this process; the lock file serializes processes
+_file_lock = threading.Lock()
+
+
+@contextmanager
+def _locked(path: Path):
+    """Hold the lock of a metrics file, in this process and across processes."""
+    with _file_lock, open(path.with_name(path.name + ".lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ProviderMetrics:
+    """Thread-safe per-model and per-endpoint counters of provider calls."""
+
+    def __init__(self):
+        self.models = {}
+        self.endpoints = {}
+        self._flushed_models = {}
+        self._flushed_endpoints = {}
+        self._lock = threading.Lock()
+
+    def _buckets(self, endpoint: str, model: Optional[str]) -> list[dict]:
+        buckets = [self.endpoints.setdefault(endpoint, _empty_stats())]
+        if model:
+            buckets.append(self.models.setdefault(model, _empty_stats()))
+        return buckets
+
+    def record(self,
+               endpoint: str,
+               model: Optional[str] = None,
+               started_at: Optional[float] = None,
+               latency: Optional[float] = None,
+               prompt_tokens: int = 0,
+               completion_tokens: int = 0,
+               retries: int = 0,
+               headers=None,
+               error: Optional[Exception] = None) -> None:
+        """
+        Count one provider call.
+
+        Args:
+            endpoint: API endpoint, e.g. "chat.completions".
+            model: Model the call was made for, if any.
+            started_at: Wall-clock start of the call (time.time()).
+            latency: Duration of the call in seconds, including retries. None for calls without
+                a latency of their own, e.g. the requests of a batch.
+            prompt_tokens, completion_tokens: Token usage reported by the provider.
+            retries: Number of retries the client took.
+            headers: Response headers, read for `x-ratelimit-*` headroom.
+            error: The exception the call raised, if it failed.
+        """
+        status_code = getattr(error, "status_code", None)
+        if headers is None and error is not None and getattr(error, "response", None) is not None:
+            headers = error.response.headers
+        request_headroom = token_headroom = None
+        if headers is not None:
+            request_headroom = _header_ratio(headers, "x-ratelimit-remaining-requests", "x-ratelimit-limit-requests")
+            token_headroom = _header_ratio(headers, "x-ratelimit-remaining-tokens", "x-ratelimit-limit-tokens")
+        with self._lock:
+            for stats in self._buckets(endpoint, model):
+                stats["requests"] += 1
+                stats["errors"] += error is not None
+                stats["rate_limited"] += status_code == 429
+                stats["retries"] += retries
+                stats["prompt_tokens"] += prompt_tokens
+                stats["completion_tokens"] += completion_tokens
+                if latency is not None:
+                    stats["latency_sum"] += latency
+                    stats["latency_min"] = _min(stats["latency_min"], latency)
+                    stats["latency_max"] = _max(stats["latency_max"], latency)
+                    stats["latency_buckets"][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+                stats["request_headroom"] = _min(stats["request_headroom"], request_headroom)
+                stats["token_headroom"] = _min(stats["token_headroom"], token_headroom)
+                if started_at is not None:
+                    stats["first_started_at"] = _min(stats["first_started_at"], started_at)
+                    stats["last_finished_at"] = _max(stats["last_finished_at"], started_at + (latency or 0))
+
+    def record_retry(self, endpoint: str, model: Optional[str] = None) -> None:
+        """Count a retry of a failed call that was made outside of the client (see `rate_limiter`)."""
+        with self._lock:
+            for stats in self._buckets(endpoint, model):
+                stats["retries"] += 1
+
+    def model_latency(self, model: str, percentile: float) -> tuple[Optional[float], int]:
+        """Return a latency percentile of the calls of a model in seconds (None if there are none) and the number of timed calls."""
+        with self._lock:
+            stats = self.models.get(model)
+            if stats is None:
+                return None, 0
+            return latency_percentile(stats, percentile), sum(stats["latency_buckets"])
+
+    def summary(self) -> dict:
+        """Return the summary of this process's calls: {"models": {...}, "endpoints": {...}, "total": {...}}."""
+        with self._lock:
+            return _summary_of(self.models, self.endpoints)
+
+    def log_stats(self) -> None:
+        """Log the summary of every model."""
+        for model, summary in self.summary()["models"].items():
+            logger.info(_format_summary(model, summary))
+
+    def start_run(self, path: Path = METRICS_PATH) -> None:
+        """
+        Start the metrics file over for a new run. Calls counted by this process before
+        are not added to the new file.
+        """
+        path = Path(path)
+        with _locked(path):
+            path.unlink(missing_ok=True)
+        with self._lock:
+            self._flushed_models = json.loads(json.dumps(self.models))
+            self._flushed_endpoints = json.loads(json.dumps(self.endpoints))
+
+    def write(self, path: Path = METRICS_PATH) -> dict:
+        """
+        Add the calls counted since the last write to the metrics file and return its summary.
+
+        The file is read, merged and replaced under its lock, so concurrent writers of this and
+        other processes do not lose each other's updates.
+        """
+        path = Path(path)
+        with self._lock:
+            models = {model: _subtract_stats(stats, self._flushed_models.get(model, _empty_stats()))
+                      for model, stats in self.models.items()}
+            endpoints = {endpoint: _subtract_stats(stats, self._flushed_endpoints.get(endpoint, _empty_stats()))
+                         for endpoint, stats in self.endpoints.items()}
+            self._flushed_models = json.loads(json.dumps(self.models))
+            self._flushed_endpoints = json.loads(json.dumps(self.endpoints))
+
+        with _locked(path):
+            data = load_metrics(path)
+            stored_models = data.get("models", {})
+            stored_endpoints = data.get("endpoints", {})
+            for model, stats in models.items():
+                stored_models[model] = merge_stats(stored_models.get(model, _empty_stats()), stats)
+            for endpoint, stats in endpoints.items():
+                stored_endpoints[endpoint] = merge_stats(stored_endpoints.get(endpoint, _empty_stats()), stats)
+            data = {"summary": _summary_of(stored_models, stored_endpoints),
+                    "models": stored_models,
+                    "endpoints": stored_endpoints}
+            # A temporary file of its own, so that a crashed writer never leaves a shared one behind
+            with tempfile.NamedTemporaryFile("w", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp",
+                                             delete=False) as f:
+                json.dump(data, f, indent=4)
+            os.replace(f.name, path)
+        logger.info(f"Provider metrics written to {path}")
+        return data["summary"]
+
+
+def _summary_of(models: dict, endpoints: dict) -> dict:
+    total = _empty_stats()
+    for stats in endpoints.values():
+        total = merge_stats(total, stats)
+    total_summary = summarize(total)
+    costs = [summarize(stats, model)["cost_usd"] for model, stats in models.items()]
+    total_summary["cost_usd"] = sum(cost for cost in costs if cost is not None) if costs else None
+    return {
+        "models": {model: summarize(stats, model) for model, stats in models.items()},
+        "endpoints": {endpoint: summarize(stats) for endpoint, stats in endpoints.items()},
+        "total": total_summary,
+    }
+
+
+def _format_summary(name: str, summary: dict) -> str:
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else "n/a"
+
+    cost = f"${summary['cost_usd']:.4f}" if summary.get("cost_usd") is not None else "n/a"
+    return (f"Provider calls for {name}: {summary['requests']} requests, {summary['errors']} errors "
+            f"({summary['rate_limited']} rate limited), {summary['retries']} retries, "
+            f"latency p50/p95/p99 {seconds(summary['latency_p50_s'])}/{seconds(summary['latency_p95_s'])}/"
+            f"{seconds(summary['latency_p99_s'])}, {summary['prompt_tokens']} prompt + "
+            f"{summary['completion_tokens']} completion tokens, cost {cost}")
+
+
+def load_metrics(path: Path = METRICS_PATH) -> dict:
+    """Return the content of the metrics file, or an empty dictionary if it does not exist."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def wandb_metrics(ft_model_id: str, path: Path = METRICS_PATH) -> dict:
+    """Return the summary of one model from the metrics file as flat W&B metrics ("provider/..."), or {}."""
+    summary = load_metrics(path).get("summary", {}).get("models", {}).get(ft_model_id)
+    if not summary:
+        return {}
+    return {f"provider/{key}": value for key, value in summary.items() if value is not None}
+
+
+_provider_metrics = ProviderMetrics()
+
+
+def get_provider_metrics() -> ProviderMetrics:
+    """Return the process-wide provider call counters."""
+    return _provider_metrics
+
+
+def _record_response(endpoint: str, model: Optional[str], started_at: float, latency: float, raw_response):
+    result = raw_response.parse()
+    usage = getattr(result, "usage", None)
+    _provider_metrics.record(endpoint,
+                             model,
+                             started_at=started_at,
+                             latency=latency,
+                             # Chat completions report prompt/completion tokens, the Responses API input/output tokens
+                             prompt_tokens=getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", 0) or 0,
+                             completion_tokens=(getattr(usage, "completion_tokens", None)
+                                                or getattr(usage, "output_tokens", 0) or 0),
+                             retries=_retries_taken(raw_response),
+                             headers=raw_response.headers)
+    return result
+
+
+def instrumented_call(endpoint: str, model: Optional[str], call, /, *args, **kwargs):
+    """
+    Make a provider call through its `with_raw_response` variant and count it.
+
+    Args:
+        endpoint: API endpoint, e.g. "chat.completions".
+        model: Model the call was made for, if any.
+        call: The raw-response method, e.g. `client.chat.completions.with_raw_response.create`.
+        *args, **kwargs: Arguments of the call.
+
+    Returns:
+        The parsed response, as returned by the plain method.
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        raw_response = call(*args, **kwargs)
+    except Exception as e:
+        _provider_metrics.record(endpoint, model, started_at=started_at, latency=time.perf_counter() - start, error=e)
+        raise
+    return _record_response(endpoint, model, started_at, time.perf_counter() - start, raw_response)
+
+
+async def instrumented_call_async(endpoint: str, model: Optional[str], call, /, *args, **kwargs):
+    """Async counterpart of `instrumented_call`."""
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        raw_response = await call(*args, **kwargs)
+    except Exception as e:
+        _provider_metrics.record(endpoint, model, started_at=started_at, latency=time.perf_counter() - start, error=e)
+        raise
+    return _record_response(endpoint, model, started_at, time.perf_counter() - start, raw_response)
@@ -0,0 +1,304 @@
+"""
+Admission-controlled submission of fine-tuning jobs.
+
+Configurations wait in a queue and are only submitted while fewer than
+`max_concurrent_jobs` jobs are active and the estimated spend of the sweep stays
+below `max_estimated_spend`. A job that the provider rejects because of its own
+concurrency limit goes back to the front of the queue.
+
+The queue is persisted in `_ft_job_queue.json` after every change and every
+submitted experiment is added to the experiment store right away, so a long sweep
+survives restarts without losing or re-submitting jobs. A configuration is moved to
+"submitting" under a fresh experiment ID before its job is created, and the job
+carries that ID in its metadata; a submission interrupted by a crash or an ambiguous
+error is reconciled by looking the job up at the provider instead of creating it again.
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Optional
+
+import shortuuid
+
+from .experiment_store import get_experiment_store
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+QUEUE_PATH = Path(__file__).parent / "_ft_job_queue.json"
+
+# Metadata key of a fine-tuning job holding the experiment ID it was submitted for
+EXPERIMENT_ID_METADATA_KEY = "experiment_id"
+
+# Pass as `max_estimated_spend` to submit every configuration regardless of its estimated cost
+NO_SPEND_CAP = float("inf")
+
+
+def _empty_queue() -> dict:
+    return {"pending": [], "submitting": {}, "active": {}, "skipped": [], "estimated_spend": 0.0}
+
+
+def _write_json(path: Path, data) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    tmp_path.replace(path)
+
+
+def _is_capacity_error(e: Exception) -> bool:
+    """Return True if the provider rejected a job because too many jobs are active or rate limited."""
+    import openai
+
+    return isinstance(e, openai.RateLimitError) or (isinstance(e, openai.APIStatusError) and e.status_code == 429)
+
+
+def has_pending_submissions(queue_path: Path = QUEUE_PATH) -> bool:
+    """Return True if a persisted queue with configurations still to submit (or to reconcile) exists."""
+    if not Path(queue_path).exists():
+        return False
+    with open(queue_path, "r") as f:
+        queue = json.load(f)
+    return bool(queue["pending"] or queue.get("submitting"))
+
+
+class JobSubmitter:
+    """
+    Submit fine-tuning jobs from a persistent queue under concurrency and budget caps.
+
+    Args:
+        max_concurrent_jobs: Maximum number of active (not yet finished) jobs.
+        max_estimated_spend: Maximum estimated spend of the sweep in USD. None or NO_SPEND_CAP disables the cap.
+        hourly_prices: Training price in USD per hour for each model. Configurations of other models
+            are submitted without a cost estimate.
+        estimated_training_hours: Assumed duration of a single job in hours.
+        poll_interval: Fixed seconds between two checks of the active jobs while at capacity.
+            None derives the delay from the job states (see `step_2_update_experiments.next_poll_delay`).
+        queue_path: Path of the persisted queue.
+    """
+
+    def __init__(self,
+                 max_concurrent_jobs: int,
+                 max_estimated_spend: Optional[float],
+                 hourly_prices: dict,
+                 estimated_training_hours: float,
+                 poll_interval: Optional[float] = None,
+                 queue_path: Path = QUEUE_PATH):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_estimated_spend = None if max_estimated_spend == NO_SPEND_CAP else max_estimated_spend
+        self.hourly_prices = hourly_prices
+        self.estimated_training_hours = estimated_training_hours
+        self.poll_interval = poll_interval
+        self.queue_path = Path(queue_path)
+        self.queue = _empty_queue()
+        self._unpriced_models = set()
+
+    def estimate_cost(self, config: dict) -> Optional[float]:
+        """Estimate the training cost of a configuration in USD, or return None if the model has no known price."""
+        # A configuration that continues from a fine-tuned model is priced as its base model
+        model = config.get("base_model", config["model"])
+        if model not in self.hourly_prices:
+            if model not in self._unpriced_models:
+                self._unpriced_models.add(model)
+                logger.warning(f"No hourly price known for model {model}, its jobs are submitted "
+                               f"without a cost check")
+            return None
+        return self.hourly_prices[model] * self.estimated_training_hours
+
+    def load(self) -> None:
+        if self.queue_path.exists():
+            with open(self.queue_path, "r") as f:
+                self.queue = {**_empty_queue(), **json.load(f)}
+
+    def _save(self) -> None:
+        _write_json(self.queue_path, self.queue)
+
+    def enqueue(self, training_configurations: list[dict], new_sweep: bool = True) -> None:
+        """
+        Add configurations to the queue.
+
+        Args:
+            training_configurations (list[dict]): Configurations to submit.
+            new_sweep (bool): Start a new sweep, replacing the previous queue, its spend and
+                the experiment store. If False, the configurations are appended to the current sweep.
+        """
+        if new_sweep and not training_configurations:
+            logger.warning("No configurations to submit, keeping the current sweep")
+            return
+        if new_sweep:
+            self.queue = _empty_queue()
+            get_experiment_store().replace_all({})
+        else:
+            self.load()
+        self.queue["pending"].extend(training_configurations)
+        self._save()
+
+    def _refresh_active(self) -> list:
+        """Drop finished jobs from the active set and return the jobs that are still running."""
+        from .step_2_update_experiments import FAILED_JOB_STATUSES, SUCCEEDED_JOB_STATUS, retrieve_jobs
+
+        jobs = retrieve_jobs(list(self.queue["active"].values()))
+        running = []
+        for exp_id, ft_job_id in list(self.queue["active"].items()):
+            job = jobs[ft_job_id]
+            if isinstance(job, Exception):
+                running.append(None)
+            elif job.status == SUCCEEDED_JOB_STATUS or job.status in FAILED_JOB_STATUSES:
+                logger.info(f"Job {ft_job_id} finished with status {job.status}, freeing a slot")
+                del self.queue["active"][exp_id]
+            else:
+                running.append(job)
+        self._save()
+        return running
+
+    def _wait(self, running_jobs: list) -> None:
+        from .step_2_update_experiments import next_poll_delay
+
+        delay = self.poll_interval
+        if delay is None:
+            delay = next_poll_delay([job for job in running_jobs if job is not None])
+        logger.info(f"{len(self.queue['active'])} active job(s), {len(self.queue['pending'])} pending, "
+                    f"checking again in {delay:.0f} seconds...")
+        time.sleep(delay)
+
+    def _record(self, experiment_id: str, ft_job_id: str) -> None:
+        """Add the job of a submitting configuration to the experiment store and mark it active."""
+        submission = self.queue["submitting"][experiment_id]
+        config = submission["config"]
+        if get_experiment_store().get(experiment_id) is None:
+            get_experiment_store().add(experiment_id, {
+                "model": config["model"],
+                "training_file": config["training_file"],
+                "training_file_oai_id": config["training_file_oai_id"],
+                "test_file": config["test_file"] if "test_file" in config else None,
+                "test_file_oai_id": config["test_file_oai_id"] if "test_file_oai_id" in config else None,
+                "hyperparameters": config["hyperparameters"],
+                "ft_job_id": ft_job_id,
+                **({"base_model": config["base_model"]} if "base_model" in config else {}),
+            })
+        del self.queue["submitting"][experiment_id]
+        self.queue["active"][experiment_id] = ft_job_id
+        self.queue["estimated_spend"] += submission["cost"]
+        self._save()
+        logger.info(f"Submitted experiment {experiment_id} as job {ft_job_id}")
+
+    def _reconcile(self, experiment_id: str) -> bool:
+        """
+        Look up the job of a submission whose outcome is unknown, in the experiment store and then
+        at the provider, and record it if it exists.
+
+        Returns:
+            bool: True if the job exists, False if it was never created.
+        """
+        from .finetuning import find_finetuning_jobs
+
+        experiment = get_experiment_store().get(experiment_id)
+        if experiment is not None:
+            self._record(experiment_id, experiment["ft_job_id"])
+            return True
+        jobs = find_finetuning_jobs({EXPERIMENT_ID_METADATA_KEY: experiment_id})
+        if jobs:
+            logger.info(f"Found job {jobs[0].id} of interrupted submission {experiment_id}")
+            self._record(experiment_id, jobs[0].id)
+            return True
+        return False
+
+    def _reconcile_all(self) -> None:
+        """Resolve the submissions left by an interrupted run, re-queueing those without a job."""
+        for experiment_id in reversed(list(self.queue["submitting"])):
+            if not self._reconcile(experiment_id):
+                logger.info(f"Submission {experiment_id} never created a job, re-queueing it")
+                self.queue["pending"].insert(0, self.queue["submitting"].pop(experiment_id)["config"])
+                self._save()
+
+    def _submit(self, config: dict, cost: float) -> Optional[bool]:
+        """
+        Submit the first pending configuration and record it in the experiment store.
+
+        The configuration is saved as submitting before the job is created, see the module docstring.
+
+        Returns:
+            bool: True if the job was created, False if the configuration was skipped after an error,
+            or None if the provider rejected the job for capacity and the configuration went back to the queue.
+        """
+        from .finetuning import run_finetuning
+
+        method_config = None if config["hyperparameters"] is None else {
+            "type": "supervised",
+            "supervised": {
+                "hyperparameters": config["hyperparameters"]
+            }
+        }
+        experiment_id = str(shortuuid.uuid())
+        self.queue["pending"].pop(0)
+        self.queue["submitting"][experiment_id] = {"config": config, "cost": cost}
+        self._save()
+        try:
+            response = run_finetuning(
+                model=config["model"],
+                training_file=config["training_file_oai_id"],
+                ft_method_config=method_config,
+                metadata={EXPERIMENT_ID_METADATA_KEY: experiment_id},
+            )
+        except Exception as e:
+            if _is_capacity_error(e):
+                logger.warning(f"Provider rejected job for capacity, re-queueing: {str(e)}")
+                self.queue["pending"].insert(0, self.queue["submitting"].pop(experiment_id)["config"])
+                self._save()
+                return None
+            logger.exception(f"Error running experiment with config {config}: {str(e)}")
+            # The job may have been created even though the call failed
+            try:
+                if self._reconcile(experiment_id):
+                    return True
+            except Exception as reconcile_error:
+                logger.error(f"Could not look up submission {experiment_id}, it is reconciled "
+                             f"on resume: {str(reconcile_error)}")
+                return False
+            self.queue["skipped"].append(self.queue["submitting"].pop(experiment_id)["config"])
+            self._save()
+            return False
+
+        self._record(experiment_id, response.id)
+        return True
+
+    def run(self) -> dict:
+        """
+        Submit every queued configuration, waiting for free slots as needed.
+
+        Returns:
+            dict: All experiments submitted by this queue, as stored in the experiment store.
+        """
+        self._reconcile_all()
+        running_jobs = []
+        while self.queue["pending"]:
+            if len(self.queue["active"]) >= self.max_concurrent_jobs:
+                running_jobs = self._refresh_active()
+                if len(self.queue["active"]) >= self.max_concurrent_jobs:
+                    self._wait(running_jobs)
+                    continue
+
+            config = self.queue["pending"][0]
+            if not all(key in config for key in ["model", "training_file", "training_file_oai_id", "hyperparameters"]):
+                logger.error(f"Missing required fields in config: {config}. Skipping this configuration.")
+                self.queue["skipped"].append(self.queue["pending"].pop(0))
+                self._save()
+                continue
+
+            cost = self.estimate_cost(config) or 0.0
+            if self.max_estimated_spend is not None and self.queue["estimated_spend"] + cost > self.max_estimated_spend:
+                logger.warning(f"Skipping config {config}: estimated spend would reach "
+                               f"${self.queue['estimated_spend'] + cost:.2f} (budget ${self.max_estimated_spend:.2f})")
+                self.queue["skipped"].append(self.queue["pending"].pop(0))
+                self._save()
+                continue
+
+            if self._submit(config, cost) is None:
+                # The provider is at its own limit: wait for one of our jobs to finish
+                running_jobs = self._refresh_active()
+                self._wait(running_jobs)
+
+        logger.info(f"All configurations processed, estimated spend ${self.queue['estimated_spend']:.2f}, "
+                    f"{len(self.queue['skipped'])} skipped")
+        return get_experiment_store().all()
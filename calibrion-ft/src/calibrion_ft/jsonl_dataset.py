@@ -0,0 +1,240 @@
+"""
+Memory-mapped JSONL datasets with a persisted line offset index.
+
+The byte offset of every line is computed once and stored next to the file in
+`<file>.idx`, so opening a multi-GB split is instant and any example can be read
+in O(1) without scanning the file. Lines are decoded only when they are accessed.
+The SHA-256 of the file is computed during the same scan and kept in the index.
+
+Datapoint IDs are 1-based line numbers, as in step 3's results.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+from array import array
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+# Suffix of the offset index stored next to each JSONL file
+INDEX_SUFFIX = ".idx"
+
+# Index header: magic, format version, mtime_ns and size of the indexed file, number of lines, SHA-256 of the file
+INDEX_MAGIC = b"JSONLIDX"
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct("<8sQQQQ32s")
+
+# Bytes scanned at once while building the index
+INDEX_CHUNK_SIZE = 64 << 20
+
+
+def _file_signature(path: Path) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def build_line_offsets(path: Path, sha256=None) -> array:
+    """
+    Return the byte offset of the start of every line of a file, as an array of unsigned 64-bit integers.
+
+    Args:
+        path (Path): Path of the file.
+        sha256: Optional `hashlib.sha256()` object, updated with the content of the file during the same scan.
+    """
+    import numpy as np
+
+    offsets = array("Q")
+    size = os.path.getsize(path)
+    if size == 0:
+        return offsets
+    offsets.append(0)
+    position = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(INDEX_CHUNK_SIZE):
+            if sha256 is not None:
+                sha256.update(chunk)
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            offsets.frombytes((newlines.astype(np.uint64) + np.uint64(position + 1)).tobytes())
+            position += len(chunk)
+    # A trailing newline does not start another line
+    if offsets[-1] == size:
+        offsets.pop()
+    return offsets
+
+
+def extract_example(data: dict) -> tuple[Optional[str], Optional[str]]:
+    """Return the first user and the first assistant message content of a chat example, in one pass."""
+    user_prompt = None
+    expected_response = None
+    for message in data.get("messages", ()):
+        role = message.get("role")
+        if role == "user" and user_prompt is None:
+            user_prompt = message.get("content")
+        elif role == "assistant" and expected_response is None:
+            expected_response = message.get("content")
+        if user_prompt is not None and expected_response is not None:
+            break
+    return user_prompt, expected_response
+
+
+class JsonlDataset:
+    """
+    Random-access view of a JSONL file.
+
+    Args:
+        path (Path): Path of the JSONL file.
+        index_path (Path, optional): Path of the offset index. Defaults to `<path>.idx`.
+            The index is rebuilt when the file's modification time or size changes.
+
+    Attributes:
+        sha256 (str): Hex SHA-256 of the file, as of the index.
+    """
+
+    def __init__(self, path: Path, index_path: Path = None):
+        self.path = Path(path)
+        self.index_path = Path(index_path) if index_path else self.path.with_name(self.path.name + INDEX_SUFFIX)
+        self.offsets, self.sha256 = self._load_or_build_index()
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._size = size
+
+    def _load_or_build_index(self) -> tuple[array, str]:
+        signature = _file_signature(self.path)
+        if self.index_path.exists():
+            with open(self.index_path, "rb") as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) == INDEX_HEADER.size:
+                    magic, version, mtime_ns, size, count, digest = INDEX_HEADER.unpack(header)
+                    if (magic, version, (mtime_ns, size)) == (INDEX_MAGIC, INDEX_VERSION, signature):
+                        offsets = array("Q")
+                        offsets.frombytes(f.read(count * offsets.itemsize))
+                        if len(offsets) == count:
+                            return offsets, digest.hex()
+
+        logger.info(f"Building line index of {self.path}")
+        sha256 = hashlib.sha256()
+        offsets = build_line_offsets(self.path, sha256)
+        try:
+            tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, *signature, len(offsets), sha256.digest()))
+                f.write(offsets.tobytes())
+            tmp_path.replace(self.index_path)
+        except OSError as e:
+            logger.warning(f"Could not write line index {self.index_path}: {str(e)}")
+        return offsets, sha256.hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __enter__(self) -> "JsonlDataset":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def get_line(self, i: int) -> bytes:
+        """Return the raw bytes of line i (0-based), without the trailing newline."""
+        if i < 0:
+            i += len(self.offsets)
+        if not 0 <= i < len(self.offsets):
+            raise IndexError(f"Line {i} out of range for {self.path} with {len(self.offsets)} lines")
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self._size
+        return self._mmap[start:end].rstrip(b"\r\n")
+
+    def get(self, i: int) -> dict:
+        """Return the decoded JSON object of line i (0-based)."""
+        return json.loads(self.get_line(i))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.get(i) for i in range(*key.indices(len(self)))]
+        return self.get(key)
+
+    def get_example(self, i: int) -> Optional[dict]:
+        """
+        Return line i (0-based) as a chat example with "datapoint_id", "user_prompt" and
+        "expected_response", or None if it has no user prompt.
+        """
+        user_prompt, expected_response = extract_example(self.get(i))
+        if not user_prompt:
+            return None
+        return {
+            "datapoint_id": i + 1,
+            "user_prompt": user_prompt,
+            "expected_response": expected_response,
+        }
+
+    def iter_examples(self,
+                      start: int = 0,
+                      stop: int = None,
+                      skip_datapoint_ids: set[int] = frozenset()) -> Iterator[dict]:
+        """
+        Iterate over the chat examples of lines [start, stop). Examples without a user
+        prompt are logged and skipped, and so are the given datapoint IDs (without decoding them).
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            if i + 1 in skip_datapoint_ids:
+                continue
+            example = self.get_example(i)
+            if example is None:
+                logger.warning(f"Could not find user prompt for example {i + 1}. Skipping...")
+                continue
+            yield example
+
+    def shard_bounds(self, shard_index: int, num_shards: int) -> tuple[int, int]:
+        """Return the line range [start, stop) of one of `num_shards` contiguous, near-equal shards."""
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"Shard index {shard_index} out of range for {num_shards} shards")
+        return len(self) * shard_index // num_shards, len(self) * (shard_index + 1) // num_shards
+
+    def iter_shard(self, shard_index: int, num_shards: int, skip_datapoint_ids: set[int] = frozenset()) -> Iterator[dict]:
+        """Iterate over the chat examples of one shard, see `shard_bounds`."""
+        start, stop = self.shard_bounds(shard_index, num_shards)
+        return self.iter_examples(start, stop, skip_datapoint_ids)
+
+    def sample_indices(self, k: int, seed: int = None) -> list[int]:
+        """Return k distinct line indices drawn uniformly at random, in ascending order."""
+        return sorted(random.Random(seed).sample(range(len(self)), min(k, len(self))))
+
+    def chat_stats(self) -> dict:
+        """
+        Validate every line as a chat example and return counts for a dataset summary.
+
+        Returns:
+            dict: {"lines", "examples", "invalid_json", "missing_user", "missing_assistant",
+                   "user_chars", "assistant_chars"}, where "examples" counts the lines that have
+                   both a user prompt and an assistant response.
+        """
+        stats = dict.fromkeys(("lines", "examples", "invalid_json", "missing_user",
+                               "missing_assistant", "user_chars", "assistant_chars"), 0)
+        for i in range(len(self)):
+            stats["lines"] += 1
+            try:
+                user_prompt, expected_response = extract_example(self.get(i))
+            except (ValueError, AttributeError, TypeError):
+                stats["invalid_json"] += 1
+                continue
+            stats["missing_user"] += not user_prompt
+            stats["missing_assistant"] += not expected_response
+            if user_prompt and expected_response:
+                stats["examples"] += 1
+                stats["user_chars"] += len(user_prompt)
+                stats["assistant_chars"] += len(expected_response)
+        return stats
@@ -3,12 +3,38 @@ Global logging configuration for the calibrion_ft package.
 
 This module provides a centralized logging setup that can be used
 throughout the package to ensure consistent logging behavior.
+
+By default every logger writes to stdout synchronously. `enable_queue_logging` switches
+all package loggers to a queue that is drained by one background writer thread, with an
+optional JSON-lines sink and sampling/rate limiting of per-datapoint messages.
 """
 
+import atexit
+import json
 import logging
+import os
+import queue
 import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
 from typing import Optional
 
+# Default format of console log messages
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Console handler of every logger set up by this module, by logger name
+_console_handlers: dict[str, logging.Handler] = {}
+
+# Queue logging state, see enable_queue_logging
+_queue_handler: Optional[QueueHandler] = None
+_queue_listener: Optional[QueueListener] = None
+_queue_lock = threading.RLock()
+_atexit_registered = False
+
 
 def setup_logger(
     name: Optional[str] = None,
@@ -48,15 +74,15 @@ def setup_logger(
     # Create formatter
     if format_string is None:
         if include_timestamp:
-            format_string = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            format_string = DEFAULT_FORMAT
         else:
             format_string = '%(name)s - %(levelname)s - %(message)s'
     
     formatter = logging.Formatter(format_string)
     console_handler.setFormatter(formatter)
     
-    # Add handler to logger
-    logger.addHandler(console_handler)
+    # Add handler to logger, or the queue handler if queue logging is enabled
+    _attach_console_handler(logger, console_handler)
     
     # Prevent propagation to root logger to avoid duplicate messages
     logger.propagate = False
@@ -103,13 +129,214 @@ def configure_package_logging(level: int = logging.INFO) -> None:
     if not package_logger.handlers:
         handler = logging.StreamHandler(sys.stdout)
         handler.setLevel(level)
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        formatter = logging.Formatter(DEFAULT_FORMAT)
         handler.setFormatter(formatter)
-        package_logger.addHandler(handler)
+        _attach_console_handler(package_logger, handler)
         package_logger.propagate = False
 
 
+def _attach_console_handler(logger: logging.Logger, console_handler: logging.Handler) -> None:
+    with _queue_lock:
+        _console_handlers[logger.name] = console_handler
+        logger.addHandler(_queue_handler if _queue_handler is not None else console_handler)
+
+
+# Attributes every LogRecord has; any other attribute of a record was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line.
+
+    Each line has "time" (UTC, ISO 8601), "level", "logger" and "message", the formatted
+    traceback as "exception" if there is one, and every field passed through `extra`
+    (e.g. `logger.debug("...", extra={"datapoint_id": 3})`). Values that are not JSON
+    serializable are written as their string representation.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        return json.dumps(entry, default=str)
+
+
+class PerDatapointFilter(logging.Filter):
+    """
+    Sample and rate limit log records about single datapoints.
+
+    A record is about a single datapoint if it was logged with `extra={"datapoint_id": ...}`;
+    all other records pass unchanged. Records below WARNING are kept for a `sample_rate`
+    fraction of the datapoints, chosen by a hash of the datapoint ID, so that either all or
+    none of the messages of a datapoint are kept. Independently, at most `max_per_second`
+    per-datapoint records of each logger pass (with bursts of the same size), and the number
+    of records dropped by the limit is appended to the next record that passes.
+
+    Args:
+        sample_rate: Fraction of datapoints whose DEBUG and INFO records are kept, 0 to 1
+        max_per_second: Maximum rate of per-datapoint records of one logger. None disables the limit.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, max_per_second: Optional[float] = None):
+        super().__init__()
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate must be between 0 and 1, got {sample_rate}")
+        if max_per_second is not None and max_per_second <= 0:
+            raise ValueError(f"max_per_second must be positive, got {max_per_second}")
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self._lock = threading.Lock()
+        # Logger name -> [available tokens, time of last refill, records dropped since the last pass]
+        self._buckets: dict[str, list] = {}
+
+    def _sampled(self, datapoint_id) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        return zlib.crc32(str(datapoint_id).encode()) % 10_000 < self.sample_rate * 10_000
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        datapoint_id = getattr(record, "datapoint_id", None)
+        if datapoint_id is None:
+            return True
+        if record.levelno < logging.WARNING and not self._sampled(datapoint_id):
+            return False
+        if self.max_per_second is None:
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(record.name, [self.max_per_second, now, 0])
+            bucket[0] = min(self.max_per_second, bucket[0] + (now - bucket[1]) * self.max_per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = f"{record.msg} [{dropped} per-datapoint messages dropped by rate limit]"
+        return True
+
+
+class _PreparedQueueHandler(QueueHandler):
+    """
+    QueueHandler that keeps the traceback separate from the message, so the
+    JSON-lines sink can write it to its own field.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def enable_queue_logging(json_path: Optional[str | Path] = None,
+                         sample_rate: float = 1.0,
+                         max_per_second: Optional[float] = None) -> None:
+    """
+    Send the records of all package loggers through a queue to one background writer thread.
+
+    Logging calls then only filter the record, format its message and put it on the queue;
+    writing to stdout (and to the JSON-lines file) happens on the writer thread, so worker
+    threads never block on output. The console format is DEFAULT_FORMAT for every logger;
+    logger levels are unchanged. Loggers set up after this call use the queue as well.
+    Calling it again replaces the previous queue configuration.
+
+    Worker processes forked while queue logging is enabled write to stdout directly.
+    The queue is flushed by `stop_queue_logging`, which also runs at interpreter exit.
+
+    Args:
+        json_path: If set, every record is also appended to this file as one JSON object per line
+            (see `JsonLinesFormatter`)
+        sample_rate: Fraction of datapoints whose DEBUG and INFO messages are kept, see `PerDatapointFilter`
+        max_per_second: Maximum rate of per-datapoint messages per logger, see `PerDatapointFilter`
+    """
+    global _queue_handler, _queue_listener, _atexit_registered
+
+    datapoint_filter = PerDatapointFilter(sample_rate=sample_rate, max_per_second=max_per_second)
+    with _queue_lock:
+        stop_queue_logging()
+
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter(DEFAULT_FORMAT))
+        handlers = [console_handler]
+        if json_path is not None:
+            json_path = Path(json_path)
+            json_path.parent.mkdir(parents=True, exist_ok=True)
+            json_handler = logging.FileHandler(json_path, mode="a", encoding="utf-8")
+            json_handler.setFormatter(JsonLinesFormatter())
+            handlers.append(json_handler)
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = _PreparedQueueHandler(log_queue)
+        _queue_handler.addFilter(datapoint_filter)
+        _queue_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _queue_listener.start()
+
+        for name, handler in _console_handlers.items():
+            logger = logging.getLogger(name)
+            logger.removeHandler(handler)
+            logger.addHandler(_queue_handler)
+
+        if not _atexit_registered:
+            atexit.register(stop_queue_logging)
+            _atexit_registered = True
+
+
+def stop_queue_logging() -> None:
+    """
+    Write all queued records, stop the background writer and restore synchronous logging.
+    Does nothing if queue logging is not enabled.
+    """
+    global _queue_handler, _queue_listener
+
+    with _queue_lock:
+        if _queue_handler is None:
+            return
+        _restore_console_handlers()
+        _queue_listener.stop()
+        for handler in _queue_listener.handlers:
+            handler.close()
+        _queue_handler = None
+        _queue_listener = None
+
+
+def _restore_console_handlers() -> None:
+    for name, handler in _console_handlers.items():
+        logger = logging.getLogger(name)
+        logger.removeHandler(_queue_handler)
+        if handler not in logger.handlers:
+            logger.addHandler(handler)
+
+
+def _reset_after_fork() -> None:
+    # The writer thread does not exist in a forked child, so the child logs synchronously
+    global _queue_handler, _queue_listener, _queue_lock
+
+    _queue_lock = threading.RLock()
+    if _queue_handler is not None:
+        _restore_console_handlers()
+        _queue_handler = None
+        _queue_listener = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
 # Configure package logging when module is imported
 configure_package_logging()
\ No newline at end of file
@@ -0,0 +1,616 @@
+"""
+Shared rate limiter and retries for provider calls.
+
+Every model has a request bucket and a token bucket, sized from the `x-ratelimit-limit-*`
+headers of its responses (limits per minute) and refilled continuously. Before a request
+is sent, one request and its estimated tokens are taken from the buckets of its model;
+if they are not available yet, the caller waits until they are. After the response, the
+buckets are lowered to the `x-ratelimit-remaining-*` values if the provider saw more usage
+(e.g. from other clients), and the unused part of the token estimate is given back.
+Until a model has answered once, its requests are not limited.
+
+Failed calls are retried with jittered exponential backoff. A 429 response also pauses
+every request of its model for the `retry-after` time, so concurrent callers back off
+together instead of each tripping the limit again. The clients of `clients.py` are built
+with `max_retries=0`, so these are the only retries.
+
+By default the buckets are shared by all threads and event loops of the process. With
+`configure_rate_limiter(shared_path=...)` they are kept in a SQLite database instead and
+shared by all processes that use the same file (e.g. the workers of `work_queue.py`).
+Like the work queue, the database uses SQLite's rollback journal instead of WAL, so the
+file can be shared by workers on different machines through a network filesystem.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .instrumentation import get_provider_metrics, instrumented_call, instrumented_call_async
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+# Share of the provider limits left unused, so that estimation errors do not trip them
+DEFAULT_SAFETY_MARGIN = 0.05
+
+# Retries of a failed call and the bounds of the backoff between them in seconds
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 60.0
+
+# Token estimation: characters per prompt token and tokens added per message by the chat format,
+# completion tokens assumed for a model until it has answered
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+DEFAULT_COMPLETION_TOKENS = 512
+
+# Weight of the newest response in the running averages of the token estimates
+ESTIMATE_SMOOTHING = 0.1
+
+# HTTP status codes that are retried besides 5xx
+RETRYABLE_STATUS_CODES = (408, 429)
+
+# Calls that create a billed resource. A timeout or a 5xx response does not tell whether the
+# provider created it, so these are only retried after a 429 or if the connection was never made.
+NON_IDEMPOTENT_ENDPOINTS = ("fine_tuning.jobs.create", "files.create", "batches.create")
+
+SQLITE_TIMEOUT = 60.0
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call with a deadline would have to wait for the rate limits past it."""
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse a provider reset duration like "120ms", "1.5s" or "6m0s" into seconds."""
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value or "")
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def _header_number(headers, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """
+    Return the wait requested by a response (`retry-after-ms`, `retry-after`), or else the time
+    until the exhausted rate limit resets (`x-ratelimit-reset-*`), or None.
+    """
+    if headers is None:
+        return None
+    retry_after_ms = _header_number(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    retry_after = _header_number(headers, "retry-after")
+    if retry_after is not None:
+        return retry_after
+    resets = [_parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+              for kind in ("requests", "tokens")
+              if (_header_number(headers, f"x-ratelimit-remaining-{kind}") or 0) < 1
+              and headers.get(f"x-ratelimit-reset-{kind}")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def _connection_refused(error: BaseException) -> bool:
+    """Return True if the error chain shows that no connection was made, so the request was never sent."""
+    while error is not None:
+        if isinstance(error, ConnectionRefusedError) or type(error).__name__ == "ConnectError":
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def is_retryable(error: Exception, idempotent: bool = True) -> bool:
+    """
+    Return True for errors worth retrying: timeouts, connection errors, 408/429 and 5xx responses.
+    A call that is not idempotent is only retried after a 429 or a refused connection.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        if not idempotent:
+            return status_code == 429
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    try:
+        import openai
+    except ImportError:
+        return False
+    if not isinstance(error, openai.APIConnectionError):
+        return False
+    return idempotent or (not isinstance(error, openai.APITimeoutError) and _connection_refused(error))
+
+
+def estimate_prompt_tokens(request: dict) -> int:
+    """
+    Estimate the prompt tokens of a chat completion or responses request from its
+    `messages` or `input`, at CHARS_PER_TOKEN characters per token.
+    """
+    messages = request.get("messages", request.get("input", []))
+    if isinstance(messages, str):
+        return len(messages) // CHARS_PER_TOKEN + 1
+    tokens = 0
+    for message in messages:
+        content = message.get("content", "") if isinstance(message, dict) else message
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        tokens += len(content) // CHARS_PER_TOKEN + TOKENS_PER_MESSAGE
+    return tokens
+
+
+def _bucket(limit: float, margin: float) -> dict:
+    capacity = limit * (1 - margin)
+    return {"limit": limit, "capacity": capacity, "rate": capacity / 60, "level": capacity, "updated_at": time.time()}
+
+
+def _refill(bucket: dict, now: float) -> None:
+    bucket["level"] = min(bucket["capacity"], bucket["level"] + max(0.0, now - bucket["updated_at"]) * bucket["rate"])
+    bucket["updated_at"] = now
+
+
+def _take(state: dict, tokens: float, now: float) -> float:
+    """Take one request and `tokens` from a model's buckets; return 0, or the seconds to wait if they are short."""
+    wait = max(0.0, state.get("paused_until", 0.0) - now)
+    amounts = {"requests": 1, "tokens": tokens}
+    for kind, amount in amounts.items():
+        bucket = state.get(kind)
+        if bucket is not None:
+            _refill(bucket, now)
+            amounts[kind] = min(amount, bucket["capacity"])
+            wait = max(wait, (amounts[kind] - bucket["level"]) / bucket["rate"])
+    if wait > 0:
+        return wait
+    for kind, amount in amounts.items():
+        if state.get(kind) is not None:
+            state[kind]["level"] -= amount
+    return 0.0
+
+
+def _observe(state: dict, headers, refund: float, margin: float, now: float) -> None:
+    """Size a model's buckets from the rate limit headers of a response and sync them with the provider."""
+    for kind in ("requests", "tokens"):
+        limit = _header_number(headers, f"x-ratelimit-limit-{kind}")
+        if limit is None or limit <= 0:
+            continue
+        bucket = state.get(kind)
+        if bucket is None or bucket["limit"] != limit:
+            bucket = state[kind] = _bucket(limit, margin)
+        _refill(bucket, now)
+        if kind == "tokens":
+            bucket["level"] = min(bucket["capacity"], bucket["level"] + refund)
+        remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+        if remaining is not None:
+            bucket["level"] = min(bucket["level"], remaining - bucket["limit"] * margin)
+
+
+class _LocalBuckets:
+    """Bucket states of this process."""
+
+    # Updates only hold a thread lock for a moment, so they can run on an event loop
+    blocking = False
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def update(self, model: str, update):
+        """Apply `update(state)` to the state of a model atomically and return its result."""
+        with self._lock:
+            return update(self._states.setdefault(model, {}))
+
+    def close(self) -> None:
+        pass
+
+
+class _SharedBuckets:
+    """Bucket states in a SQLite database, updated in one transaction per call, shared by all processes using it."""
+
+    # Updates may wait up to SQLITE_TIMEOUT for another process, so they run off the event loop
+    blocking = True
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            # Also switches databases created in WAL mode back to the rollback journal
+            self._conn.execute("PRAGMA journal_mode=DELETE")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rate_limits (model TEXT PRIMARY KEY, state TEXT NOT NULL)")
+        return self._conn
+
+    def update(self, model: str, update):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT state FROM rate_limits WHERE model = ?", (model,)).fetchone()
+                state = json.loads(row[0]) if row else {}
+                result = update(state)
+                conn.execute("INSERT OR REPLACE INTO rate_limits (model, state) VALUES (?, ?)",
+                             (model, json.dumps(state)))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RateLimiter:
+    """
+    Per-model request and token buckets plus the retry policy of provider calls.
+
+    Args:
+        shared_path: SQLite file to keep the buckets in, shared by all processes using it.
+            None keeps them in this process.
+        safety_margin: Share of the provider limits left unused.
+        max_retries: Retries of a failed call before its error is raised.
+        backoff_base, backoff_max: The n-th retry waits a random time between 0 and
+            min(backoff_max, backoff_base * 2**n) seconds, or at least the `retry-after` of a 429.
+    """
+
+    def __init__(self,
+                 shared_path: Optional[Path] = None,
+                 safety_margin: float = DEFAULT_SAFETY_MARGIN,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX):
+        if not 0 <= safety_margin < 1:
+            raise ValueError(f"safety_margin must be between 0 and 1, got {safety_margin}")
+        self.safety_margin = safety_margin
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets = _SharedBuckets(shared_path) if shared_path is not None else _LocalBuckets()
+        self._lock = threading.Lock()
+        # Per model: running ratio of reported to estimated prompt tokens, and mean completion tokens
+        self._prompt_ratios = {}
+        self._completion_tokens = {}
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+
+    # Token estimation
+
+    def estimate_tokens(self, model: str, request: dict) -> int:
+        """
+        Estimate the tokens a request counts against the token limit of its model: the prompt
+        estimate, corrected by the ratio seen in earlier responses, plus the `max_tokens` (or the
+        mean completion tokens seen so far) of each of its `n` choices. Requests without
+        `messages` or `input` (e.g. job or file calls) count 0 tokens.
+        """
+        if "messages" not in request and "input" not in request:
+            return 0
+        with self._lock:
+            ratio = self._prompt_ratios.get(model, 1.0)
+            completion_tokens = self._completion_tokens.get(model, DEFAULT_COMPLETION_TOKENS)
+        max_tokens = (request.get("max_tokens") or request.get("max_completion_tokens")
+                      or request.get("max_output_tokens") or completion_tokens)
+        return int(estimate_prompt_tokens(request) * ratio + max_tokens * (request.get("n") or 1))
+
+    def _learn(self, model: str, request: dict, usage) -> Optional[int]:
+        """Update the token estimates of a model from the usage of a response and return its total tokens."""
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None)
+        if prompt_tokens is None or completion_tokens is None:
+            return None
+        with self._lock:
+            estimated = estimate_prompt_tokens(request)
+            if estimated:
+                ratio = self._prompt_ratios.get(model, prompt_tokens / estimated)
+                self._prompt_ratios[model] = ratio + ESTIMATE_SMOOTHING * (prompt_tokens / estimated - ratio)
+            per_choice = completion_tokens / (request.get("n") or 1)
+            mean = self._completion_tokens.get(model, per_choice)
+            self._completion_tokens[model] = mean + ESTIMATE_SMOOTHING * (per_choice - mean)
+        return prompt_tokens + completion_tokens
+
+    # Buckets
+
+    def try_acquire(self, model: str, tokens: int) -> float:
+        """Take one request and `tokens` from the buckets of a model; return 0, or the seconds to wait first."""
+        return self._buckets.update(model, lambda state: _take(state, tokens, time.time()))
+
+    def acquire(self, model: Optional[str], tokens: int = 0, deadline: Optional[float] = None) -> None:
+        """
+        Wait until a request of `tokens` tokens fits into the limits of a model and take it.
+        Raises DeadlineExceeded instead of waiting past `deadline` (a `time.monotonic()` value).
+        """
+        if model is None:
+            return
+        waited = 0.0
+        while (wait := self.try_acquire(model, tokens)) > 0:
+            _check_wait(wait, deadline, model)
+            time.sleep(wait)
+            waited += wait
+        self._count_wait(waited)
+
+    async def try_acquire_async(self, model: str, tokens: int) -> float:
+        """Async counterpart of `try_acquire`."""
+        return await self._off_loop(self.try_acquire, model, tokens)
+
+    async def acquire_async(self, model: Optional[str], tokens: int = 0, deadline: Optional[float] = None) -> None:
+        """Async counterpart of `acquire`."""
+        if model is None:
+            return
+        waited = 0.0
+        while (wait := await self.try_acquire_async(model, tokens)) > 0:
+            _check_wait(wait, deadline, model)
+            await asyncio.sleep(wait)
+            waited += wait
+        self._count_wait(waited)
+
+    async def _off_loop(self, function, *args):
+        """Call a function that updates the buckets, on a worker thread if the update can block on SQLite."""
+        if self._buckets.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def _count_wait(self, waited: float) -> None:
+        if waited:
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += waited
+
+    def observe(self, model: Optional[str], headers, estimated_tokens: int = 0, used_tokens: Optional[int] = None) -> None:
+        """
+        Update the buckets of a model from the headers of a response. If the response reports
+        its token usage, the difference to the estimate taken by `acquire` is given back.
+        """
+        if model is None or headers is None:
+            return
+        refund = estimated_tokens - used_tokens if used_tokens is not None else 0
+        self._buckets.update(model, lambda state: _observe(state, headers, refund, self.safety_margin, time.time()))
+
+    def pause(self, model: Optional[str], seconds: float) -> None:
+        """Hold back every request of a model for `seconds`."""
+        if model is None:
+            return
+
+        def update(state):
+            state["paused_until"] = max(state.get("paused_until", 0.0), time.time() + seconds)
+
+        self._buckets.update(model, update)
+
+    # Retries
+
+    def retry_delay(self, attempt: int, error: Exception) -> float:
+        """Return the seconds to wait before retrying after the `attempt`-th failure (0-based)."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = retry_after_seconds(getattr(response, "headers", None))
+        if retry_after is not None:
+            delay = max(delay, retry_after + random.uniform(0, self.backoff_base))
+        return delay
+
+    def _on_error(self, endpoint: str, model: Optional[str], error: Exception, attempt: int,
+                  deadline: Optional[float] = None) -> float:
+        """
+        Update the buckets after a failed attempt; return the seconds to wait before retrying, or
+        raise the error if it is not retried or the retry could not start before `deadline`.
+        """
+        if attempt >= self.max_retries or not is_retryable(error, endpoint not in NON_IDEMPOTENT_ENDPOINTS):
+            raise error
+        response = getattr(error, "response", None)
+        delay = self.retry_delay(attempt, error)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise error
+        with self._lock:
+            self.retries += 1
+            self.rate_limited += getattr(error, "status_code", None) == 429
+        if getattr(error, "status_code", None) == 429:
+            self.observe(model, getattr(response, "headers", None))
+            self.pause(model, delay)
+        get_provider_metrics().record_retry(endpoint, model)
+        logger.debug("Retrying %s call for %s in %.2fs after attempt %d failed: %s",
+                     endpoint, model, delay, attempt + 1, error)
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+            }
+
+    def log_stats(self) -> None:
+        """Log the counters of this rate limiter."""
+        stats = self.stats()
+        logger.info(f"Rate limiter: {stats['waits']} requests held back for {stats['wait_seconds']:.1f}s in total, "
+                    f"{stats['retries']} retries ({stats['rate_limited']} after a 429)")
+
+    def close(self) -> None:
+        self._buckets.close()
+
+
+def _check_wait(wait: float, deadline: Optional[float], model: str) -> None:
+    if deadline is not None and time.monotonic() + wait >= deadline:
+        raise DeadlineExceeded(f"Rate limits of {model} allow the next request in {wait:.2f}s, after its deadline")
+
+
+def _attempt_kwargs(kwargs: dict, deadline: Optional[float]) -> dict:
+    """Return the arguments of one attempt, with a `timeout` that ends at `deadline` at the latest."""
+    if deadline is None:
+        return kwargs
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline passed before the request was sent")
+    timeout = kwargs.get("timeout")
+    return {**kwargs, "timeout": min(timeout, remaining) if isinstance(timeout, (int, float)) else remaining}
+
+
+def _capturing(call, captured: dict):
+    """Wrap a raw-response call so that the raw response stays available for its headers."""
+    def wrapper(*args, **kwargs):
+        captured["raw_response"] = call(*args, **kwargs)
+        return captured["raw_response"]
+    return wrapper
+
+
+def _capturing_async(call, captured: dict):
+    async def wrapper(*args, **kwargs):
+        captured["raw_response"] = await call(*args, **kwargs)
+        return captured["raw_response"]
+    return wrapper
+
+
+def _observe_response(limiter: RateLimiter, model: Optional[str], kwargs: dict, estimated_tokens: int,
+                      captured: dict, result) -> None:
+    raw_response = captured.get("raw_response")
+    if model is None or raw_response is None:
+        return
+    used_tokens = limiter._learn(model, kwargs, getattr(result, "usage", None))
+    limiter.observe(model, raw_response.headers, estimated_tokens, used_tokens)
+
+
+def limited_call(endpoint: str, model: Optional[str], call, /, *args, **kwargs):
+    """
+    Make a provider call through `instrumented_call` within the rate limits of its model,
+    retrying it on timeouts, connection errors, 408/429 and 5xx responses. Calls of
+    NON_IDEMPOTENT_ENDPOINTS are only retried after a 429 or a refused connection.
+
+    Args:
+        endpoint: API endpoint, e.g. "chat.completions".
+        model: Model the call is made for, or None for calls that are not rate limited per model.
+        call: The raw-response method, e.g. `client.chat.completions.with_raw_response.create`.
+        *args, **kwargs: Arguments of the call.
+
+    Returns:
+        The parsed response, as returned by the plain method.
+    """
+    return call_within_limits(endpoint, model, call, args, kwargs)
+
+
+def call_within_limits(endpoint: str,
+                       model: Optional[str],
+                       call,
+                       args: tuple = (),
+                       kwargs: dict = None,
+                       estimated_tokens: Optional[int] = None,
+                       acquired: bool = False,
+                       deadline: Optional[float] = None):
+    """
+    `limited_call` for callers that already took the first attempt from the buckets with
+    `RateLimiter.try_acquire` (`acquired=True`, with the `estimated_tokens` they took), or
+    that give the call a `deadline` (a `time.monotonic()` value). The deadline covers waiting
+    for the rate limits, every attempt and the backoff between them: each attempt gets the
+    remaining time as its `timeout`, and once a wait or retry would end past the deadline
+    the call fails with DeadlineExceeded or the error of the last attempt.
+    """
+    kwargs = kwargs or {}
+    limiter = get_rate_limiter()
+    if estimated_tokens is None:
+        estimated_tokens = limiter.estimate_tokens(model, kwargs) if model is not None else 0
+    attempt = 0
+    while True:
+        if not acquired:
+            limiter.acquire(model, estimated_tokens, deadline)
+        acquired = False
+        captured = {}
+        try:
+            result = instrumented_call(endpoint, model, _capturing(call, captured), *args,
+                                       **_attempt_kwargs(kwargs, deadline))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            time.sleep(limiter._on_error(endpoint, model, e, attempt, deadline))
+            attempt += 1
+            continue
+        _observe_response(limiter, model, kwargs, estimated_tokens, captured, result)
+        return result
+
+
+async def limited_call_async(endpoint: str, model: Optional[str], call, /, *args, **kwargs):
+    """Async counterpart of `limited_call`."""
+    return await call_within_limits_async(endpoint, model, call, args, kwargs)
+
+
+async def call_within_limits_async(endpoint: str,
+                                   model: Optional[str],
+                                   call,
+                                   args: tuple = (),
+                                   kwargs: dict = None,
+                                   estimated_tokens: Optional[int] = None,
+                                   acquired: bool = False,
+                                   deadline: Optional[float] = None):
+    """Async counterpart of `call_within_limits`."""
+    kwargs = kwargs or {}
+    limiter = get_rate_limiter()
+    if estimated_tokens is None:
+        estimated_tokens = limiter.estimate_tokens(model, kwargs) if model is not None else 0
+    attempt = 0
+    while True:
+        if not acquired:
+            await limiter.acquire_async(model, estimated_tokens, deadline)
+        acquired = False
+        captured = {}
+        try:
+            result = await instrumented_call_async(endpoint, model, _capturing_async(call, captured), *args,
+                                                   **_attempt_kwargs(kwargs, deadline))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            await asyncio.sleep(await limiter._off_loop(limiter._on_error, endpoint, model, e, attempt, deadline))
+            attempt += 1
+            continue
+        await limiter._off_loop(_observe_response, limiter, model, kwargs, estimated_tokens, captured, result)
+        return result
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def configure_rate_limiter(shared_path: Optional[Path] = None,
+                           safety_margin: float = DEFAULT_SAFETY_MARGIN,
+                           max_retries: int = DEFAULT_MAX_RETRIES,
+                           backoff_base: float = DEFAULT_BACKOFF_BASE,
+                           backoff_max: float = DEFAULT_BACKOFF_MAX) -> RateLimiter:
+    """
+    Replace the process-wide rate limiter used by `limited_call`. See `RateLimiter` for the arguments.
+
+    Returns:
+        The newly configured RateLimiter.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is not None:
+            _rate_limiter.close()
+        _rate_limiter = RateLimiter(shared_path=shared_path,
+                                    safety_margin=safety_margin,
+                                    max_retries=max_retries,
+                                    backoff_base=backoff_base,
+                                    backoff_max=backoff_max)
+        return _rate_limiter
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide rate limiter, creating a default one on first use."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
@@ -0,0 +1,211 @@
+"""
+Persistent, content-addressed cache for fine-tuned model responses.
+
+Responses are stored in a SQLite database keyed by the SHA-256 hash of the
+full request (endpoint, model, messages, temperature, n), so re-running
+steps 3 and 4 on an unchanged model does not call the API again.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+# read_write: serve hits, store misses
+# read_only:  serve hits, never write
+# refresh:    never serve, overwrite entries with fresh responses
+# bypass:     do not touch the cache at all
+CACHE_MODES = ("read_write", "read_only", "refresh", "bypass")
+
+DEFAULT_CACHE_PATH = Path(__file__).parent / "_response_cache.sqlite"
+
+# Eviction is checked every this many writes instead of on every write
+EVICTION_INTERVAL = 100
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with size/age-based eviction and hit/miss counters.
+
+    Args:
+        path: Path of the SQLite database file.
+        mode: One of CACHE_MODES.
+        max_entries: Maximum number of entries kept. Least recently used entries are
+            evicted first. None disables size-based eviction.
+        max_age_seconds: Entries older than this are treated as misses and evicted.
+            None disables age-based eviction.
+    """
+
+    def __init__(self,
+                 path: Path = DEFAULT_CACHE_PATH,
+                 mode: str = "read_write",
+                 max_entries: Optional[int] = None,
+                 max_age_seconds: Optional[float] = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}. Expected one of {CACHE_MODES}")
+        self.path = Path(path)
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(request: dict) -> str:
+        """Return the content address of a request: SHA-256 of its canonical JSON."""
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, request: dict) -> Optional[Any]:
+        """
+        Return the cached response for a request, or None on a miss.
+
+        Always a miss in "refresh" and "bypass" modes.
+        """
+        if self.mode in ("refresh", "bypass"):
+            if self.mode == "refresh":
+                self.misses += 1
+            return None
+
+        key = self.make_key(request)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            if self.mode == "read_write":
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, request: dict, response: Any) -> None:
+        """Store the response for a request. No-op in "read_only" and "bypass" modes."""
+        if self.mode in ("read_only", "bypass"):
+            return
+
+        key = self.make_key(request)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response, ensure_ascii=False), now, now),
+            )
+            conn.commit()
+            self.writes += 1
+            if self.writes % EVICTION_INTERVAL == 0:
+                self._evict(conn, now)
+
+    def evict(self) -> int:
+        """Apply age- and size-based eviction now and return the number of evicted entries."""
+        with self._lock:
+            return self._evict(self._connection(), time.time())
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        evicted = 0
+        if self.max_age_seconds is not None:
+            evicted += conn.execute("DELETE FROM responses WHERE created_at < ?",
+                                    (now - self.max_age_seconds,)).rowcount
+        if self.max_entries is not None:
+            evicted += conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        conn.commit()
+        self.evictions += evicted
+        if evicted:
+            logger.debug(f"Evicted {evicted} entries from response cache {self.path}")
+        return evicted
+
+    def stats(self) -> dict:
+        """Return the hit/miss/write/eviction counters of this cache instance."""
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def log_stats(self) -> None:
+        """Log the counters of this cache instance."""
+        if self.mode == "bypass":
+            return
+        stats = self.stats()
+        logger.info(
+            f"Response cache ({stats['mode']}): {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.1%} hit rate), {stats['writes']} writes, {stats['evictions']} evictions"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def configure_response_cache(path: Path = DEFAULT_CACHE_PATH,
+                             mode: str = "read_write",
+                             max_entries: Optional[int] = None,
+                             max_age_seconds: Optional[float] = None) -> ResponseCache:
+    """
+    Replace the process-wide response cache used by the `finetuning` query functions.
+
+    Args:
+        path: Path of the SQLite database file.
+        mode: One of "read_write", "read_only", "refresh" or "bypass".
+        max_entries: Maximum number of cached responses, None for unbounded.
+        max_age_seconds: Maximum age of a cached response, None for no expiry.
+
+    Returns:
+        The newly configured ResponseCache.
+    """
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = ResponseCache(path=path, mode=mode, max_entries=max_entries, max_age_seconds=max_age_seconds)
+    return _response_cache
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache, creating a default one on first use."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -1,14 +1,25 @@
-import time
-from pathlib import Path
-import step_1_run_ft_jobs, step_2_update_experiments, step_3_eval_run_ft_models, step_4_run_evaluation
-import training_configs
-import json
+import argparse
 import logging
-from .logging_config import setup_logger
+from typing import TYPE_CHECKING
+from .logging_config import enable_queue_logging, setup_logger
+
+if TYPE_CHECKING:
+    from .early_stopping import EarlyStopping
+    from .hyperparameter_search import SearchStrategy
 
 logger = setup_logger(log_level=logging.INFO)
 
-def run_pipeline(wandb_project: str = "sw-code-ai", dataset_version: str = "1.1.small", skip_steps: list[int] = None):
+def run_pipeline(wandb_project: str = "sw-code-ai",
+                 dataset_version: str = "1.1.small",
+                 skip_steps: list[int] = None,
+                 eval_mode: str = "sequential",
+                 cache_mode: str = "read_write",
+                 eval_cache_mode: str = "read_write",
+                 use_scheduler: bool = False,
+                 search_strategy: "SearchStrategy" = None,
+                 early_stopping: "EarlyStopping" = None,
+                 hedge_requests: bool = False,
+                 request_deadline: float = None):
     """
     Run the complete fine-tuning and evaluation pipeline.
     
@@ -16,20 +27,64 @@ def run_pipeline(wandb_project: str = "sw-code-ai", dataset_version: str = "1.1.
         wandb_project: W&B project name
         dataset_version: Version of the dataset to use (must exist in versions.yaml)
         skip_steps: List of step numbers to skip (e.g. [1,2] skips steps 1 and 2)
+        eval_mode: Execution mode of step 3, "sequential", "async" or "batch"
+        cache_mode: Mode of the model response cache: "read_write", "read_only", "refresh" or "bypass"
+        eval_cache_mode: Mode of the evaluator result cache used by step 4, same values as cache_mode
+        use_scheduler: Run steps 2-4 per experiment with the event-driven `PipelineScheduler`
+            instead of waiting for all experiments at every step. `skip_steps` applies to it as well.
+        search_strategy: Adaptive search (e.g. `SuccessiveHalving`) that replaces steps 1 and 2.
+            Only the experiments of its last round are evaluated in steps 3 and 4. Successive halving
+            trains fewer epochs than the grid but submits more jobs (every round submits new ones).
+        early_stopping: Interleave steps 3 and scoring and stop querying models that are clearly
+            behind the best one (see `early_stopping.EarlyStopping`). Not available with the scheduler.
+        hedge_requests: Send a duplicate of temperature 0 model queries that are slower than the p95
+            latency of their model and use the first answer (see `hedging`)
+        request_deadline: Seconds a model query may take in total, including rate limit waits and retries.
+            None waits for the read timeout of the transport.
     """
+    # Steps are imported here so that importing this module (and `--help`) stays fast
+    from . import step_1_run_ft_jobs, step_2_update_experiments, step_3_eval_run_ft_models, training_configs
+    from .evaluation.core import shutdown_evaluator_pool
+    from .evaluation.memo import configure_result_cache
+    from .hedging import configure_hedging
+    from .hyperparameter_search import run_search
+    from .instrumentation import get_provider_metrics
+    from .response_cache import configure_response_cache
+    from .scheduler import PipelineScheduler
+
     skip_steps = skip_steps or []
+    if early_stopping is not None and use_scheduler:
+        raise ValueError("Early stopping compares all models and cannot be used with the per-experiment scheduler")
+    configure_response_cache(mode=cache_mode)
+    configure_result_cache(mode=eval_cache_mode)
+    configure_hedging(enabled=hedge_requests, deadline_s=request_deadline)
+    if 3 not in skip_steps:
+        # A run that queries the models starts the provider metrics over; step 4 alone reuses them
+        get_provider_metrics().start_run()
+
+    if search_strategy is not None and 1 not in skip_steps:
+        logger.info(f"Starting hyperparameter search with {type(search_strategy).__name__}")
+        try:
+            run_search(search_strategy, dataset_version=dataset_version)
+        except Exception as e:
+            logger.exception(f"Could not finish hyperparameter search: {str(e)}")
+            raise
+        skip_steps = skip_steps + [1, 2]
 
     if 1 not in skip_steps:
         logger.info("Starting Step 1: Running fine-tuning jobs")
         try:
-            experiments = step_1_run_ft_jobs.run_experiments(
-                training_configurations=step_1_run_ft_jobs.generate_configurations(
-                    dataset_version=dataset_version,
-                    llms=training_configs.llms,
-                    batch_sizes=training_configs.batch_sizes,
-                    learning_rate_multipliers=training_configs.learning_rate_multipliers
+            if step_1_run_ft_jobs.has_pending_experiments():
+                experiments = step_1_run_ft_jobs.resume_experiments()
+            else:
+                experiments = step_1_run_ft_jobs.run_experiments(
+                    training_configurations=step_1_run_ft_jobs.generate_configurations(
+                        dataset_version=dataset_version,
+                        llms=training_configs.llms,
+                        batch_sizes=training_configs.batch_sizes,
+                        learning_rate_multipliers=training_configs.learning_rate_multipliers
+                    )
                 )
-            )
             if experiments is None:
                 logger.info("Pipeline aborted by user")
                 return
@@ -37,30 +92,40 @@ def run_pipeline(wandb_project: str = "sw-code-ai", dataset_version: str = "1.1.
             logger.exception(f"Could not finish step 1: {str(e)}")
             raise
 
+    if use_scheduler:
+        logger.info("Starting scheduler for steps 2-4")
+        try:
+            PipelineScheduler(wandb_project=wandb_project,
+                              dataset_version=dataset_version,
+                              skip_steps=skip_steps,
+                              eval_mode=eval_mode).run()
+        except Exception as e:
+            logger.exception(f"Could not finish scheduled steps: {str(e)}")
+            raise
+        shutdown_evaluator_pool()
+        get_provider_metrics().write()
+        logger.info("Pipeline completed successfully")
+        return
+
     if 2 not in skip_steps:
         logger.info("Starting Step 2: Waiting for fine-tuning jobs to complete")
-        # Wait time before checking job completion in seconds
-        waiting_time = 300
-        while True:
-            try:
-                step_2_update_experiments.update_experiments()
-                with open(Path(__file__).parent / "_experiments.json", 'r') as f:
-                    experiments = json.load(f)
-                if all('ft_model_id' in exp for exp in experiments.values()):
-                    break
-                minutes = waiting_time // 60
-                seconds = waiting_time % 60
-                logger.info(f"Not all jobs completed, waiting {minutes} minutes and {seconds} seconds...")
-                time.sleep(waiting_time)
-            except Exception as e:
-                logger.exception(f"Error in Step 2: {str(e)}")
-                raise
-        logger.info("All fine-tuning jobs completed successfully")
+        try:
+            experiments = step_2_update_experiments.wait_for_experiments()
+        except Exception as e:
+            logger.exception(f"Error in Step 2: {str(e)}")
+            raise
+        failed = [exp_id for exp_id, exp in experiments.items() if 'ft_model_id' not in exp]
+        if failed:
+            logger.error(f"{len(failed)} fine-tuning job(s) failed or were cancelled: {failed}")
+        else:
+            logger.info("All fine-tuning jobs completed successfully")
     
     if 3 not in skip_steps:
         logger.info("Starting Step 3: Running fine-tuned models on evaluation set")
         try:
-            step_3_eval_run_ft_models.eval_run_all_fted_models(dataset_version=dataset_version)
+            step_3_eval_run_ft_models.eval_run_all_fted_models(dataset_version=dataset_version,
+                                                               mode=eval_mode,
+                                                               early_stopping=early_stopping)
         except Exception as e:
             logger.exception(f"Could not finish step 3: {str(e)}")
             raise
@@ -68,16 +133,72 @@ def run_pipeline(wandb_project: str = "sw-code-ai", dataset_version: str = "1.1.
     if 4 not in skip_steps:
         logger.info("Starting Step 4: Running evaluation and logging results to W&B")
         try:
+            from . import step_4_run_evaluation
+
             step_4_run_evaluation.evaluate_all_ft_models(wandb_project=wandb_project)
         except Exception as e:
             logger.exception(f"Could not finish step 4: {str(e)}")
             raise
     
+    # Scoring in step 3 (early stopping) keeps the evaluator pool alive as well; it is also shut down at exit
+    shutdown_evaluator_pool()
+    get_provider_metrics().write()
     logger.info("Pipeline completed successfully")
 
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the fine-tuning and evaluation pipeline.")
+    parser.add_argument("--wandb-project", default="test-calibrion-ft", help="W&B project name")
+    parser.add_argument("--dataset-version", default="2.0.0", help="Version of the dataset to use")
+    parser.add_argument("--skip-steps", type=int, nargs="*", default=[1, 2, 3], help="Step numbers to skip")
+    parser.add_argument("--eval-mode", choices=["sequential", "async", "batch"], default="sequential",
+                        help="Execution mode of step 3")
+    parser.add_argument("--cache-mode", choices=["read_write", "read_only", "refresh", "bypass"], default="read_write",
+                        help="Mode of the model response cache")
+    parser.add_argument("--eval-cache-mode", choices=["read_write", "read_only", "refresh", "bypass"],
+                        default="read_write", help="Mode of the evaluator result cache")
+    parser.add_argument("--use-scheduler", action="store_true", help="Run steps 2-4 per experiment")
+    parser.add_argument("--early-stopping", action="store_true",
+                        help="Stop querying models in step 3 that are clearly behind the best one")
+    parser.add_argument("--early-stopping-confidence", type=float, default=0.95,
+                        help="Confidence level of the early stopping error rate intervals")
+    parser.add_argument("--early-stopping-min-samples", type=int, default=200,
+                        help="Scored examples a model needs before it can be stopped")
+    parser.add_argument("--hedge-requests", action="store_true",
+                        help="Send a duplicate of model queries slower than the p95 latency (temperature 0 only)")
+    parser.add_argument("--request-deadline", type=float, default=None,
+                        help="Seconds a model query may take in total, retries included")
+    parser.add_argument("--queue-logging", action="store_true",
+                        help="Write log messages from a background thread instead of the logging threads")
+    parser.add_argument("--log-json", default=None,
+                        help="Also append log messages as JSON lines to this file (implies --queue-logging)")
+    parser.add_argument("--log-sample-rate", type=float, default=1.0,
+                        help="Fraction of datapoints whose debug and info messages are kept (implies --queue-logging)")
+    parser.add_argument("--log-max-per-second", type=float, default=None,
+                        help="Maximum rate of per-datapoint messages per module (implies --queue-logging)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.queue_logging or args.log_json or args.log_sample_rate < 1 or args.log_max_per_second:
+        enable_queue_logging(json_path=args.log_json,
+                             sample_rate=args.log_sample_rate,
+                             max_per_second=args.log_max_per_second)
+    early_stopping = None
+    if args.early_stopping:
+        from .early_stopping import EarlyStopping
+
+        early_stopping = EarlyStopping(confidence=args.early_stopping_confidence,
+                                       min_samples=args.early_stopping_min_samples)
     run_pipeline(
-        wandb_project="test-calibrion-ft",
-        dataset_version="2.0.0",
-        skip_steps=[1, 2, 3]
+        wandb_project=args.wandb_project,
+        dataset_version=args.dataset_version,
+        skip_steps=args.skip_steps,
+        eval_mode=args.eval_mode,
+        cache_mode=args.cache_mode,
+        eval_cache_mode=args.eval_cache_mode,
+        use_scheduler=args.use_scheduler,
+        early_stopping=early_stopping,
+        hedge_requests=args.hedge_requests,
+        request_deadline=args.request_deadline
     )
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+Event-driven pipeline scheduler.
+
+Instead of running every step for all experiments before starting the next one,
+each experiment moves through its own stages independently:
+
+    training -> inference -> scoring -> done
+
+Inference (step 3) for a model starts as soon as its fine-tuning job succeeds and
+scoring (step 4) as soon as its inference finished. The stage of every experiment
+is persisted in `_pipeline_state.json`, so a stopped scheduler resumes where it left off.
+"""
+
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from .experiment_store import get_experiment_store
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+STATE_PATH = Path(__file__).parent / "_pipeline_state.json"
+
+STAGE_TRAINING = "training"
+STAGE_INFERENCE = "inference"
+STAGE_SCORING = "scoring"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+
+
+class PipelineScheduler:
+    """
+    Run steps 2-4 per experiment as soon as the previous stage of that experiment finished.
+
+    Args:
+        wandb_project: W&B project name used for scoring.
+        dataset_version: Version of the dataset whose test split is used for inference.
+        skip_steps: Step numbers to skip. 2: job statuses are not polled, only experiments
+            that already have an ft_model_id proceed. 3: inference is skipped and existing
+            step 3 results are scored. 4: scoring is skipped.
+        eval_mode: Execution mode of step 3 for a single model ("sequential", "async" or "batch").
+        max_inference_workers: Maximum number of models running inference at the same time.
+        poll_interval: Fixed number of seconds between two status checks of jobs that are still
+            training. None derives the delay from the job states (see `step_2_update_experiments.next_poll_delay`).
+        state_path: Path of the persisted scheduler state.
+    """
+
+    def __init__(self,
+                 wandb_project: str,
+                 dataset_version: str,
+                 skip_steps: list[int] = None,
+                 eval_mode: str = "sequential",
+                 max_inference_workers: int = 4,
+                 poll_interval: float = None,
+                 state_path: Path = STATE_PATH):
+        self.wandb_project = wandb_project
+        self.dataset_version = dataset_version
+        self.skip_steps = skip_steps or []
+        self.eval_mode = eval_mode
+        self.max_inference_workers = max_inference_workers
+        self.poll_interval = poll_interval
+        self.state_path = Path(state_path)
+        self.state = {}
+        self.experiments = {}
+        self._running_jobs = []
+        self._next_poll_at = 0.0
+        self._evaluator_registry = None
+
+    def _load(self) -> None:
+        self.experiments = get_experiment_store().all()
+        if self.state_path.exists():
+            with open(self.state_path, 'r') as f:
+                self.state = json.load(f)
+            logger.info(f"Resuming pipeline state from {self.state_path}")
+        for exp_id, exp_data in self.experiments.items():
+            if exp_data.get('pruned'):
+                continue
+            if exp_id not in self.state:
+                stage = STAGE_INFERENCE if exp_data.get('ft_model_id') else STAGE_TRAINING
+                self.state[exp_id] = {"stage": stage}
+
+    def _save(self) -> None:
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=4)
+        tmp_path.replace(self.state_path)
+
+    def _update_experiment(self, exp_id: str, **fields) -> None:
+        self.experiments[exp_id] = get_experiment_store().update(exp_id, **fields)
+
+    def _set_stage(self, exp_id: str, stage: str, **details) -> None:
+        self.state[exp_id].update(stage=stage, **details)
+        self._save()
+        logger.info(f"Experiment {exp_id} -> {stage}")
+
+    def _experiments_in(self, stage: str) -> list[str]:
+        return [exp_id for exp_id, exp_state in self.state.items() if exp_state["stage"] == stage]
+
+    def _poll_training_jobs(self) -> None:
+        """
+        Move experiments whose fine-tuning job finished to the inference (or failed) stage.
+
+        Every job is retrieved once per sweep; a call before the poll delay of the previous
+        sweep has passed does nothing, so finishing stages do not trigger extra sweeps.
+        """
+        from .step_2_update_experiments import FAILED_JOB_STATUSES, SUCCEEDED_JOB_STATUS, retrieve_jobs
+
+        if time.monotonic() < self._next_poll_at:
+            return
+        training = {exp_id: self.experiments[exp_id]['ft_job_id'] for exp_id in self._experiments_in(STAGE_TRAINING)}
+        jobs = retrieve_jobs(list(training.values()))
+        self._running_jobs = []
+        for exp_id, ft_job_id in training.items():
+            job = jobs[ft_job_id]
+            if isinstance(job, Exception):
+                continue
+            if job.status == SUCCEEDED_JOB_STATUS:
+                self._update_experiment(exp_id, ft_model_id=job.fine_tuned_model)
+                self._set_stage(exp_id, STAGE_INFERENCE)
+            elif job.status in FAILED_JOB_STATUSES:
+                self._update_experiment(exp_id, ft_status=job.status)
+                self._set_stage(exp_id, STAGE_FAILED, error=f"Fine-tuning job {ft_job_id} {job.status}")
+            else:
+                logger.debug(f"Job {ft_job_id} status: {job.status}")
+                self._running_jobs.append(job)
+        self._next_poll_at = time.monotonic() + self._poll_delay()
+
+    def _poll_delay(self) -> float:
+        from .step_2_update_experiments import next_poll_delay
+
+        if self.poll_interval is not None:
+            return self.poll_interval
+        return next_poll_delay(self._running_jobs)
+
+    def _run_inference(self, exp_id: str) -> None:
+        from .dataset_config import get_dataset_files
+        from .step_3_eval_run_ft_models import eval_run_fted_models
+
+        if 3 in self.skip_steps:
+            return
+        _, test_file, _, _ = get_dataset_files(self.dataset_version)
+        if not test_file:
+            raise ValueError(f"No test file found for dataset version {self.dataset_version}")
+        eval_run_fted_models([self.experiments[exp_id]['ft_model_id']], test_file, mode=self.eval_mode)
+
+    def _run_scoring(self, exp_id: str) -> None:
+        from .eval_run_store import iter_eval_run_results
+        from .step_4_run_evaluation import SKIP_EVALUATORS, evaluate_and_log_ft_model, get_evaluator_registry
+
+        if 4 in self.skip_steps:
+            return
+        if self._evaluator_registry is None:
+            self._evaluator_registry = get_evaluator_registry(exclude=SKIP_EVALUATORS)
+        ft_model_id = self.experiments[exp_id]['ft_model_id']
+        evaluate_and_log_ft_model(ft_model_id,
+                                  iter_eval_run_results(ft_model_id),
+                                  self.experiments[exp_id],
+                                  self.wandb_project,
+                                  self._evaluator_registry)
+
+    def run(self) -> dict:
+        """
+        Run the scheduler until every experiment is done or failed.
+
+        Returns:
+            dict: The final state of every experiment, keyed by experiment ID.
+        """
+        self._load()
+        self._save()
+
+        running: dict[Future, tuple[str, str]] = {}
+        # Inference is network bound and runs in parallel; scoring logs to W&B, which
+        # supports one active run per process, so it runs one experiment at a time.
+        with ThreadPoolExecutor(max_workers=self.max_inference_workers) as inference_pool, \
+                ThreadPoolExecutor(max_workers=1) as scoring_pool:
+            while True:
+                if 2 not in self.skip_steps:
+                    self._poll_training_jobs()
+
+                busy = {exp_id for exp_id, _ in running.values()}
+                for exp_id in self._experiments_in(STAGE_INFERENCE):
+                    if exp_id not in busy:
+                        running[inference_pool.submit(self._run_inference, exp_id)] = (exp_id, STAGE_INFERENCE)
+                for exp_id in self._experiments_in(STAGE_SCORING):
+                    if exp_id not in busy:
+                        running[scoring_pool.submit(self._run_scoring, exp_id)] = (exp_id, STAGE_SCORING)
+
+                waiting_for_jobs = 2 not in self.skip_steps and self._experiments_in(STAGE_TRAINING)
+                if not running and not waiting_for_jobs:
+                    break
+
+                # Time left until the next sweep of the fine-tuning jobs
+                timeout = max(0.0, self._next_poll_at - time.monotonic()) if waiting_for_jobs else None
+                if not running:
+                    logger.info(f"Waiting for fine-tuning jobs, checking again in {timeout:.0f} seconds...")
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    exp_id, stage = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.exception(f"Stage {stage} failed for experiment {exp_id}: {str(e)}")
+                        self._set_stage(exp_id, STAGE_FAILED, error=f"{stage}: {str(e)}")
+                        continue
+                    self._set_stage(exp_id, STAGE_SCORING if stage == STAGE_INFERENCE else STAGE_DONE)
+
+        for exp_id in self._experiments_in(STAGE_TRAINING):
+            logger.warning(f"Experiment {exp_id} has no fine-tuned model and step 2 is skipped")
+        failed = self._experiments_in(STAGE_FAILED)
+        if failed:
+            logger.error(f"{len(failed)} experiment(s) failed: {failed}")
+        logger.info(f"Scheduler finished: {len(self._experiments_in(STAGE_DONE))} experiment(s) done")
+        return self.state
@@ -1,20 +1,11 @@
-import json
-import shortuuid
 from pathlib import Path
-from openai import OpenAI
-from finetuning import run_finetuning
 import logging
+from .experiment_store import get_experiment_store
+from .job_submitter import JobSubmitter, has_pending_submissions
 from .logging_config import setup_logger
 
 logger = setup_logger(log_level=logging.INFO)
 
-with open('secrets/openai_api_key.json', 'r') as f:
-    credentials = json.load(f)
-
-client = OpenAI(
-  api_key=credentials.get('openai_api_key'),
-)
-
 # TODO Test if all combinations are generated correctly
 def generate_configurations(dataset_version: str,
                           llms,
@@ -69,11 +60,75 @@ def generate_configurations(dataset_version: str,
                 configs.append(config)
     return configs
 
-def run_experiments(training_configurations):
+def make_job_submitter(max_concurrent_jobs=None, max_estimated_spend=None):
+    """
+    Create a JobSubmitter with the limits and prices from `training_configs`, unless overridden.
+
+    Pass `job_submitter.NO_SPEND_CAP` as `max_estimated_spend` to disable the budget of
+    `training_configs`; setting `training_configs.max_estimated_spend` to None disables it as well.
+    """
+    from . import training_configs
+
+    return JobSubmitter(
+        max_concurrent_jobs=max_concurrent_jobs if max_concurrent_jobs is not None else training_configs.max_concurrent_jobs,
+        max_estimated_spend=max_estimated_spend if max_estimated_spend is not None else training_configs.max_estimated_spend,
+        hourly_prices=training_configs.llm_hourly_prices,
+        estimated_training_hours=training_configs.estimated_training_hours,
+    )
+
+
+def validate_dataset_files(training_configurations) -> bool:
+    """
+    Validate the local training and test files of the configurations and log their statistics.
+
+    The statistics are the "chat_stats" of the file's `DatasetRegistry` metadata, cached next to
+    the file in `<file>.meta.json`, so unchanged files are not scanned again. Files that are not
+    available locally (only uploaded) are skipped with a warning.
+
+    Args:
+        training_configurations (list): List of dictionaries containing configurations for fine-tuning.
+
+    Returns:
+        bool: False if a file has no complete example or contains invalid lines.
+    """
+    from .dataset_config import get_dataset_registry
+
+    valid = True
+    files = dict.fromkeys(config[key] for config in training_configurations
+                          for key in ("training_file", "test_file") if config.get(key))
+    for file in files:
+        if not Path(file).exists():
+            logger.warning(f"Dataset file {file} not found locally, skipping validation")
+            continue
+        stats = get_dataset_registry().file_metadata(file)["chat_stats"]
+        examples = stats["examples"]
+        logger.info(f"{file}: {examples} examples in {stats['lines']} lines, "
+                    f"avg. {stats['user_chars'] / max(examples, 1):.0f} prompt chars and "
+                    f"{stats['assistant_chars'] / max(examples, 1):.0f} response chars")
+        if stats["invalid_json"] or stats["missing_user"] or not examples:
+            logger.warning(f"{file}: {stats['invalid_json']} invalid lines, {stats['missing_user']} without "
+                           f"user prompt, {stats['missing_assistant']} without assistant response")
+            valid = False
+    return valid
+
+
+def run_experiments(training_configurations,
+                    max_concurrent_jobs: int = None,
+                    max_estimated_spend: float = None):
     """
     Run fine-tuning experiments based on the provided configurations.
+
+    Configurations are submitted through a persistent `JobSubmitter` queue: at most
+    `max_concurrent_jobs` jobs are active at the same time, configurations that would push
+    the estimated spend above `max_estimated_spend` are skipped, and every submitted job is
+    recorded in the experiment store immediately. Use `resume_experiments` to continue an
+    interrupted sweep.
+
     Args:
         training_configurations (list): List of dictionaries containing configurations for fine-tuning.
+        max_concurrent_jobs (int, optional): Defaults to `training_configs.max_concurrent_jobs`.
+        max_estimated_spend (float, optional): Budget in USD. Defaults to `training_configs.max_estimated_spend`;
+            `job_submitter.NO_SPEND_CAP` disables the budget.
 
         Returns:
             dict: A dictionary where each key is a unique identifier for an experiment,
@@ -98,57 +153,49 @@ def run_experiments(training_configurations):
                         }
                     }
     """
-    experiments = {}
-    
-    logger.warning(f"This will run \"{len(training_configurations)}\" experiments which can become costly.")
+    if not validate_dataset_files(training_configurations):
+        logger.warning("Some dataset files failed validation, see above.")
+
+    submitter = make_job_submitter(max_concurrent_jobs, max_estimated_spend)
+    costs = [submitter.estimate_cost(config) for config in training_configurations]
+    total_cost = sum(cost for cost in costs if cost is not None)
+    unpriced = sum(1 for cost in costs if cost is None)
+
+    estimate = f"estimated ${total_cost:.2f}"
+    if unpriced:
+        estimate += f" without {unpriced} unpriced configuration(s)"
+    budget = "no budget" if submitter.max_estimated_spend is None else f"budget ${submitter.max_estimated_spend:.2f}"
+    logger.warning(f"This will run \"{len(training_configurations)}\" experiments which can become costly "
+                   f"({estimate}, {budget}).")
     user_input = input(f"Do you want to continue experiments? (y/N): ")
     if user_input.lower() != 'y':
         logger.info("Aborting experiment run.")
         return None
     logger.info("Proceeding with experiments...")
-    
-    for config in training_configurations:
-        # Validate required fields
-        if not all(key in config for key in ["model", "training_file", "training_file_oai_id", "hyperparameters"]):
-            logger.error(f"Missing required fields in config: {config}. Skipping this configuration.")
-            continue
-            
-        method_config = None if config["hyperparameters"] is None else {
-            "type": "supervised",
-            "supervised": {
-                "hyperparameters": config["hyperparameters"]
-            }
-        }
-        
-        try:
-            response = run_finetuning(
-                model=config["model"],
-                training_file=config["training_file_oai_id"],
-                ft_method_config=method_config
-            )
-            
-            # Generate unique experiment ID
-            experiment_id = str(shortuuid.uuid())
-            
-            # Store experiment config with UUID as key
-            experiments[experiment_id] = {
-                "model": config["model"],
-                "training_file": config["training_file"],
-                "training_file_oai_id": config["training_file_oai_id"],
-                "test_file": config["test_file"] if "test_file" in config else None,
-                "test_file_oai_id": config["test_file_oai_id"] if "test_file_oai_id" in config else None,
-                "hyperparameters": config["hyperparameters"],
-                "ft_job_id": response.id,
-            }
-
-        except Exception as e:
-            logger.exception(f"Error running experiment with config {config}: {str(e)}")
-    
-    output_path = Path(__file__).parent / "_experiments.json"
-    with open(output_path, "w") as f:
-        json.dump(experiments, f, indent=4)
+
+    submitter.enqueue(training_configurations)
+    experiments = submitter.run()
+
     logger.info(f"Generated {len(experiments)} experiments.")
-    logger.info(f"Experiments saved to {output_path}")
+    logger.info(f"Experiments saved to {get_experiment_store().path}")
     
     return experiments
 
+
+def has_pending_experiments() -> bool:
+    """Return True if an interrupted sweep left configurations in the submission queue."""
+    return has_pending_submissions()
+
+
+def resume_experiments(max_concurrent_jobs: int = None,
+                       max_estimated_spend: float = None):
+    """
+    Continue submitting the configurations left in the persisted queue by `run_experiments`.
+
+    Returns:
+        dict: All experiments of the sweep, as stored in the experiment store.
+    """
+    submitter = make_job_submitter(max_concurrent_jobs, max_estimated_spend)
+    submitter.load()
+    logger.info(f"Resuming sweep with {len(submitter.queue['pending'])} pending configurations")
+    return submitter.run()
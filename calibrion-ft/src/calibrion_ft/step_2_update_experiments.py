@@ -1,56 +1,162 @@
-import json
-from openai import OpenAI
-from pathlib import Path
+import time
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from .clients import get_client
+from .experiment_store import get_experiment_store
+from .rate_limiter import limited_call
 from .logging_config import setup_logger
 
 logger = setup_logger(log_level=logging.INFO)
 
-with open('secrets/openai_api_key.json', 'r') as f:
-    credentials = json.load(f)
+SUCCEEDED_JOB_STATUS = 'succeeded'
+FAILED_JOB_STATUSES = ('failed', 'cancelled')
 
-client = OpenAI(
-  api_key=credentials.get('openai_api_key'),
-)
+# Number of jobs retrieved in parallel
+DEFAULT_POLL_WORKERS = 8
 
-def update_experiments():
+# Bounds of the delay between two polls in seconds
+MIN_POLL_INTERVAL = 30
+MAX_POLL_INTERVAL = 900
+
+# Expected delay per job status when the provider gives no estimated finish time
+STATUS_POLL_INTERVALS = {
+    'validating_files': 60,
+    'queued': 300,
+    'running': 180,
+}
+
+# Growth of the delay for every poll that did not observe any status change
+BACKOFF_FACTOR = 1.5
+
+
+def is_terminal(exp_data: dict) -> bool:
+    """Return True if the fine-tuning job of an experiment has succeeded, failed or been cancelled."""
+    return 'ft_model_id' in exp_data or exp_data.get('ft_status') in FAILED_JOB_STATUSES
+
+
+def retrieve_jobs(ft_job_ids: list[str], max_workers: int = DEFAULT_POLL_WORKERS) -> dict:
+    """
+    Retrieve several fine-tuning jobs concurrently.
+
+    Args:
+        ft_job_ids (list[str]): IDs of the fine-tuning jobs.
+        max_workers (int): Number of jobs retrieved in parallel.
+
+    Returns:
+        dict: Mapping of job ID to the retrieved job, or to the exception raised while retrieving it.
+    """
+    def retrieve(ft_job_id):
+        try:
+            return limited_call("fine_tuning.jobs.retrieve", None,
+                                get_client().fine_tuning.jobs.with_raw_response.retrieve, ft_job_id)
+        except Exception as e:
+            logger.exception(f"Error retrieving job {ft_job_id}: {str(e)}")
+            return e
+
+    if not ft_job_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ft_job_ids))) as pool:
+        return dict(zip(ft_job_ids, pool.map(retrieve, ft_job_ids)))
+
+
+def next_poll_delay(jobs: list, unchanged_polls: int = 0) -> float:
+    """
+    Compute how long to wait before the next poll of the still running jobs.
+
+    The delay is the time until the earliest estimated finish of any job; jobs without an
+    estimate contribute a status-specific default. Every poll that observed no change grows
+    the delay by BACKOFF_FACTOR. The result is clamped to [MIN_POLL_INTERVAL, MAX_POLL_INTERVAL].
+
+    Args:
+        jobs (list): Retrieved fine-tuning jobs that are not terminal yet.
+        unchanged_polls (int): Number of consecutive polls without any status change.
+
+    Returns:
+        float: Delay in seconds.
+    """
+    now = time.time()
+    delays = []
+    for job in jobs:
+        if getattr(job, 'estimated_finish', None):
+            delays.append(job.estimated_finish - now)
+        else:
+            delays.append(STATUS_POLL_INTERVALS.get(job.status, MIN_POLL_INTERVAL))
+    delay = min(delays, default=MIN_POLL_INTERVAL) * BACKOFF_FACTOR ** unchanged_polls
+    return max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, delay))
+
+
+def update_experiments(max_workers: int = DEFAULT_POLL_WORKERS) -> dict:
     """
     Update the experiment results with finetuned model IDs from OpenAI's fine-tuning jobs.
-    This function reads the experiment results from a JSON file, retrieves the status of each fine-tuning job,
-    and updates the JSON file with the finetuned model IDs if all jobs have succeeded.
+    This function reads the experiments from the experiment store, retrieves the status of every
+    fine-tuning job that has not finished yet (concurrently), and records each outcome right away:
+    succeeded jobs get their `ft_model_id`, failed or cancelled jobs get `ft_status` and `ft_error`.
 
     It's necessary step because the finetuned model IDs are not returned immediately after job creation,
     and we need to check the status of each job to ensure they have completed successfully before updating the results.
+
+    Args:
+        max_workers (int): Number of jobs retrieved in parallel.
+
+    Returns:
+        dict: Mapping of experiment ID to the retrieved job for every experiment that was still
+        running before this call (the exception instead of a job if retrieval failed).
     """
 
-    json_path = Path(__file__).parent / '_experiments.json'
-    with open(json_path, 'r') as f:
-        experiments = json.load(f)
+    store = get_experiment_store()
+    experiments = store.all()
 
-    all_succeeded = True
-    job_results = {}
+    pending = {exp_id: exp_data['ft_job_id'] for exp_id, exp_data in experiments.items()
+               if not is_terminal(exp_data)}
+    jobs = retrieve_jobs(list(pending.values()), max_workers=max_workers)
 
-    for exp_id, exp_data in experiments.items():
-        ft_job_id = exp_data['ft_job_id']
-        try:
-            response = client.fine_tuning.jobs.retrieve(ft_job_id)
-            if response.status != 'succeeded':
-                logger.info(f"Job {ft_job_id} status: {response.status}")
-                all_succeeded = False
-                break
-            job_results[exp_id] = response.fine_tuned_model
-        except Exception as e:
-            logger.exception(f"Error retrieving job {ft_job_id}: {str(e)}")
-            all_succeeded = False
+    polled = {}
+    for exp_id, ft_job_id in pending.items():
+        job = jobs[ft_job_id]
+        polled[exp_id] = job
+        if isinstance(job, Exception):
+            continue
+        if job.status == SUCCEEDED_JOB_STATUS:
+            experiments[exp_id] = store.update(exp_id, ft_model_id=job.fine_tuned_model)
+            logger.info(f"Job {ft_job_id} succeeded: {job.fine_tuned_model}")
+        elif job.status in FAILED_JOB_STATUSES:
+            experiments[exp_id] = store.update(exp_id,
+                                               ft_status=job.status,
+                                               ft_error=getattr(job.error, 'message', None) if job.error else None)
+            logger.error(f"Job {ft_job_id} {job.status}: {experiments[exp_id]['ft_error']}")
+        else:
+            logger.info(f"Job {ft_job_id} status: {job.status}")
+
+    finished = sum(1 for exp_data in experiments.values() if is_terminal(exp_data))
+    logger.info(f"{finished}/{len(experiments)} fine-tuning jobs finished")
+    return polled
+
+
+def wait_for_experiments(max_workers: int = DEFAULT_POLL_WORKERS) -> dict:
+    """
+    Poll the fine-tuning jobs until every job succeeded, failed or was cancelled.
+
+    Returns:
+        dict: The final experiments, as stored in the experiment store.
+    """
+    unchanged_polls = 0
+    previous_statuses = None
+    while True:
+        polled = update_experiments(max_workers=max_workers)
+        # Jobs whose retrieval failed are retried on the next poll
+        unfinished = {exp_id: job for exp_id, job in polled.items()
+                      if isinstance(job, Exception)
+                      or (job.status != SUCCEEDED_JOB_STATUS and job.status not in FAILED_JOB_STATUSES)}
+        if not unfinished:
             break
 
-    if all_succeeded:
-        for exp_id, fine_tuned_model in job_results.items():
-            experiments[exp_id]['ft_model_id'] = fine_tuned_model
+        statuses = {exp_id: getattr(job, 'status', None) for exp_id, job in polled.items()}
+        unchanged_polls = unchanged_polls + 1 if statuses == previous_statuses else 0
+        previous_statuses = statuses
 
-        with open(json_path, 'w') as f:
-            json.dump(experiments, f, indent=4)
-        logger.info("Successfully updated all fine-tuned model IDs")
-    else:
-        logger.warning("Update aborted: Not all jobs have succeeded")
+        running = [job for job in unfinished.values() if not isinstance(job, Exception)]
+        delay = next_poll_delay(running, unchanged_polls)
+        logger.info(f"{len(unfinished)} job(s) not finished, checking again in {delay:.0f} seconds...")
+        time.sleep(delay)
 
+    return get_experiment_store().all()
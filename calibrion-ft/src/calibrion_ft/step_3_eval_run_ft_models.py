@@ -1,11 +1,74 @@
-from finetuning import query_fted_model_chat_completion
-from pathlib import Path
-import json
+from .finetuning import query_fted_model_chat_completion, query_fted_model_chat_completion_async
+from contextlib import ExitStack
+import asyncio
 import logging
+from typing import TYPE_CHECKING
+from .batch_inference import eval_run_models_batch
+from .eval_run_store import EVAL_RUNS_DIR, EvalRunWriter
+from .experiment_store import get_experiment_store
+from .hedging import get_hedger
+from .instrumentation import get_provider_metrics
+from .jsonl_dataset import JsonlDataset
 from .logging_config import setup_logger
+from .rate_limiter import get_rate_limiter
+from .response_cache import get_response_cache
+from .transport import get_connection_stats
+
+if TYPE_CHECKING:
+    from .early_stopping import EarlyStopping
 
 logger = setup_logger(log_level=logging.INFO)
 
+# Upper bound on in-flight requests across all models in async mode
+DEFAULT_MAX_CONCURRENCY = 32
+# Upper bound on in-flight requests for a single fine-tuned model in async mode
+DEFAULT_MAX_CONCURRENCY_PER_MODEL = 8
+
+
+def iter_test_examples(test_file: str, skip_datapoint_ids: set[int] = frozenset()):
+    """
+    Iterate over the examples of a test dataset file.
+
+    The file is read through a memory-mapped `JsonlDataset`, so skipped datapoints are
+    not decoded at all.
+
+    Args:
+        test_file (str): Path to the test dataset file (JSONL in chat format).
+        skip_datapoint_ids (set[int]): Datapoints that are not yielded.
+
+    Yields:
+        dict: A dictionary with "datapoint_id", "user_prompt" and "expected_response".
+        Examples without a user prompt are logged and skipped.
+    """
+    with JsonlDataset(test_file) as dataset:
+        yield from dataset.iter_examples(skip_datapoint_ids=skip_datapoint_ids)
+
+
+def iter_eval_run_fted_model(ft_model_id: str,
+                             test_file: str,
+                             skip_datapoint_ids: set[int] = frozenset()):
+    """
+    Run a fine-tuned model on the test dataset and yield the result of each example as it arrives.
+
+    Args:
+        ft_model_id (str): The ID of the fine-tuned model to evaluate.
+        test_file (str): Path to the test dataset file.
+        skip_datapoint_ids (set[int]): Datapoints that already have a result and are not queried again.
+
+    Yields:
+        dict: The evaluation result of one example.
+    """
+    logger.info(f"Starting evaluation for model {ft_model_id} on {test_file}")
+
+    for example in iter_test_examples(test_file, skip_datapoint_ids):
+        response = query_fted_model_chat_completion(model_id=ft_model_id,
+                           user_query=example["user_prompt"])[0]
+
+        yield {
+            **example,
+            "generated_response": response,
+        }
+
 
 def eval_run_fted_model(ft_model_id: str,
                         test_file: str) -> str:
@@ -19,69 +82,225 @@ def eval_run_fted_model(ft_model_id: str,
     Returns:
         list: A list of dictionaries containing evaluation results for each example.
     """
-    
-    logger.info(f"Starting evaluation for model {ft_model_id} on {test_file}")
+    return list(iter_eval_run_fted_model(ft_model_id, test_file))
+
 
+async def query_examples_async(ft_model_id: str,
+                              examples: list[dict],
+                              global_semaphore: asyncio.Semaphore,
+                              on_result,
+                              max_concurrency_per_model: int = DEFAULT_MAX_CONCURRENCY_PER_MODEL) -> int:
+    """
+    Query a fine-tuned model on the given examples with concurrent requests.
+
+    Each request holds a slot of the per-model semaphore and of the shared global
+    semaphore, so the number of in-flight requests is bounded on both levels.
+    Results are handed to `on_result` in completion order and are not kept in memory.
 
-    ft_model_results = []
-    
-    with open(test_file, "r") as test_f:
-        for i, line in enumerate(test_f):
-            logger.debug(f"Processing eval example {i+1}")
-            data = json.loads(line)
-            user_prompt = next((msg['content'] for msg in data['messages'] if msg['role'] == 'user'), None)
-            expected_response = next((msg['content'] for msg in data['messages'] if msg['role'] == 'assistant'), None)
+    Args:
+        ft_model_id (str): The ID of the fine-tuned model to query.
+        examples (list[dict]): Examples as yielded by `iter_test_examples`.
+        global_semaphore (asyncio.Semaphore): Semaphore shared by all models of the run.
+        on_result (callable): Called with the result dictionary of every finished example.
+        max_concurrency_per_model (int): Maximum number of in-flight requests for this model.
 
-            if not user_prompt:
-                logger.warning(f"Could not find user prompt for example {i+1}. Skipping...")
-                continue
-            
-            response = query_fted_model_chat_completion(model_id=ft_model_id,
-                               user_query=user_prompt)[0]
+    Returns:
+        int: Number of examples that were queried.
+    """
+    model_semaphore = asyncio.Semaphore(max_concurrency_per_model)
 
-            ft_model_results.append({
-                "datapoint_id": i + 1,
-                "user_prompt": user_prompt,
-                "expected_response": expected_response,
-                "generated_response": response,
-            })
+    async def run_example(example: dict) -> None:
+        async with model_semaphore, global_semaphore:
+            responses = await query_fted_model_chat_completion_async(model_id=ft_model_id,
+                                                                     user_query=example["user_prompt"])
+        logger.debug("Model %s finished datapoint %s", ft_model_id, example["datapoint_id"],
+                     extra={"datapoint_id": example["datapoint_id"]})
+        on_result({
+            **example,
+            "generated_response": responses[0],
+        })
 
-    return ft_model_results
+    await asyncio.gather(*(run_example(example) for example in examples))
+    return len(examples)
 
 
-def eval_run_all_fted_models(dataset_version: str) -> None:
+async def eval_run_fted_model_async(ft_model_id: str,
+                                    test_file: str,
+                                    global_semaphore: asyncio.Semaphore,
+                                    on_result,
+                                    max_concurrency_per_model: int = DEFAULT_MAX_CONCURRENCY_PER_MODEL,
+                                    skip_datapoint_ids: set[int] = frozenset()) -> int:
+    """
+    Run a fine-tuned model on the test dataset with concurrent requests, see `query_examples_async`.
+
+    Args:
+        ft_model_id (str): The ID of the fine-tuned model to evaluate.
+        test_file (str): Path to the test dataset file.
+        global_semaphore (asyncio.Semaphore): Semaphore shared by all models of the run.
+        on_result (callable): Called with the result dictionary of every finished example.
+        max_concurrency_per_model (int): Maximum number of in-flight requests for this model.
+        skip_datapoint_ids (set[int]): Datapoints that already have a result and are not queried again.
+
+    Returns:
+        int: Number of examples that were queried.
+    """
+    logger.info(f"Starting async evaluation for model {ft_model_id} on {test_file}")
+    return await query_examples_async(ft_model_id,
+                                      list(iter_test_examples(test_file, skip_datapoint_ids)),
+                                      global_semaphore,
+                                      on_result,
+                                      max_concurrency_per_model=max_concurrency_per_model)
+
+
+async def _eval_run_models_async(writers: dict,
+                                 test_file: str,
+                                 max_concurrency: int,
+                                 max_concurrency_per_model: int) -> None:
+    """
+    Run several fine-tuned models on the test dataset concurrently.
+
+    Args:
+        writers (dict): Mapping of ft_model_id to the open EvalRunWriter of that model.
+    """
+    global_semaphore = asyncio.Semaphore(max_concurrency)
+    await asyncio.gather(*(
+        eval_run_fted_model_async(ft_model_id,
+                                  test_file,
+                                  global_semaphore,
+                                  on_result=writer.write,
+                                  max_concurrency_per_model=max_concurrency_per_model,
+                                  skip_datapoint_ids=set(writer.completed_ids))
+        for ft_model_id, writer in writers.items()
+    ))
+
+
+def eval_run_fted_models(ft_model_ids: list[str],
+                         test_file: str,
+                         mode: str = "sequential",
+                         max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                         max_concurrency_per_model: int = DEFAULT_MAX_CONCURRENCY_PER_MODEL,
+                         resume: bool = True,
+                         batch_client=None,
+                         early_stopping: "EarlyStopping" = None) -> None:
+    """
+    Run the given fine-tuned models on a test file and append the results to their JSONL files.
+    The provider call metrics are added to `_provider_metrics.json` (see `instrumentation`).
+
+    Args:
+        ft_model_ids (list[str]): IDs of the fine-tuned models to run.
+        test_file (str): Path to the test dataset file.
+        mode, max_concurrency, max_concurrency_per_model, resume, batch_client, early_stopping:
+            See `eval_run_all_fted_models`.
+    """
+    if mode not in ("sequential", "async", "batch"):
+        raise ValueError(f"Unknown evaluation mode: {mode}")
+    if early_stopping is not None and mode == "batch":
+        raise ValueError("Early stopping needs the sequential or async mode")
+
+    try:
+        if early_stopping is not None:
+            from .early_stopping import eval_run_fted_models_early_stopping
+
+            # Sequential mode keeps one request in flight at a time
+            eval_run_fted_models_early_stopping(ft_model_ids,
+                                                test_file,
+                                                settings=early_stopping,
+                                                max_concurrency=max_concurrency if mode == "async" else 1,
+                                                max_concurrency_per_model=max_concurrency_per_model if mode == "async" else 1,
+                                                resume=resume)
+        elif mode in ("async", "batch"):
+            with ExitStack() as stack:
+                writers = {ft_model_id: stack.enter_context(EvalRunWriter(ft_model_id, resume=resume))
+                           for ft_model_id in ft_model_ids}
+                if mode == "batch":
+                    eval_run_models_batch(writers, list(iter_test_examples(test_file)), test_file,
+                                          client=batch_client)
+                else:
+                    asyncio.run(_eval_run_models_async(writers,
+                                                       test_file,
+                                                       max_concurrency=max_concurrency,
+                                                       max_concurrency_per_model=max_concurrency_per_model))
+        else:
+            for ft_model_id in ft_model_ids:
+                with EvalRunWriter(ft_model_id, resume=resume) as writer:
+                    for result in iter_eval_run_fted_model(ft_model_id,
+                                                           test_file,
+                                                           skip_datapoint_ids=writer.completed_ids.copy()):
+                        writer.write(result)
+    finally:
+        # Latency and token metrics are written even if the run was interrupted
+        get_provider_metrics().write()
+
+
+def select_ft_model_ids(experiments: dict) -> list[str]:
+    """Return the fine-tuned models of the experiments that should be evaluated, skipping unfinished and pruned ones."""
+    ft_model_ids = []
+    for exp_id, exp_data in experiments.items():
+        ft_model_id = exp_data.get('ft_model_id')
+        if not ft_model_id:
+            logger.warning(f"Experiment {exp_id} does not have a fine-tuned model ID. Skipping...")
+            continue
+        if exp_data.get('pruned'):
+            logger.info(f"Experiment {exp_id} was pruned by the hyperparameter search. Skipping...")
+            continue
+        logger.info(f"Evaluating experiment {exp_id} with model {ft_model_id}")
+        ft_model_ids.append(ft_model_id)
+    return ft_model_ids
+
+
+def eval_run_all_fted_models(dataset_version: str,
+                             mode: str = "sequential",
+                             max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                             max_concurrency_per_model: int = DEFAULT_MAX_CONCURRENCY_PER_MODEL,
+                             resume: bool = True,
+                             batch_client=None,
+                             early_stopping: "EarlyStopping" = None) -> None:
     """
     Evaluate all fine-tuned models using the test split.
 
+    Results are appended to one JSONL file per model in `_ft_models_eval_runs/`
+    (see `eval_run_store`) as soon as they arrive.
+
     Args:
         dataset_version (str): Version of the dataset to use for evaluation
+        mode (str): "sequential" queries one datapoint at a time, "async" runs datapoints
+            and models concurrently using the async OpenAI client, "batch" submits the
+            test split to the Batch API (see `batch_inference`) and waits for the results.
+        max_concurrency (int): Maximum number of in-flight requests across all models ("async" mode only).
+        max_concurrency_per_model (int): Maximum number of in-flight requests per model ("async" mode only).
+        resume (bool): Skip (ft_model_id, datapoint_id) pairs that already have a result on disk.
+            If False, existing results of the evaluated models are discarded.
+        batch_client: OpenAI client used in "batch" mode, e.g. one pointing to a local fake
+            endpoint. Defaults to the shared client of `clients.get_client`.
+        early_stopping (EarlyStopping): If set, inference and scoring interleave and models that
+            are clearly behind the best one stop being queried (see `early_stopping`).
+            Not available in "batch" mode.
 
     Returns:
         None
     """
     from .dataset_config import get_dataset_files
-    
-    experiments_path = Path(__file__).parent / "_experiments.json"
-    with open(experiments_path, 'r') as f:
-        experiments = json.load(f)
-    
+
+    experiments = get_experiment_store().all()
+
     _, test_file, _, _ = get_dataset_files(dataset_version)
     if not test_file:
         raise ValueError(f"No test file found for dataset version {dataset_version}")
-    
-    results = {}
-    
-    for exp_id, exp_data in experiments.items():
-        ft_model_id = exp_data.get('ft_model_id')
-        if not ft_model_id:
-            logger.warning(f"Experiment {exp_id} does not have a fine-tuned model ID. Skipping...")
-            continue
-        
-        logger.info(f"Evaluating experiment {exp_id} with model {ft_model_id}")
-        res = eval_run_fted_model(ft_model_id, test_file)
-        results[ft_model_id] = res
-    
-    output_path = Path(__file__).parent / "_ft_models_eval_runs.json"
-    with open(output_path, "w", encoding="utf-8") as out_f:
-        json.dump(results, out_f, indent=2, ensure_ascii=False)
-    logger.info(f"Results saved to {output_path}")
+
+    ft_model_ids = select_ft_model_ids(experiments)
+
+    eval_run_fted_models(ft_model_ids,
+                         test_file,
+                         mode=mode,
+                         max_concurrency=max_concurrency,
+                         max_concurrency_per_model=max_concurrency_per_model,
+                         resume=resume,
+                         batch_client=batch_client,
+                         early_stopping=early_stopping)
+
+    logger.info(f"Results saved to {EVAL_RUNS_DIR}")
+    get_response_cache().log_stats()
+    get_connection_stats().log_stats()
+    get_provider_metrics().log_stats()
+    get_rate_limiter().log_stats()
+    get_hedger().log_stats()
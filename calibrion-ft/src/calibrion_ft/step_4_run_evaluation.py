@@ -1,134 +1,275 @@
-from evaluation.core import run_evaluators
-from evaluation.registry import get_evaluator_registry
-from evaluation.evaluation_utilities import format_eval_results, extract_code
-import wandb
 from pathlib import Path
 import json
 import logging
-import pandas as pd
+from typing import TYPE_CHECKING
+from urllib.parse import quote
+from .evaluation.core import EvaluatorError, run_evaluators_on_batch, shutdown_evaluator_pool
+from .evaluation.memo import get_result_cache
+from .evaluation.registry import get_evaluator_registry
+from .evaluation.aggregation import ErrorAggregator
+from .evaluation.evaluation_utilities import extract_code
+from .early_stopping import load_early_stopping_status
+from .eval_run_store import EVAL_RUNS_DIR, iter_eval_run_results, list_eval_run_models
+from .experiment_store import get_experiment_store
+from .instrumentation import wandb_metrics as provider_wandb_metrics
 from .logging_config import setup_logger
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 logger = setup_logger(log_level=logging.INFO)
 
-def evaluate_ft_model(model_results: list, evaluator_registry) -> tuple[pd.DataFrame, pd.DataFrame]:
+# Evaluators that are not run in step 4
+SKIP_EVALUATORS = ["semantic_similarity_evaluator", "multi_template_guidelines"]
+
+# Per-datapoint error counts of every model, one Parquet (or CSV) file per model
+EVAL_DETAILS_DIR = Path(__file__).parent / "_ft_models_eval_details"
+
+# Number of datapoints handed to the parallel evaluator engine at once
+EVAL_WINDOW_SIZE = 4096
+
+
+def _eval_input(eval_run: dict) -> dict:
+    expected_response = eval_run["expected_response"]
+    generated_response = eval_run["generated_response"]
+
+    expected_html = extract_code(expected_response, "html_code")
+    generated_html = extract_code(generated_response, "html_code")
+    expected_js = extract_code(expected_response, "js_code")
+    generated_js = extract_code(generated_response, "js_code")
+
+    # TODO Clarify translations handling
+    translation_code = generated_html or generated_js
+    return {
+        "html_code": generated_html,
+        "js_code": generated_js,
+        "js_codes": [generated_js],
+        "html_codes": [generated_html],
+        "translations": translation_code,
+    }
+
+
+def iter_scored_datapoints(model_results,
+                           evaluator_registry,
+                           max_workers: int = None,
+                           chunk_size: int = None,
+                           executor: str = "auto"):
     """
-    Evaluate all responses for a single model and return aggregated results.
-    
+    Run the evaluators on the responses of one model and yield the results datapoint by datapoint.
+
+    Datapoints are evaluated in windows of EVAL_WINDOW_SIZE by `run_evaluators_on_batch`,
+    which spreads them over a pool of workers. Results are memoized in the evaluator result
+    cache, so identical generated code is only evaluated once per evaluator version.
+    A datapoint whose code cannot be extracted or on which any evaluator fails is logged and skipped.
+
     Args:
-        model_results: List of dictionaries containing evaluation data for one model
+        model_results: List or iterator of dictionaries containing evaluation data for one model
         evaluator_registry: Registry of evaluators to use
-    
-    Returns:
-        tuple: (detailed_df, summary_df) - Aggregated evaluation results
-        Returns (None, None) if evaluation fails or input is empty
+        max_workers, chunk_size, executor: See `evaluate_ft_model`
+
+    Yields:
+        tuple: (datapoint_id, evaluator name to result dictionary)
     """
-    if not model_results:
-        logger.warning("Empty model results provided")
-        return None, None
+    def evaluate_window(datapoint_ids, eval_inputs):
+        results = run_evaluators_on_batch(evaluator_registry,
+                                          eval_inputs,
+                                          skip_evaluators=SKIP_EVALUATORS,
+                                          max_workers=max_workers,
+                                          chunk_size=chunk_size,
+                                          executor=executor,
+                                          return_exceptions=True,
+                                          result_cache=get_result_cache())
+        for datapoint_id, result in zip(datapoint_ids, results):
+            errors = [value for value in result.values() if isinstance(value, EvaluatorError)]
+            if errors:
+                for error in errors:
+                    logger.error("Error running evaluator %s for datapoint %s: %s",
+                                 error.evaluator_name, datapoint_id, error.message,
+                                 extra={"datapoint_id": datapoint_id})
+                continue
+            yield datapoint_id, result
 
-    agg_error_details_df = None
-    
+    datapoint_ids, eval_inputs = [], []
     for eval_run in model_results:
-        expected_response = eval_run["expected_response"]
-        generated_response = eval_run["generated_response"]
         datapoint_id = eval_run["datapoint_id"]
-        
         try:
-            expected_html = extract_code(expected_response, "html_code")
-            generated_html = extract_code(generated_response, "html_code")
-            expected_js = extract_code(expected_response, "js_code")
-            generated_js = extract_code(generated_response, "js_code")
+            eval_input = _eval_input(eval_run)
         except Exception:
-            logger.error(f"Code extraction failed for datapoint {datapoint_id}")
+            logger.error("Code extraction failed for datapoint %s", datapoint_id,
+                         extra={"datapoint_id": datapoint_id})
             continue
+        # The input holds whole generated HTML/JS, so it is only formatted if DEBUG is enabled
+        logger.debug("Queued datapoint %s for evaluation with input: %s", datapoint_id, eval_input,
+                     extra={"datapoint_id": datapoint_id})
+        datapoint_ids.append(datapoint_id)
+        eval_inputs.append(eval_input)
+        if len(eval_inputs) >= EVAL_WINDOW_SIZE:
+            yield from evaluate_window(datapoint_ids, eval_inputs)
+            datapoint_ids, eval_inputs = [], []
+    if eval_inputs:
+        yield from evaluate_window(datapoint_ids, eval_inputs)
 
-        # TODO Clarify translations handling
-        if generated_html:
-            translation_code = generated_html
-        elif generated_js:
-            translation_code = generated_js
-        eval_input = {
-            "html_code": generated_html,
-            "js_code": generated_js,
-            "js_codes": [generated_js],
-            "html_codes": [generated_html],
-            "translations": translation_code,
-        }
-        logger.debug(f"Running evaluators for datapoint {datapoint_id} with input: {eval_input}")
-        try:
-            result = run_evaluators(evaluator_registry,
-                              eval_input,
-                              skip_evaluators=["semantic_similarity_evaluator", "multi_template_guidelines"])
-        except Exception as e:
-            logger.error(f"Error running evaluators for datapoint {datapoint_id}: {str(e)}")
-            continue
-        
-        details_df, _ = format_eval_results(result, method='pandas')
+
+def evaluate_ft_model(model_results,
+                      evaluator_registry,
+                      max_workers: int = None,
+                      chunk_size: int = None,
+                      executor: str = "auto",
+                      details_path: Path = None) -> "pd.DataFrame":
+    """
+    Evaluate all responses for a single model and return aggregated results.
+
+    Datapoints are scored by `iter_scored_datapoints` and their error categories are folded
+    into counters as results arrive (see `ErrorAggregator`). A datapoint on which any
+    evaluator fails is logged and left out of the aggregate, as before.
+    
+    Args:
+        model_results: List or iterator of dictionaries containing evaluation data for one model
+        evaluator_registry: Registry of evaluators to use
+        max_workers: Number of evaluator workers. Defaults to the number of CPUs.
+        chunk_size: Number of datapoints sent to a worker at once. Defaults to the largest
+            preferred batch size of the evaluators
+        executor: "auto", "process", "thread" or "serial", see `run_evaluators_on_batch`
+        details_path: If set, the per-datapoint error counts are written there as Parquet
+            (CSV if no Parquet engine is installed)
+    
+    Returns:
+        pd.DataFrame: Total count per error category ("Category", "Count"), or None if
+        evaluation fails or input is empty
+    """
+    aggregator = ErrorAggregator(evaluator_registry)
+    num_results = 0
+
+    def counted(results):
+        nonlocal num_results
+        for eval_run in results:
+            num_results += 1
+            yield eval_run
+
+    for datapoint_id, result in iter_scored_datapoints(counted(model_results),
+                                                       evaluator_registry,
+                                                       max_workers=max_workers,
+                                                       chunk_size=chunk_size,
+                                                       executor=executor):
+        aggregator.add(datapoint_id, result)
+
+    if num_results == 0:
+        logger.warning("Empty model results provided")
+    if details_path is not None and aggregator.num_datapoints:
+        details_path = aggregator.write_datapoints(details_path)
+        logger.info(f"Wrote per-datapoint error counts to {details_path}")
+    return aggregator.summary()
+
+
+def evaluate_and_log_ft_model(ft_model_id: str,
+                              model_results,
+                              experiment_config: dict,
+                              wandb_project: str,
+                              evaluator_registry) -> None:
+    """
+    Evaluate the results of one fine-tuned model and log the error counts to a W&B run.
+
+    Args:
+        ft_model_id: ID of the fine-tuned model
+        model_results: List or iterator of dictionaries containing evaluation data for the model
+        experiment_config: Experiment entry of the model from the experiment store
+        wandb_project: Name of the W&B project to log results
+        evaluator_registry: Registry of evaluators to use
+    """
+    logger.info(f"Evaluating results for model {ft_model_id}")
+    details_path = EVAL_DETAILS_DIR / f"{quote(ft_model_id, safe='')}.parquet"
+    details_df = evaluate_ft_model(model_results, evaluator_registry, details_path=details_path)
+    log_ft_model_summary(ft_model_id, details_df, experiment_config, wandb_project)
+
+
+def log_ft_model_summary(ft_model_id: str,
+                         details_df: "pd.DataFrame",
+                         experiment_config: dict,
+                         wandb_project: str) -> None:
+    """
+    Log the error counts of one fine-tuned model to a W&B run, together with the provider call
+    metrics of the model from `_provider_metrics.json` ("provider/..." metrics) and, if step 3
+    ran with early stopping, whether the model was stopped early and how many examples it saw.
+
+    Args:
+        ft_model_id: ID of the fine-tuned model
+        details_df: Total count per error category ("Category", "Count"), or None
+        experiment_config: Experiment entry of the model from the experiment store
+        wandb_project: Name of the W&B project to log results
+    """
+    import wandb
+
+    wandb.init(
+        project=wandb_project,
+        name=f"evaluation_{ft_model_id}",
+        config={
+            "model": experiment_config["model"],
+            "training_file": experiment_config["training_file"],
+            "hyperparameters": experiment_config["hyperparameters"],
+            "ft_job_id": experiment_config["ft_job_id"],
+            "ft_model_id": ft_model_id
+        },
+        tags=["model_evaluation"],
+        reinit=True
+    )
+
+    metrics = {}
+    if details_df is not None:
+        logger.info(f"\nModel {ft_model_id} Detailed Results:\n{details_df}\n")
+        for category, count in zip(details_df['Category'], details_df['Count'].tolist()):
+            metrics[f"errors/{category.lower().replace(' ', '_')}"] = count
         
-        if agg_error_details_df is None:
-            agg_error_details_df = details_df.copy()
-        else:
-            agg_error_details_df['Count'] += details_df['Count']        
+        metrics["errors/total"] = int(details_df['Count'].sum())
 
-    return agg_error_details_df
+    # Latency, token and cost summary of the model's provider calls in step 3
+    metrics.update(provider_wandb_metrics(ft_model_id))
+    early_stopping = load_early_stopping_status().get(ft_model_id)
+    if early_stopping:
+        metrics["early_stopping/stopped_early"] = int(early_stopping["stopped_early"])
+        metrics["early_stopping/examples_seen"] = early_stopping["examples_seen"]
+        if early_stopping["error_rate"] is not None:
+            metrics["early_stopping/error_rate"] = early_stopping["error_rate"]
+    if metrics:
+        wandb.log(metrics)
+        
+    wandb.finish()
 
 
 def evaluate_all_ft_models(wandb_project: str) -> None:
     """
-    Evaluate all model results from the JSON file.
+    Evaluate all model results written by step 3.
+
+    Results are streamed from the per-model JSONL files in `_ft_models_eval_runs/`.
+    If that directory does not exist, the legacy `_ft_models_eval_runs.json` is read instead.
     
     Args:
         wandb_project: Name of the W&B project to log results
     """
-    eval_run_results = Path(__file__).parent / "_ft_models_eval_runs.json"
-    experiments_path = Path(__file__).parent / "_experiments.json"
-    
-    logger.info(f"Starting evaluation of results from {eval_run_results}")
-    evaluator_registry = get_evaluator_registry()
+    legacy_eval_run_results = Path(__file__).parent / "_ft_models_eval_runs.json"
 
-    with open(experiments_path, 'r') as f:
-        experiments_config = json.load(f)
-    
-    with open(eval_run_results, 'r') as f:
-        ft_models_eval_runs = json.load(f)
-    
-    for ft_model_id, content in ft_models_eval_runs.items():
-        experiment_config = None
-        for exp in experiments_config.values():
-            if exp.get('ft_model_id') == ft_model_id:
-                experiment_config = exp
-                break
-        
-        if not experiment_config:
-            logger.warning(f"No experiment config found for model {ft_model_id}")
-            continue
+    evaluator_registry = get_evaluator_registry(exclude=SKIP_EVALUATORS)
 
-        wandb.init(
-            project=wandb_project,
-            name=f"evaluation_{ft_model_id}",
-            config={
-                "model": experiment_config["model"],
-                "training_file": experiment_config["training_file"],
-                "hyperparameters": experiment_config["hyperparameters"],
-                "ft_job_id": experiment_config["ft_job_id"],
-                "ft_model_id": ft_model_id
-            },
-            tags=["model_evaluation"],
-            reinit=True
-        )
-        
-        logger.info(f"Evaluating results for model {ft_model_id}")
-        details_df = evaluate_ft_model(content, evaluator_registry)
-        if details_df is not None:
-            logger.info(f"\nModel {ft_model_id} Detailed Results:\n{details_df}\n")
-            metrics = {}
-            for _, row in details_df.iterrows():
-                category = row['Category'].lower().replace(' ', '_')
-                count = row['Count']
-                metrics[f"errors/{category}"] = count
-            
-            metrics["errors/total"] = details_df['Count'].sum()
-
-            wandb.log(metrics)
-            
-        wandb.finish()
\ No newline at end of file
+    experiment_store = get_experiment_store()
+
+    if EVAL_RUNS_DIR.exists():
+        logger.info(f"Starting evaluation of results from {EVAL_RUNS_DIR}")
+        ft_models_eval_runs = ((ft_model_id, iter_eval_run_results(ft_model_id))
+                               for ft_model_id in list_eval_run_models())
+    else:
+        logger.info(f"Starting evaluation of results from {legacy_eval_run_results}")
+        with open(legacy_eval_run_results, 'r') as f:
+            ft_models_eval_runs = json.load(f).items()
+
+    try:
+        for ft_model_id, content in ft_models_eval_runs:
+            found = experiment_store.find_by_ft_model_id(ft_model_id)
+            if not found:
+                logger.warning(f"No experiment config found for model {ft_model_id}")
+                continue
+            _, experiment_config = found
+
+            evaluate_and_log_ft_model(ft_model_id, content, experiment_config, wandb_project, evaluator_registry)
+    finally:
+        shutdown_evaluator_pool()
+
+    get_result_cache().log_stats()
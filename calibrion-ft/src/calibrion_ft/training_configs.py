@@ -24,3 +24,36 @@ batch_sizes = [
 learning_rate_multipliers = [
     # 0.05
 ]
+
+
+# Training price in USD per hour, as listed next to `llms` above.
+# Used by the job submitter to estimate the spend of a sweep.
+llm_hourly_prices = {
+    "gpt-4.1-nano-2025-04-14": 1.50,
+    "gpt-4o-mini-2024-07-18": 3.00,
+    "gpt-4.1-mini-2025-04-14": 5.00,
+    "gpt-4.1-2025-04-14": 25.00,
+    "o4-mini-2025-04-16": 100.00,
+}
+
+# Inference price of the fine-tuned models in USD per 1M (input, output) tokens, by base model.
+# Used to estimate the cost of provider calls in `instrumentation.py`.
+llm_inference_prices = {
+    "gpt-4.1-nano-2025-04-14": (0.20, 0.80),
+    "gpt-4o-mini-2024-07-18": (0.30, 1.20),
+    "gpt-4.1-mini-2025-04-14": (0.80, 3.20),
+    "gpt-4.1-2025-04-14": (3.00, 12.00),
+    "gpt-4o-2024-08-06": (3.75, 15.00),
+    "o4-mini-2025-04-16": (4.00, 16.00),
+}
+
+# Assumed duration of a single fine-tuning job in hours, for cost estimates.
+estimated_training_hours = 1.0
+
+# Maximum number of fine-tuning jobs that are active (queued or running) at the same time.
+# The provider rejects new jobs above its own limit.
+max_concurrent_jobs = 3
+
+# Maximum estimated spend of a sweep in USD. Configurations that would exceed it are not submitted.
+# None submits every configuration.
+max_estimated_spend = 250.0
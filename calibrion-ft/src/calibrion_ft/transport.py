@@ -0,0 +1,184 @@
+"""
+Shared HTTP transport for all provider calls.
+
+The OpenAI clients of `clients.py` are built on one sync and one async HTTP client
+configured here, so every step (job submission, job polling, model queries, batches)
+shares the same connection pool, and TLS handshakes and DNS lookups are paid once per
+connection instead of once per step or request.
+
+Connection reuse is counted from the HTTP core trace events: every request that did not
+open a new TCP connection reused a pooled one.
+"""
+
+import logging
+import threading
+from typing import Optional
+
+from .logging_config import setup_logger
+
+logger = setup_logger(log_level=logging.INFO)
+
+# Pool limits, sized for the async evaluation of step 3 (DEFAULT_MAX_CONCURRENCY) plus job polling
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 64
+
+# Seconds an idle connection is kept in the pool
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+# Timeouts in seconds; reads are long because fine-tuned models can take minutes to answer
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 600.0
+DEFAULT_WRITE_TIMEOUT = 600.0
+DEFAULT_POOL_TIMEOUT = 600.0
+
+
+class ConnectionStats:
+    """Thread-safe counters of requests, new connections and TLS handshakes."""
+
+    def __init__(self):
+        self.requests = 0
+        self.http2_requests = 0
+        self.connections_opened = 0
+        self.connection_failures = 0
+        self.tls_handshakes = 0
+        self._lock = threading.Lock()
+
+    def record(self, event_name: str) -> None:
+        """Count one HTTP core trace event."""
+        with self._lock:
+            if event_name == "connection.connect_tcp.complete":
+                self.connections_opened += 1
+            elif event_name == "connection.connect_tcp.failed":
+                self.connection_failures += 1
+            elif event_name == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+            elif event_name == "http11.send_request_headers.started":
+                self.requests += 1
+            elif event_name == "http2.send_request_headers.started":
+                self.requests += 1
+                self.http2_requests += 1
+
+    def stats(self) -> dict:
+        """Return the counters and the share of requests sent on a reused connection."""
+        with self._lock:
+            reused = max(0, self.requests - self.connections_opened)
+            return {
+                "requests": self.requests,
+                "http2_requests": self.http2_requests,
+                "connections_opened": self.connections_opened,
+                "connection_failures": self.connection_failures,
+                "tls_handshakes": self.tls_handshakes,
+                "reused_requests": reused,
+                "reuse_rate": reused / self.requests if self.requests else 0.0,
+            }
+
+    def log_stats(self) -> None:
+        """Log the counters."""
+        stats = self.stats()
+        if not stats["requests"]:
+            return
+        logger.info(
+            f"HTTP transport: {stats['requests']} requests on {stats['connections_opened']} new connections "
+            f"({stats['reuse_rate']:.1%} reused), {stats['tls_handshakes']} TLS handshakes, "
+            f"{stats['connection_failures']} connection failures, {stats['http2_requests']} HTTP/2 requests"
+        )
+
+
+_settings = {
+    "max_connections": DEFAULT_MAX_CONNECTIONS,
+    "max_keepalive_connections": DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    "keepalive_expiry": DEFAULT_KEEPALIVE_EXPIRY,
+    "connect_timeout": DEFAULT_CONNECT_TIMEOUT,
+    "read_timeout": DEFAULT_READ_TIMEOUT,
+    "write_timeout": DEFAULT_WRITE_TIMEOUT,
+    "pool_timeout": DEFAULT_POOL_TIMEOUT,
+    "http2": False,
+}
+_connection_stats = ConnectionStats()
+
+
+def configure_transport(max_connections: Optional[int] = DEFAULT_MAX_CONNECTIONS,
+                        max_keepalive_connections: Optional[int] = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry: Optional[float] = DEFAULT_KEEPALIVE_EXPIRY,
+                        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                        read_timeout: float = DEFAULT_READ_TIMEOUT,
+                        write_timeout: float = DEFAULT_WRITE_TIMEOUT,
+                        pool_timeout: float = DEFAULT_POOL_TIMEOUT,
+                        http2: bool = False) -> None:
+    """
+    Configure the HTTP transport of the shared OpenAI clients. Clients built before are
+    discarded and rebuilt with the new settings on next use.
+
+    Args:
+        max_connections: Maximum number of open connections, None for unlimited.
+        max_keepalive_connections: Maximum number of idle connections kept in the pool.
+        keepalive_expiry: Seconds an idle connection is kept in the pool.
+        connect_timeout, read_timeout, write_timeout: Timeouts of a single request in seconds.
+        pool_timeout: Seconds a request waits for a free connection when the pool is full.
+        http2: Use HTTP/2 (multiplexes requests over few connections). Requires the `h2` package;
+            falls back to HTTP/1.1 if it is not installed.
+    """
+    from . import clients
+
+    _settings.update(max_connections=max_connections,
+                     max_keepalive_connections=max_keepalive_connections,
+                     keepalive_expiry=keepalive_expiry,
+                     connect_timeout=connect_timeout,
+                     read_timeout=read_timeout,
+                     write_timeout=write_timeout,
+                     pool_timeout=pool_timeout,
+                     http2=http2)
+    clients.reset_clients()
+
+
+def get_connection_stats() -> ConnectionStats:
+    """Return the connection counters of the shared transport."""
+    return _connection_stats
+
+
+def _http_client_kwargs() -> dict:
+    import openai
+
+    limits_class = type(openai.DEFAULT_CONNECTION_LIMITS)
+    kwargs = {
+        "limits": limits_class(max_connections=_settings["max_connections"],
+                               max_keepalive_connections=_settings["max_keepalive_connections"],
+                               keepalive_expiry=_settings["keepalive_expiry"]),
+        "timeout": openai.Timeout(connect=_settings["connect_timeout"],
+                                  read=_settings["read_timeout"],
+                                  write=_settings["write_timeout"],
+                                  pool=_settings["pool_timeout"]),
+    }
+    if _settings["http2"]:
+        try:
+            import h2  # noqa: F401
+            kwargs["http2"] = True
+        except ImportError:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+    return kwargs
+
+
+def build_http_client():
+    """Build the pooled sync HTTP client for `OpenAI`, with connection tracing."""
+    import openai
+
+    def trace(event_name, info):
+        _connection_stats.record(event_name)
+
+    def add_trace(request):
+        request.extensions["trace"] = trace
+
+    return openai.DefaultHttpxClient(event_hooks={"request": [add_trace]}, **_http_client_kwargs())
+
+
+def build_async_http_client():
+    """Build the pooled async HTTP client for `AsyncOpenAI`, with connection tracing."""
+    import openai
+
+    async def trace(event_name, info):
+        _connection_stats.record(event_name)
+
+    async def add_trace(request):
+        request.extensions["trace"] = trace
+
+    return openai.DefaultAsyncHttpxClient(event_hooks={"request": [add_trace]}, **_http_client_kwargs())
@@ -0,0 +1,715 @@
+"""
+Durable local work queue for sharded, multi-worker evaluation.
+
+The test split is cut into contiguous shards (see `JsonlDataset.shard_bounds`), and every
+`(ft_model_id, shard)` pair becomes one work item per stage:
+
+    inference (step 3) -> scoring (step 4)
+
+Items live in a SQLite database. Independent worker processes, on this machine or on
+others that share the filesystem, claim items with a lease, renew the lease while they
+work and mark the item done when finished. An item whose lease expired (its worker died)
+is handed to the next worker, which resumes the shard from the results already on disk.
+Each shard writes its results to its own directory in `_work_queue_results/`, in the
+step 3 JSONL format and the step 4 per-datapoint format, and the coordinator merges
+them into `_ft_models_eval_runs/` and `_ft_models_eval_details/` once a model is complete.
+
+The database uses SQLite's rollback journal instead of WAL: WAL needs shared memory and
+does not work across machines on a network filesystem.
+
+Usage:
+    python -m calibrion_ft.work_queue submit --dataset-version 2.0.0 --num-shards 32
+    python -m calibrion_ft.work_queue worker --threads 4 --api-key-env OPENAI_API_KEY_ORG2
+    python -m calibrion_ft.work_queue merge --wandb-project my-project --wait
+    python -m calibrion_ft.work_queue status
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+from .experiment_store import get_experiment_store
+from .instrumentation import get_provider_metrics
+from .logging_config import setup_logger
+from .scheduler import STAGE_INFERENCE, STAGE_SCORING
+
+logger = setup_logger(log_level=logging.INFO)
+
+DEFAULT_QUEUE_PATH = Path(__file__).parent / "_work_queue.sqlite"
+WORK_DIR = Path(__file__).parent / "_work_queue_results"
+
+STAGES = (STAGE_INFERENCE, STAGE_SCORING)
+
+# pending: waiting for a worker, leased: claimed by a worker, done: finished,
+# failed: gave up after DEFAULT_MAX_ATTEMPTS attempts
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Seconds a claimed item stays with its worker without a lease renewal
+DEFAULT_LEASE_SECONDS = 300.0
+
+# Attempts per item before it is marked failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Seconds an idle worker or a waiting coordinator sleeps between two polls of the queue
+DEFAULT_POLL_INTERVAL = 10.0
+
+# Seconds a connection waits for a lock held by another process
+SQLITE_TIMEOUT = 60.0
+
+
+class LeaseLostError(Exception):
+    """Raised in a worker whose lease on an item expired and was taken over by another worker."""
+
+
+@dataclass(frozen=True)
+class WorkItem:
+    """One stage of one shard of one fine-tuned model."""
+    id: int
+    stage: str
+    ft_model_id: str
+    test_file: str
+    shard_index: int
+    num_shards: int
+    then_score: bool
+    attempts: int
+
+    @property
+    def shard_dir(self) -> Path:
+        return shard_dir(self.shard_index, self.num_shards)
+
+
+def shard_dir(shard_index: int, num_shards: int, work_dir: Path = WORK_DIR) -> Path:
+    """Return the directory holding the results of one shard."""
+    return Path(work_dir) / f"shard-{shard_index:04d}-of-{num_shards:04d}"
+
+
+def shard_details_path(ft_model_id: str, shard_index: int, num_shards: int, work_dir: Path = WORK_DIR) -> Path:
+    """Return the per-datapoint error counts of one model on one shard."""
+    return shard_dir(shard_index, num_shards, work_dir) / f"{quote(ft_model_id, safe='')}.parquet"
+
+
+class WorkQueue:
+    """
+    SQLite-backed queue of work items with leases.
+
+    Args:
+        path: Path of the SQLite database file, on a filesystem shared by all workers.
+        lease_seconds: Seconds a claimed item stays with its worker without a renewal.
+        max_attempts: Attempts per item before it is marked failed.
+    """
+
+    def __init__(self,
+                 path: Path = DEFAULT_QUEUE_PATH,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS work_items ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " stage TEXT NOT NULL,"
+                " ft_model_id TEXT NOT NULL,"
+                " test_file TEXT NOT NULL,"
+                " shard_index INTEGER NOT NULL,"
+                " num_shards INTEGER NOT NULL,"
+                " then_score INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"
+                " worker_id TEXT,"
+                " lease_expires_at REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " updated_at REAL NOT NULL,"
+                " UNIQUE (stage, ft_model_id, shard_index, num_shards))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items (status, stage)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS merges ("
+                " stage TEXT NOT NULL,"
+                " ft_model_id TEXT NOT NULL,"
+                " merged_at REAL NOT NULL,"
+                " PRIMARY KEY (stage, ft_model_id))"
+            )
+        return self._conn
+
+    def _execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection().execute(sql, parameters)
+
+    def submit(self,
+               ft_model_ids: list[str],
+               test_file: str,
+               num_shards: int,
+               stages: tuple[str, ...] = STAGES) -> int:
+        """
+        Add the items of the given models and stages. Items that already exist are kept as they are,
+        so submitting the same run twice does not repeat any work.
+
+        If both stages are requested, only the inference items are added; the scoring item of
+        a shard is added when its inference item is done.
+
+        Returns:
+            int: Number of items added.
+        """
+        unknown = set(stages) - set(STAGES)
+        if unknown or not stages:
+            raise ValueError(f"Unknown stages: {sorted(unknown)}. Expected some of {STAGES}")
+        stage = STAGE_INFERENCE if STAGE_INFERENCE in stages else STAGE_SCORING
+        then_score = STAGE_INFERENCE in stages and STAGE_SCORING in stages
+        for ft_model_id in ft_model_ids:
+            existing = {num for _, num in self.shards(ft_model_id, stage)} - {num_shards}
+            if existing:
+                raise ValueError(f"Model {ft_model_id} is already queued in {existing.pop()} shards, not {num_shards}")
+            # Items are keyed without the test file, and a model has one merged result file
+            other_files = [queued for queued in self.test_files(ft_model_id)
+                           if Path(queued).resolve() != Path(test_file).resolve()]
+            if other_files:
+                raise ValueError(f"Model {ft_model_id} is already queued on {other_files[0]}, not {test_file}. "
+                                 f"Use another queue file to evaluate it on another test file")
+        now = time.time()
+        rows = [(stage, ft_model_id, str(test_file), shard_index, num_shards, int(then_score), STATUS_PENDING, now)
+                for ft_model_id in ft_model_ids for shard_index in range(num_shards)]
+        with self._lock:
+            conn = self._connection()
+            before = conn.total_changes
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO work_items"
+                " (stage, ft_model_id, test_file, shard_index, num_shards, then_score, status, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+            added = conn.total_changes - before
+        logger.info(f"Submitted {added} {stage} items for {len(ft_model_ids)} models in {num_shards} shards")
+        return added
+
+    def claim(self, worker_id: str, stages: tuple[str, ...] = STAGES) -> Optional[WorkItem]:
+        """
+        Lease the oldest pending item of the given stages, or an item whose lease expired.
+
+        An expired item that already used up `max_attempts` (its workers kept dying on it) is
+        marked failed instead of being leased again.
+
+        Returns:
+            WorkItem: The claimed item, or None if there is nothing to do.
+        """
+        now = time.time()
+        placeholders = ", ".join("?" * len(stages))
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                exhausted = conn.execute(
+                    "UPDATE work_items SET status = ?, worker_id = NULL, lease_expires_at = NULL,"
+                    " error = ?, updated_at = ?"
+                    f" WHERE stage IN ({placeholders})"
+                    "  AND status = ? AND lease_expires_at < ? AND attempts >= ?",
+                    (STATUS_FAILED, "Lease expired on the last attempt", now,
+                     *stages, STATUS_LEASED, now, self.max_attempts)).rowcount
+                row = conn.execute(
+                    "SELECT id, stage, ft_model_id, test_file, shard_index, num_shards, then_score, attempts"
+                    " FROM work_items"
+                    f" WHERE stage IN ({placeholders})"
+                    "  AND (status = ? OR (status = ? AND lease_expires_at < ? AND attempts < ?))"
+                    " ORDER BY id LIMIT 1",
+                    (*stages, STATUS_PENDING, STATUS_LEASED, now, self.max_attempts)).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE work_items SET status = ?, worker_id = ?, lease_expires_at = ?,"
+                        " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (STATUS_LEASED, worker_id, now + self.lease_seconds, now, row[0]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if exhausted:
+            logger.warning(f"Marked {exhausted} item(s) failed whose lease expired on their last attempt")
+        if row is None:
+            return None
+        item_id, stage, ft_model_id, test_file, shard_index, num_shards, then_score, attempts = row
+        return WorkItem(item_id, stage, ft_model_id, test_file, shard_index, num_shards, bool(then_score), attempts + 1)
+
+    def renew(self, item: WorkItem, worker_id: str) -> bool:
+        """Extend the lease of an item. Returns False if the worker no longer holds it."""
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE work_items SET lease_expires_at = ?, updated_at = ?"
+            " WHERE id = ? AND worker_id = ? AND status = ?",
+            (now + self.lease_seconds, now, item.id, worker_id, STATUS_LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, item: WorkItem, worker_id: str) -> bool:
+        """
+        Mark an item done and, for an inference item of a run with scoring, add the scoring item
+        of the same shard. Returns False if the worker no longer holds the item.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = conn.execute(
+                    "UPDATE work_items SET status = ?, lease_expires_at = NULL, error = NULL, updated_at = ?"
+                    " WHERE id = ? AND worker_id = ? AND status = ?",
+                    (STATUS_DONE, now, item.id, worker_id, STATUS_LEASED)).rowcount == 1
+                if updated and item.stage == STAGE_INFERENCE and item.then_score:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO work_items"
+                        " (stage, ft_model_id, test_file, shard_index, num_shards, then_score, status, updated_at)"
+                        " VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                        (STAGE_SCORING, item.ft_model_id, item.test_file, item.shard_index, item.num_shards,
+                         STATUS_PENDING, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return updated
+
+    def fail(self, item: WorkItem, worker_id: str, error: str) -> None:
+        """Release an item after an error: it is retried until it used up `max_attempts`."""
+        status = STATUS_FAILED if item.attempts >= self.max_attempts else STATUS_PENDING
+        self._execute(
+            "UPDATE work_items SET status = ?, worker_id = NULL, lease_expires_at = NULL, error = ?, updated_at = ?"
+            " WHERE id = ? AND worker_id = ? AND status = ?",
+            (status, error, time.time(), item.id, worker_id, STATUS_LEASED))
+
+    def retry_failed(self) -> int:
+        """
+        Reset failed items to pending with fresh attempts. Returns the number of items reset.
+
+        A stage that was merged without its failed shards is merged again once they finish, and
+        so is the scoring stage of a run with both stages whose inference items are retried.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "DELETE FROM merges WHERE (stage, ft_model_id) IN"
+                    " (SELECT stage, ft_model_id FROM work_items WHERE status = ?)",
+                    (STATUS_FAILED,))
+                conn.execute(
+                    "DELETE FROM merges WHERE stage = ? AND ft_model_id IN"
+                    " (SELECT ft_model_id FROM work_items WHERE status = ? AND stage = ? AND then_score = 1)",
+                    (STAGE_SCORING, STATUS_FAILED, STAGE_INFERENCE))
+                reset = conn.execute(
+                    "UPDATE work_items SET status = ?, attempts = 0, updated_at = ? WHERE status = ?",
+                    (STATUS_PENDING, time.time(), STATUS_FAILED)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return reset
+
+    def counts(self) -> dict:
+        """Return the number of items per (stage, status)."""
+        rows = self._execute("SELECT stage, status, COUNT(*) FROM work_items GROUP BY stage, status").fetchall()
+        return {(stage, status): count for stage, status, count in rows}
+
+    def model_progress(self) -> dict:
+        """
+        Return, per fine-tuned model and stage, the number of items, of done and of failed items.
+
+        Returns:
+            dict: {ft_model_id: {stage: {"items", "done", "failed", "then_score"}}}. Scoring items
+            of a run with both stages are only added as inference finishes.
+        """
+        rows = self._execute(
+            "SELECT ft_model_id, stage, COUNT(*), SUM(status = ?), SUM(status = ?), MAX(then_score)"
+            " FROM work_items GROUP BY ft_model_id, stage",
+            (STATUS_DONE, STATUS_FAILED)).fetchall()
+        progress = {}
+        for ft_model_id, stage, items, done, failed, then_score in rows:
+            progress.setdefault(ft_model_id, {})[stage] = {"items": items, "done": done, "failed": failed,
+                                                           "then_score": bool(then_score)}
+        return progress
+
+    def shards(self, ft_model_id: str, stage: str) -> list[tuple[int, int]]:
+        """Return the (shard_index, num_shards) of the items of a model and stage."""
+        return self._execute(
+            "SELECT shard_index, num_shards FROM work_items WHERE ft_model_id = ? AND stage = ? ORDER BY shard_index",
+            (ft_model_id, stage)).fetchall()
+
+    def test_files(self, ft_model_id: str) -> list[str]:
+        """Return the test files the items of a model were submitted on."""
+        return [test_file for test_file, in self._execute(
+            "SELECT DISTINCT test_file FROM work_items WHERE ft_model_id = ?", (ft_model_id,)).fetchall()]
+
+    def is_merged(self, ft_model_id: str, stage: str) -> bool:
+        return self._execute("SELECT 1 FROM merges WHERE stage = ? AND ft_model_id = ?",
+                             (stage, ft_model_id)).fetchone() is not None
+
+    def mark_merged(self, ft_model_id: str, stage: str) -> None:
+        self._execute("INSERT OR REPLACE INTO merges (stage, ft_model_id, merged_at) VALUES (?, ?, ?)",
+                      (stage, ft_model_id, time.time()))
+
+    def log_status(self) -> None:
+        """Log the number of items per stage and status."""
+        counts = self.counts()
+        for stage in STAGES:
+            by_status = {status: counts.get((stage, status), 0)
+                         for status in (STATUS_PENDING, STATUS_LEASED, STATUS_DONE, STATUS_FAILED)}
+            if any(by_status.values()):
+                logger.info(f"Work queue {stage}: " + ", ".join(f"{count} {status}" for status, count in by_status.items()))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class _LeaseKeeper:
+    """Renew the lease of an item in the background while a worker processes it."""
+
+    def __init__(self, queue: WorkQueue, item: WorkItem, worker_id: str):
+        self.queue = queue
+        self.item = item
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.renew(self.item, self.worker_id):
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                logger.warning(f"Could not renew lease of work item {self.item.id}: {str(e)}")
+
+    def check(self) -> None:
+        """Raise LeaseLostError if another worker took over the item."""
+        if self.lost:
+            raise LeaseLostError(f"Lease of work item {self.item.id} was taken over by another worker")
+
+    def __enter__(self) -> "_LeaseKeeper":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_inference_item(item: WorkItem, lease: _LeaseKeeper) -> int:
+    """
+    Run the model of an inference item on its shard of the test split, appending the results to the
+    shard's JSONL file. Datapoints that already have a result (from an earlier attempt) are skipped.
+
+    Returns:
+        int: Number of datapoints queried.
+    """
+    from .eval_run_store import EvalRunWriter
+    from .finetuning import query_fted_model_chat_completion
+    from .jsonl_dataset import JsonlDataset
+
+    queried = 0
+    with EvalRunWriter(item.ft_model_id, runs_dir=item.shard_dir) as writer, JsonlDataset(item.test_file) as dataset:
+        for example in dataset.iter_shard(item.shard_index, item.num_shards, skip_datapoint_ids=writer.completed_ids):
+            lease.check()
+            response = query_fted_model_chat_completion(model_id=item.ft_model_id,
+                                                        user_query=example["user_prompt"])[0]
+            writer.write({**example, "generated_response": response})
+            queried += 1
+    return queried
+
+
+def run_scoring_item(item: WorkItem, lease: _LeaseKeeper, evaluator_registry) -> None:
+    """
+    Score the inference results of one shard and write its per-datapoint error counts.
+
+    Results come from the shard's own JSONL file, or, for a scoring-only run, from the model's
+    step 3 file in `_ft_models_eval_runs/`, restricted to the datapoints of the shard.
+    """
+    from .eval_run_store import eval_run_path, iter_eval_run_results
+    from .jsonl_dataset import JsonlDataset
+    from .step_4_run_evaluation import evaluate_ft_model
+
+    lease.check()
+    if eval_run_path(item.ft_model_id, item.shard_dir).exists():
+        model_results = iter_eval_run_results(item.ft_model_id, item.shard_dir)
+    else:
+        with JsonlDataset(item.test_file) as dataset:
+            start, stop = dataset.shard_bounds(item.shard_index, item.num_shards)
+        model_results = (result for result in iter_eval_run_results(item.ft_model_id)
+                         if start < result["datapoint_id"] <= stop)
+    evaluate_ft_model(model_results,
+                      evaluator_registry,
+                      details_path=shard_details_path(item.ft_model_id, item.shard_index, item.num_shards))
+
+
+def run_worker(queue: WorkQueue,
+               stages: tuple[str, ...] = STAGES,
+               num_threads: int = 1,
+               exit_when_empty: bool = False,
+               poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+    """
+    Claim and process work items until the queue is drained (with `exit_when_empty`) or forever.
+
+    Args:
+        queue: The work queue.
+        stages: Stages this worker processes, e.g. only scoring on a CPU-heavy machine.
+        num_threads: Items processed concurrently by this process. Inference is I/O bound,
+            so several threads share one process and its connection pool.
+        exit_when_empty: Return once no item can be claimed instead of waiting for new ones.
+        poll_interval: Seconds to wait before polling an empty queue again.
+    """
+    evaluator_registry = None
+    registry_lock = threading.Lock()
+
+    def get_registry():
+        nonlocal evaluator_registry
+        with registry_lock:
+            if evaluator_registry is None:
+                from .evaluation.registry import get_evaluator_registry
+                from .step_4_run_evaluation import SKIP_EVALUATORS
+
+                evaluator_registry = get_evaluator_registry(exclude=SKIP_EVALUATORS)
+            return evaluator_registry
+
+    def work(thread_index: int) -> None:
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{thread_index}"
+        while True:
+            item = queue.claim(worker_id, stages)
+            if item is None:
+                if exit_when_empty:
+                    return
+                # An idle worker flushes its provider metrics, so waiting coordinators see them
+                get_provider_metrics().write()
+                time.sleep(poll_interval)
+                continue
+            logger.info(f"Worker {worker_id} processing {item.stage} of {item.ft_model_id} "
+                        f"shard {item.shard_index + 1}/{item.num_shards} (attempt {item.attempts})")
+            try:
+                with _LeaseKeeper(queue, item, worker_id) as lease:
+                    if item.stage == STAGE_INFERENCE:
+                        run_inference_item(item, lease)
+                    else:
+                        run_scoring_item(item, lease, get_registry())
+                    lease.check()
+            except LeaseLostError as e:
+                logger.warning(str(e))
+                continue
+            except Exception as e:
+                logger.error(f"Work item {item.id} failed: {type(e).__name__}: {str(e)}")
+                queue.fail(item, worker_id, f"{type(e).__name__}: {str(e)}")
+                continue
+            if not queue.complete(item, worker_id):
+                logger.warning(f"Work item {item.id} was taken over by another worker before it was completed")
+
+    threads = [threading.Thread(target=work, args=(i,), name=f"work-queue-worker-{i}") for i in range(num_threads)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        get_provider_metrics().write()
+    logger.info("Work queue drained")
+
+
+def merge_inference_results(queue: WorkQueue, ft_model_id: str) -> int:
+    """
+    Append the shard results of a model to its step 3 file in `_ft_models_eval_runs/`, in datapoint order.
+    Datapoints that are already in the file are skipped.
+
+    Returns:
+        int: Number of datapoints appended.
+    """
+    from .eval_run_store import EvalRunWriter, load_eval_run_results
+
+    appended = 0
+    with EvalRunWriter(ft_model_id) as writer:
+        for shard_index, num_shards in queue.shards(ft_model_id, STAGE_INFERENCE):
+            for result in load_eval_run_results(ft_model_id, shard_dir(shard_index, num_shards)):
+                if result["datapoint_id"] not in writer.completed_ids:
+                    writer.write(result)
+                    appended += 1
+    logger.info(f"Merged {appended} inference results of model {ft_model_id} into {writer.path}")
+    return appended
+
+
+def merge_scoring_results(queue: WorkQueue, ft_model_id: str, wandb_project: Optional[str] = None) -> None:
+    """
+    Merge the per-datapoint error counts of all shards of a model into its step 4 details file
+    in `_ft_models_eval_details/`, and log the totals to W&B like step 4 does.
+    """
+    from .evaluation.aggregation import merge_datapoint_frames, read_datapoint_frame, write_datapoint_frame
+    from .step_4_run_evaluation import EVAL_DETAILS_DIR, log_ft_model_summary
+
+    frames = [read_datapoint_frame(shard_details_path(ft_model_id, shard_index, num_shards))
+              for shard_index, num_shards in queue.shards(ft_model_id, STAGE_SCORING)]
+    details, summary = merge_datapoint_frames(frames)
+    if details is not None:
+        path = write_datapoint_frame(details, EVAL_DETAILS_DIR / f"{quote(ft_model_id, safe='')}.parquet")
+        logger.info(f"Merged per-datapoint error counts of model {ft_model_id} into {path}")
+    if wandb_project:
+        found = get_experiment_store().find_by_ft_model_id(ft_model_id)
+        if found is None:
+            logger.warning(f"No experiment config found for model {ft_model_id}")
+        else:
+            log_ft_model_summary(ft_model_id, summary, found[1], wandb_project)
+
+
+def merge_results(queue: WorkQueue, wandb_project: Optional[str] = None) -> bool:
+    """
+    Merge the results of every model whose stage finished on all shards, once per model and stage.
+
+    Returns:
+        bool: True if no submitted item is left to process and every finished stage is merged.
+    """
+    finished = True
+    for ft_model_id, stages in queue.model_progress().items():
+        for stage in STAGES:
+            progress = stages.get(stage, {"items": 0, "done": 0, "failed": 0})
+            inference = stages.get(STAGE_INFERENCE)
+            if stage == STAGE_SCORING and inference and inference["then_score"]:
+                # One scoring item is added per successful inference item
+                expected = inference["done"] if inference["done"] + inference["failed"] == inference["items"] else None
+            else:
+                expected = progress["items"]
+            if not expected:
+                finished &= expected == 0
+                continue
+            if progress["done"] + progress["failed"] < expected:
+                finished = False
+                continue
+            if queue.is_merged(ft_model_id, stage):
+                continue
+            if progress["failed"]:
+                logger.warning(f"{progress['failed']} of {expected} {stage} shards of model "
+                               f"{ft_model_id} failed, merging the others")
+            if stage == STAGE_INFERENCE:
+                merge_inference_results(queue, ft_model_id)
+            else:
+                merge_scoring_results(queue, ft_model_id, wandb_project)
+            queue.mark_merged(ft_model_id, stage)
+    return finished
+
+
+def wait_and_merge(queue: WorkQueue,
+                   wandb_project: Optional[str] = None,
+                   poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+    """Merge the results of models as they finish until no submitted item is left to process."""
+    while not merge_results(queue, wandb_project):
+        time.sleep(poll_interval)
+    queue.log_status()
+
+
+def submit_evaluation(queue: WorkQueue,
+                      dataset_version: str,
+                      num_shards: int,
+                      stages: tuple[str, ...] = STAGES,
+                      ft_model_ids: list[str] = None) -> int:
+    """
+    Queue the evaluation of fine-tuned models on the test split of a dataset version.
+
+    If no inference item is pending or leased yet, this starts a new run and the provider
+    metrics file is started over (see `ProviderMetrics.start_run`).
+
+    Args:
+        queue: The work queue.
+        dataset_version: Version of the dataset whose test split is evaluated.
+        num_shards: Number of shards the test split is cut into.
+        stages: Stages to run, see `WorkQueue.submit`.
+        ft_model_ids: Models to evaluate. Defaults to the models of the experiment store selected by step 3.
+
+    Returns:
+        int: Number of items added.
+    """
+    from .dataset_config import get_dataset_files
+    from .step_3_eval_run_ft_models import select_ft_model_ids
+
+    _, test_file, _, _ = get_dataset_files(dataset_version)
+    if not test_file:
+        raise ValueError(f"No test file found for dataset version {dataset_version}")
+    if ft_model_ids is None:
+        ft_model_ids = select_ft_model_ids(get_experiment_store().all())
+    counts = queue.counts()
+    if STAGE_INFERENCE in stages and not any(counts.get((STAGE_INFERENCE, status))
+                                             for status in (STATUS_PENDING, STATUS_LEASED)):
+        get_provider_metrics().start_run()
+    return queue.submit(ft_model_ids, test_file, num_shards, stages)
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Sharded evaluation with a local work queue.")
+    parser.add_argument("--queue", type=Path, default=DEFAULT_QUEUE_PATH, help="Path of the queue database")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help="Seconds a claimed item stays with a worker without a renewal")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue the evaluation of fine-tuned models")
+    submit.add_argument("--dataset-version", default="2.0.0", help="Version of the dataset to use")
+    submit.add_argument("--num-shards", type=int, required=True, help="Number of shards of the test split")
+    submit.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to run")
+    submit.add_argument("--models", nargs="+", help="Fine-tuned model IDs (default: all experiments)")
+
+    worker = commands.add_parser("worker", help="Process work items")
+    worker.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to process")
+    worker.add_argument("--threads", type=int, default=1, help="Items processed concurrently")
+    worker.add_argument("--exit-when-empty", action="store_true", help="Exit once the queue is drained")
+    worker.add_argument("--api-key-env", help="Environment variable holding the API key of this worker")
+    worker.add_argument("--organization", help="Provider organization of this worker")
+    worker.add_argument("--shared-rate-limits", type=Path,
+                        help="SQLite file of rate limit buckets shared by all workers on the same API key")
+
+    merge = commands.add_parser("merge", help="Merge the results of finished models")
+    merge.add_argument("--wandb-project", help="Log the step 4 results of merged models to this W&B project")
+    merge.add_argument("--wait", action="store_true", help="Keep merging until all items are processed")
+
+    commands.add_parser("status", help="Show the number of items per stage and status")
+    commands.add_parser("retry-failed", help="Reset failed items to pending")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+    queue = WorkQueue(args.queue, lease_seconds=args.lease_seconds)
+    try:
+        if args.command == "submit":
+            submit_evaluation(queue, args.dataset_version, args.num_shards, tuple(args.stages), args.models)
+        elif args.command == "worker":
+            if args.api_key_env or args.organization:
+                from .clients import configure_clients
+
+                client_kwargs = {"organization": args.organization} if args.organization else {}
+                configure_clients(api_key=os.environ[args.api_key_env] if args.api_key_env else None, **client_kwargs)
+            if args.shared_rate_limits:
+                from .rate_limiter import configure_rate_limiter
+
+                configure_rate_limiter(shared_path=args.shared_rate_limits)
+            run_worker(queue, tuple(args.stages), num_threads=args.threads, exit_when_empty=args.exit_when_empty)
+        elif args.command == "merge":
+            if args.wait:
+                wait_and_merge(queue, args.wandb_project)
+            else:
+                merge_results(queue, args.wandb_project)
+        elif args.command == "retry-failed":
+            logger.info(f"Reset {queue.retry_failed()} failed items")
+        queue.log_status()
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from collections import Counter
+
+import pytest
+
+from calibrion_ft.evaluation.aggregation import ErrorAggregator, error_categories
+from calibrion_ft.evaluation.evaluators.base import BaseEvaluator
+
+
+class FlagEvaluator(BaseEvaluator):
+    error_keys = ("errors", "warnings", "passed")
+
+    def name(self) -> str:
+        return "flags"
+
+    def run(self, html_code) -> dict:
+        return {}
+
+
+SAMPLE_RESPONSES = [
+    "```html\n<s-chart type=\"bar\"></s-chart>\n```\n```javascript\nconst chart = document.querySelector(\"s-chart\");\n```",
+    "```html\n<div><s-table></div>\n```",
+    "```javascript\nfunction render() { return null }\n```",
+    "No code in this response.",
+]
+
+
+def test_error_keys_count_integers_and_list_items_only():
+    result = {"errors": 2, "warnings": ["a", "b", "c"], "passed": True, "details": 7}
+
+    assert FlagEvaluator.error_categories(result, "flags") == {"flags errors": 2, "flags warnings": 3, "flags passed": 0}
+
+
+def test_evaluators_without_error_keys_count_every_integer_and_list_field():
+    class Plain(FlagEvaluator):
+        error_keys = None
+
+    result = {"errors": 1, "warnings": ["a", "b"], "passed": True, "score": 0.5, "message": "ok"}
+
+    assert Plain.error_categories(result, "flags") == {"flags errors": 1, "flags warnings": 2}
+
+
+def test_streaming_aggregation_agrees_with_per_datapoint_frames(monkeypatch):
+    """The totals equal the per-datapoint DataFrame sum of step 4 before streaming, and no DataFrame is built per datapoint."""
+    pd = pytest.importorskip("pandas")
+
+    class Plain(FlagEvaluator):
+        error_keys = None
+
+        def name(self) -> str:
+            return "plain"
+
+    registry = {"flags": FlagEvaluator(), "plain": Plain()}
+    results = [{"flags": {"errors": datapoint % 3, "warnings": ["w"] * datapoint, "passed": datapoint % 2 == 0},
+                "plain": {"syntax_errors": [1] * (datapoint % 2), "missing_tags": datapoint, "valid": True}}
+               for datapoint in range(20)]
+
+    expected = None
+    for result in results:
+        categories = {}
+        for name, evaluator_result in result.items():
+            categories.update(registry[name].error_categories(evaluator_result, name))
+        details_df = pd.DataFrame({"Category": list(categories), "Count": list(categories.values())})
+        if expected is None:
+            expected = details_df.copy()
+        else:
+            expected["Count"] += details_df["Count"]
+
+    def no_frames(*args, **kwargs):
+        raise AssertionError("DataFrame built while folding a datapoint")
+
+    aggregator = ErrorAggregator(registry)
+    with monkeypatch.context() as patch:
+        patch.setattr(pd, "DataFrame", no_frames)
+        for datapoint_id, result in enumerate(results):
+            aggregator.add(datapoint_id, result)
+
+    summary = aggregator.summary()
+    assert list(summary["Category"]) == list(expected["Category"])
+    assert list(summary["Count"]) == list(expected["Count"])
+
+
+def test_aggregator_backfills_late_categories_in_first_seen_order():
+    class Late(FlagEvaluator):
+        error_keys = ("late",)
+
+        def name(self) -> str:
+            return "late"
+
+    registry = {"flags": FlagEvaluator(), "late": Late()}
+    aggregator = ErrorAggregator(registry)
+    aggregator.add(1, {"flags": {"errors": 1}})
+    aggregator.add(2, {"flags": {"errors": 2}, "late": {"late": [1]}})
+
+    assert list(aggregator.summary()["Category"]) == ["flags errors", "flags warnings", "flags passed", "late late"]
+    assert aggregator.totals == Counter({"flags errors": 3, "late late": 1, "flags warnings": 0, "flags passed": 0})
+    assert list(aggregator.datapoint_columns()["late late"]) == [0, 1]
+
+
+def test_streaming_aggregation_agrees_with_format_eval_results():
+    """The per-datapoint sum of format_eval_results (step 4 before streaming) equals the aggregator totals."""
+    utilities = pytest.importorskip("calibrion_ft.evaluation.evaluation_utilities")
+    from calibrion_ft.evaluation.core import run_evaluators
+    from calibrion_ft.evaluation.registry import get_evaluator_registry
+    from calibrion_ft.step_4_run_evaluation import SKIP_EVALUATORS, _eval_input
+
+    registry = get_evaluator_registry(exclude=SKIP_EVALUATORS)
+    if not registry:
+        pytest.skip("No evaluators installed")
+
+    aggregator = ErrorAggregator(registry)
+    expected = Counter()
+    for datapoint_id, response in enumerate(SAMPLE_RESPONSES, start=1):
+        eval_input = _eval_input({"expected_response": response, "generated_response": response})
+        result = run_evaluators(registry, eval_input)
+        details_df, _ = utilities.format_eval_results(result, method='pandas')
+        expected.update(dict(zip(details_df['Category'], details_df['Count'].astype(int))))
+        aggregator.add(datapoint_id, result)
+        assert error_categories(result, registry) == Counter(dict(zip(details_df['Category'],
+                                                                       details_df['Count'].astype(int))))
+
+    assert aggregator.totals == expected
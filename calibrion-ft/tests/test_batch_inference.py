@@ -0,0 +1,101 @@
+import json
+import sys
+from functools import partial
+from pathlib import Path
+
+import openai
+import pytest
+
+from calibrion_ft import batch_inference, response_cache
+from calibrion_ft.eval_run_store import EvalRunWriter, load_eval_run_results
+from calibrion_ft.step_3_eval_run_ft_models import iter_test_examples
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "benchmarks"))
+from mock_provider import MockProvider, MockProviderConfig  # noqa: E402
+
+MODEL = "ft:gpt-4o-mini:org::abc"
+PROMPTS = {f"question {i}": f"answer {i}" for i in range(1, 6)}
+
+
+@pytest.fixture
+def test_file(tmp_path) -> Path:
+    path = tmp_path / "test.jsonl"
+    with open(path, "w") as f:
+        for prompt, response in PROMPTS.items():
+            f.write(json.dumps({"messages": [{"role": "user", "content": prompt},
+                                             {"role": "assistant", "content": response}]}) + "\n")
+    return path
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "_response_cache", None)
+    yield response_cache.configure_response_cache(tmp_path / "cache.sqlite")
+    response_cache.get_response_cache().close()
+
+
+@pytest.fixture
+def provider():
+    with MockProvider(MockProviderConfig(responses=PROMPTS)) as provider:
+        yield provider
+
+
+def run(provider, test_file, tmp_path):
+    client = openai.OpenAI(api_key="test", base_url=provider.base_url, max_retries=0)
+    with EvalRunWriter(MODEL, runs_dir=tmp_path / "runs") as writer:
+        batch_inference.eval_run_models_batch({MODEL: writer}, list(iter_test_examples(test_file)), test_file,
+                                              client=client, batch_dir=tmp_path / "batches", poll_interval=0.01)
+    return load_eval_run_results(MODEL, tmp_path / "runs")
+
+
+def test_batch_responses_are_mapped_back_to_their_datapoints(provider, test_file, tmp_path):
+    results = run(provider, test_file, tmp_path)
+
+    assert [r["datapoint_id"] for r in results] == [1, 2, 3, 4, 5]
+    assert all(r["generated_response"] == PROMPTS[r["user_prompt"]] for r in results)
+    assert not list((tmp_path / "batches").glob("*.batches.json"))
+
+
+def test_resumed_run_only_submits_the_shards_without_a_batch(provider, test_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_inference, "write_batch_shards",
+                        partial(batch_inference.write_batch_shards, max_requests=2))
+    submit_batch = batch_inference.submit_batch
+    submitted = []
+
+    def fail_after_two(client, shard_path, ft_model_id):
+        if len(submitted) == 2:
+            raise RuntimeError("interrupted")
+        submitted.append(submit_batch(client, shard_path, ft_model_id))
+        return submitted[-1]
+
+    monkeypatch.setattr(batch_inference, "submit_batch", fail_after_two)
+    with pytest.raises(RuntimeError):
+        run(provider, test_file, tmp_path)
+    state_path, = (tmp_path / "batches").glob("*.batches.json")
+    with open(state_path) as f:
+        assert list(json.load(f)["shards"].values()) == [*submitted, None]
+
+    resubmitted = []
+    monkeypatch.setattr(batch_inference, "submit_batch",
+                        lambda *args: resubmitted.append(args[1].name) or submit_batch(*args))
+    results = run(provider, test_file, tmp_path)
+
+    assert [r["datapoint_id"] for r in results] == [1, 2, 3, 4, 5]
+    assert resubmitted == [state_path.name.replace(".batches.json", ".shard-0002.jsonl")]
+
+
+def test_batches_are_not_reused_for_another_test_file(provider, test_file, tmp_path):
+    other = tmp_path / "other.jsonl"
+    other.write_bytes(test_file.read_bytes())
+    state = batch_inference._test_file_state(test_file)
+    state_path = tmp_path / "batches" / f"{batch_inference._state_prefix(MODEL, state)}.batches.json"
+    state_path.parent.mkdir()
+    state_path.write_text(json.dumps({**state, "shards": {"x.jsonl": "batch_gone"}}))
+
+    results = run(provider, other, tmp_path)
+
+    assert [r["datapoint_id"] for r in results] == [1, 2, 3, 4, 5]
+    assert state_path.exists()
+    test_file.write_text("")
+    with pytest.raises(ValueError, match="belongs to test file"):
+        batch_inference._load_state(state_path, batch_inference._test_file_state(test_file))
@@ -0,0 +1,70 @@
+import math
+
+import pytest
+
+from calibrion_ft.early_stopping import EarlyStopping, EarlyStoppingMonitor, load_early_stopping_status
+
+
+def add_results(monitor: EarlyStoppingMonitor, ft_model_id: str, n: int, errors: int) -> None:
+    monitor.add_seen(ft_model_id, n)
+    for i in range(n):
+        monitor.add(ft_model_id, i < errors)
+
+
+def test_dominated_model_is_stopped():
+    monitor = EarlyStoppingMonitor(["good", "bad"], EarlyStopping(min_samples=100))
+    add_results(monitor, "good", 200, errors=20)
+    add_results(monitor, "bad", 200, errors=100)
+
+    assert monitor.update() == ["bad"]
+    assert monitor.active() == ["good"]
+    assert monitor.status("bad")["dominated_by"] == "good"
+    assert monitor.status("bad")["error_rate_lower"] > monitor.status("good")["error_rate_upper"]
+
+
+def test_close_models_are_not_stopped():
+    monitor = EarlyStoppingMonitor(["a", "b"], EarlyStopping(min_samples=100))
+    add_results(monitor, "a", 200, errors=20)
+    add_results(monitor, "b", 200, errors=30)
+
+    assert monitor.update() == []
+    assert monitor.active() == ["a", "b"]
+
+
+def test_no_decision_before_min_samples():
+    monitor = EarlyStoppingMonitor(["good", "bad"], EarlyStopping(min_samples=300))
+    add_results(monitor, "good", 200, errors=0)
+    add_results(monitor, "bad", 200, errors=200)
+
+    assert monitor.update() == []
+    assert monitor.looks == 0
+
+
+@pytest.mark.parametrize("bound", ["wilson", "hoeffding"])
+def test_looks_and_models_narrow_the_confidence_budget(bound):
+    settings = EarlyStopping(confidence=0.95, bound=bound)
+
+    assert settings.look_confidence(1, 1) == pytest.approx(1 - 0.05 * 6 / math.pi ** 2)
+    assert settings.look_confidence(2, 1) > settings.look_confidence(1, 1)
+    assert settings.look_confidence(1, 4) > settings.look_confidence(1, 2)
+    # The error budgets of all looks add up to less than 1 - confidence
+    assert sum(1 - settings.look_confidence(look, 3) for look in range(1, 10000)) * 3 < 0.05
+
+    wide = settings.interval(30, 100, settings.look_confidence(3, 2))
+    narrow = settings.interval(30, 100)
+    assert wide[0] < narrow[0] and wide[1] > narrow[1]
+
+
+def test_status_is_written_and_loaded(tmp_path):
+    path = tmp_path / "_early_stopping.json"
+    monitor = EarlyStoppingMonitor(["good", "bad"], EarlyStopping(min_samples=100))
+    add_results(monitor, "good", 200, errors=20)
+    add_results(monitor, "bad", 200, errors=100)
+    monitor.update()
+    monitor.write(path)
+
+    statuses = load_early_stopping_status(path)
+    assert statuses["bad"]["stopped_early"]
+    assert not statuses["good"]["stopped_early"]
+    assert statuses["good"]["examples_seen"] == 200
+    assert statuses["good"]["interval_confidence"] == pytest.approx(monitor.confidence())
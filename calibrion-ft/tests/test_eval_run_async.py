@@ -0,0 +1,85 @@
+import asyncio
+import json
+from contextlib import ExitStack
+
+import pytest
+
+from calibrion_ft import step_3_eval_run_ft_models
+from calibrion_ft.eval_run_store import EvalRunWriter, eval_run_path, load_eval_run_results
+
+MODELS = ["ft:model-a", "ft:model-b"]
+NUM_EXAMPLES = 12
+
+
+@pytest.fixture
+def test_file(tmp_path):
+    path = tmp_path / "test.jsonl"
+    path.write_text("".join(json.dumps({"messages": [{"role": "user", "content": f"question {i}"},
+                                                     {"role": "assistant", "content": f"answer {i}"}]}) + "\n"
+                            for i in range(NUM_EXAMPLES)))
+    return str(path)
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """Replace the model query by one that answers later datapoints first, and record every query."""
+    queried = []
+    in_flight = {"now": 0, "max": 0}
+
+    async def query(model_id: str, user_query: str):
+        queried.append((model_id, user_query))
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.001 * (NUM_EXAMPLES - int(user_query.split()[-1])))
+        in_flight["now"] -= 1
+        return [f"{model_id} on {user_query}"]
+
+    monkeypatch.setattr(step_3_eval_run_ft_models, "query_fted_model_chat_completion_async", query)
+    return queried, in_flight
+
+
+def run(test_file: str, runs_dir, max_concurrency: int = 32, max_concurrency_per_model: int = 8) -> None:
+    with ExitStack() as stack:
+        writers = {ft_model_id: stack.enter_context(EvalRunWriter(ft_model_id, runs_dir=runs_dir))
+                   for ft_model_id in MODELS}
+        asyncio.run(step_3_eval_run_ft_models._eval_run_models_async(writers, test_file, max_concurrency,
+                                                                     max_concurrency_per_model))
+
+
+def test_results_are_written_in_completion_order_and_read_in_datapoint_order(tmp_path, test_file, queries):
+    queried, in_flight = queries
+    runs_dir = tmp_path / "runs"
+
+    run(test_file, runs_dir, max_concurrency=6, max_concurrency_per_model=4)
+
+    assert len(queried) == len(MODELS) * NUM_EXAMPLES
+    assert in_flight["max"] <= 6
+    for ft_model_id in MODELS:
+        with open(eval_run_path(ft_model_id, runs_dir)) as f:
+            written = [json.loads(line)["datapoint_id"] for line in f]
+        assert written != sorted(written)
+        results = load_eval_run_results(ft_model_id, runs_dir)
+        assert [result["datapoint_id"] for result in results] == list(range(1, NUM_EXAMPLES + 1))
+        assert all(result["generated_response"] == f"{ft_model_id} on {result['user_prompt']}" for result in results)
+
+
+def test_resume_queries_only_the_missing_datapoints(tmp_path, test_file, queries):
+    queried, _ = queries
+    runs_dir = tmp_path / "runs"
+    run(test_file, runs_dir)
+    # Model a was interrupted after 5 results, in the middle of writing the 6th
+    path = eval_run_path(MODELS[0], runs_dir)
+    lines = path.read_text().splitlines(keepends=True)
+    path.write_text("".join(lines[:5]) + lines[5][:10])
+    done = {json.loads(line)["datapoint_id"] for line in lines[:5]}
+    queried.clear()
+
+    run(test_file, runs_dir)
+
+    assert len(queried) == len(set(queried))
+    assert set(queried) == {(MODELS[0], f"question {datapoint_id - 1}")
+                            for datapoint_id in range(1, NUM_EXAMPLES + 1)
+                            if datapoint_id not in done}
+    for ft_model_id in MODELS:
+        results = load_eval_run_results(ft_model_id, runs_dir)
+        assert [result["datapoint_id"] for result in results] == list(range(1, NUM_EXAMPLES + 1))
@@ -0,0 +1,78 @@
+import pytest
+
+from calibrion_ft.evaluation.aggregation import error_categories
+from calibrion_ft.evaluation.core import EvaluatorError, run_evaluators_on_batch
+from calibrion_ft.evaluation.evaluators.base import BaseEvaluator
+from calibrion_ft.evaluation.memo import EvaluatorResultCache
+from calibrion_ft.evaluation.registry import EvaluatorMetadata, EvaluatorRegistry, EvaluatorSpec
+
+INSTANCES = []
+
+
+class CountingEvaluator(BaseEvaluator):
+    error_keys = ("errors",)
+
+    def __init__(self):
+        INSTANCES.append(self)
+
+    def name(self) -> str:
+        return "counting"
+
+    def required_inputs(self) -> list:
+        return ["text"]
+
+    def run(self, text) -> dict:
+        return {"errors": len(text) % 3, "lengths": (len(text), len(text.split()))}
+
+
+def test_selected_registries_share_instances_and_metadata(tmp_path):
+    INSTANCES.clear()
+    registry = EvaluatorRegistry([EvaluatorSpec("counting", __name__, "CountingEvaluator")])
+    cache = EvaluatorResultCache(path=tmp_path / "results.sqlite")
+    inputs = [{"text": "x" * length} for length in range(10)]
+
+    for _ in range(3):
+        results = run_evaluators_on_batch(registry.select(), inputs, executor="serial", result_cache=cache)
+
+    assert len(INSTANCES) == 1
+    assert results[4] == {"counting": {"errors": 1, "lengths": (4, 1)}}
+    assert cache.stats()["hits"] == 20
+
+
+def test_parent_reads_metadata_and_error_categories_without_instantiating():
+    INSTANCES.clear()
+    registry = EvaluatorRegistry([EvaluatorSpec("counting", __name__, "CountingEvaluator")])
+
+    assert registry.metadata("counting") == EvaluatorMetadata("1", ("text",))
+    assert error_categories({"counting": {"errors": 2, "lengths": (3, 1)}}, registry) == {"counting errors": 2}
+    assert INSTANCES == []
+
+
+class FlakyBatchEvaluator(BaseEvaluator):
+    runs = []
+
+    def name(self) -> str:
+        return "flaky"
+
+    def required_inputs(self) -> list:
+        return ["text"]
+
+    def run(self, text) -> dict:
+        self.runs.append(text)
+        if text == "bad":
+            raise ValueError("bad input")
+        return {"errors": 0}
+
+    def run_batch(self, inputs: list[dict]) -> list[dict]:
+        raise RuntimeError("batch failed")
+
+
+@pytest.mark.parametrize("texts, reruns", [(["bad"], []), (["ok", "bad"], ["ok", "bad"])])
+def test_failed_run_batch_is_only_rerun_per_input_for_several_inputs(texts, reruns):
+    FlakyBatchEvaluator.runs = []
+    results = run_evaluators_on_batch({"flaky": FlakyBatchEvaluator()}, [{"text": text} for text in texts],
+                                      executor="serial", return_exceptions=True)
+
+    assert FlakyBatchEvaluator.runs == reruns
+    assert isinstance(results[-1]["flaky"], EvaluatorError)
+    assert ("batch failed" if len(texts) == 1 else "bad input") in str(results[-1]["flaky"])
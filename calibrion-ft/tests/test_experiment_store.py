@@ -0,0 +1,64 @@
+import json
+import threading
+
+import pytest
+
+from calibrion_ft.experiment_store import ExperimentStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ExperimentStore(tmp_path / "experiments.sqlite", json_path=None)
+    yield store
+    store.close()
+
+
+def test_updates_are_kept_per_row_and_found_by_job_and_model(store):
+    store.add("exp-1", {"ft_job_id": "job-1", "model": "a"})
+    store.add("exp-2", {"ft_job_id": "job-2", "model": "b"})
+
+    assert store.update("exp-1", ft_model_id="ft:a") == {"ft_job_id": "job-1", "model": "a", "ft_model_id": "ft:a"}
+    assert list(store.all()) == ["exp-1", "exp-2"]
+    assert store.find_by_ft_job_id("job-2") == ("exp-2", {"ft_job_id": "job-2", "model": "b"})
+    assert store.find_by_ft_model_id("ft:a")[0] == "exp-1"
+    assert store.find_by_ft_model_id("ft:missing") is None
+    with pytest.raises(KeyError):
+        store.update("exp-3", ft_model_id="ft:c")
+
+
+def test_concurrent_updates_of_different_fields_are_not_lost(store):
+    store.add("exp-1", {"ft_job_id": "job-1"})
+    # Every thread writes through a store (and a connection) of its own, like separate processes
+    stores = [ExperimentStore(store.path, json_path=None) for _ in range(8)]
+
+    def update(i):
+        for j in range(10):
+            stores[i].update("exp-1", **{f"field_{i}": j})
+
+    threads = [threading.Thread(target=update, args=(i,)) for i in range(len(stores))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for other in stores:
+        other.close()
+
+    assert store.get("exp-1") == {"ft_job_id": "job-1", **{f"field_{i}": 9 for i in range(len(stores))}}
+
+
+def test_new_database_imports_the_legacy_json_once(tmp_path):
+    json_path = tmp_path / "experiments.json"
+    json_path.write_text(json.dumps({"exp-1": {"ft_job_id": "job-1"}}))
+    store = ExperimentStore(tmp_path / "experiments.sqlite", json_path=json_path)
+    assert store.all() == {"exp-1": {"ft_job_id": "job-1"}}
+    store.replace_all({})
+    store.close()
+
+    reopened = ExperimentStore(tmp_path / "experiments.sqlite", json_path=json_path)
+    assert len(reopened) == 0
+    reopened.close()
+
+    store.add("exp-2", {"ft_job_id": "job-2"})
+    store.export_json(tmp_path / "exported.json")
+    assert json.loads((tmp_path / "exported.json").read_text()) == {"exp-2": {"ft_job_id": "job-2"}}
+    store.close()
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from calibrion_ft import rate_limiter
+from calibrion_ft.hedging import Hedger
+
+MODEL = "ft:test"
+HEDGE_DELAY = 0.02
+SLOW = 0.3
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiter(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_rate_limiter", None)
+
+
+def raw_response(answer: str) -> SimpleNamespace:
+    return SimpleNamespace(parse=lambda: SimpleNamespace(answer=answer, usage=None), headers={}, retries_taken=0)
+
+
+class SlowFirstCall:
+    """Raw-response call whose first request of a query (the primary) is slow and the next one (the hedge) fast."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def new_query(self) -> None:
+        self.calls = 0
+
+    def _is_primary(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            return self.calls == 1
+
+    def __call__(self, **kwargs):
+        if self._is_primary():
+            time.sleep(SLOW)
+            return raw_response("primary")
+        return raw_response("hedge")
+
+    async def call_async(self, **kwargs):
+        if self._is_primary():
+            await asyncio.sleep(SLOW)
+            return raw_response("primary")
+        return raw_response("hedge")
+
+
+def make_hedger(**kwargs) -> Hedger:
+    hedger = Hedger(enabled=True, **kwargs)
+    hedger.hedge_delay = lambda model: HEDGE_DELAY
+    return hedger
+
+
+def test_hedge_that_answers_first_wins_and_records_the_latency_saved():
+    hedger = make_hedger(max_hedge_ratio=1.0)
+
+    result = hedger.call("chat.completions", MODEL, SlowFirstCall(), 0, messages=[])
+
+    assert result.answer == "hedge"
+    time.sleep(SLOW)
+    stats = hedger.stats()
+    assert (stats["eligible"], stats["hedged"], stats["hedge_wins"]) == (1, 1, 1)
+    assert stats["hedge_rate"] == 1.0
+    assert stats["mean_latency_saved_s"] == stats["latency_saved_s"]
+    assert 0 < stats["latency_saved_s"] <= SLOW
+
+
+def test_hedges_are_capped_at_the_ratio_of_eligible_requests():
+    hedger = make_hedger(max_hedge_ratio=0.5)
+    call = SlowFirstCall()
+
+    answers = []
+    for _ in range(4):
+        call.new_query()
+        answers.append(hedger.call("chat.completions", MODEL, call, 0, messages=[]).answer)
+
+    stats = hedger.stats()
+    assert answers == ["primary", "hedge", "primary", "hedge"]
+    assert (stats["eligible"], stats["hedged"], stats["hedge_wins"], stats["skipped_ratio"]) == (4, 2, 2, 2)
+    assert stats["hedge_rate"] == 0.5
+
+
+def test_no_hedge_without_quota_or_for_sampled_queries():
+    hedger = make_hedger(max_hedge_ratio=1.0)
+    limiter = rate_limiter.configure_rate_limiter(safety_margin=0.0)
+    # Quota for the sampled query and the primary request of the next one, but not for a hedge
+    limiter.observe(MODEL, {"x-ratelimit-limit-requests": "2", "x-ratelimit-limit-tokens": "100000"})
+
+    assert hedger.call("chat.completions", MODEL, SlowFirstCall(), 0.7, messages=[]).answer == "primary"
+    assert hedger.call("chat.completions", MODEL, SlowFirstCall(), 0, messages=[]).answer == "primary"
+
+    stats = hedger.stats()
+    assert (stats["eligible"], stats["hedged"], stats["skipped_rate_limit"]) == (1, 0, 1)
+
+
+def test_async_hedge_wins_and_is_counted():
+    hedger = make_hedger(max_hedge_ratio=1.0)
+    call = SlowFirstCall()
+
+    async def query():
+        result = await hedger.call_async("chat.completions", MODEL, call.call_async, 0, messages=[])
+        # Let the losing primary finish in the background
+        await asyncio.sleep(SLOW)
+        return result
+
+    assert asyncio.run(query()).answer == "hedge"
+    stats = hedger.stats()
+    assert (stats["eligible"], stats["hedged"], stats["hedge_wins"]) == (1, 1, 1)
+    assert stats["mean_latency_saved_s"] is not None
@@ -0,0 +1,26 @@
+from calibrion_ft.hyperparameter_search import GridSearch, SuccessiveHalving
+
+
+def test_grid_search_keeps_the_default_configuration_of_every_model():
+    search = GridSearch(["a", "b"], [1, 2], [])
+
+    configs = search.propose()
+
+    assert configs[:2] == [{"model": "a", "hyperparameters": None}, {"model": "b", "hyperparameters": None}]
+    assert configs[2] == {"model": "a", "hyperparameters": {"batch_size": 1, "n_epochs": 4}}
+    assert len(configs) == 2 + 4
+    search.report([(config, float(i)) for i, config in enumerate(configs)])
+    assert search.propose() == []
+
+
+def test_successive_halving_submits_more_jobs_but_fewer_epochs_than_the_grid():
+    search = SuccessiveHalving(["a"], [1, 2, 4, 8], [])
+    jobs = epochs = 0
+    while configs := search.propose():
+        jobs += len(configs)
+        epochs += sum(config["hyperparameters"]["n_epochs"] for config in configs)
+        search.report([({**config, "ft_model_id": f"ft:{i}"}, float(i)) for i, config in enumerate(configs)])
+
+    assert jobs == SuccessiveHalving(["a"], [1, 2, 4, 8], []).max_jobs() == 7
+    assert epochs == 8
+    assert search.best()[0]["hyperparameters"]["batch_size"] == 1
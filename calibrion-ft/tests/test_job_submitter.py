@@ -0,0 +1,114 @@
+import json
+import sys
+from pathlib import Path
+
+import openai
+import pytest
+
+from calibrion_ft import clients, experiment_store, finetuning
+from calibrion_ft.job_submitter import JobSubmitter, has_pending_submissions
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "benchmarks"))
+from mock_provider import MockProvider, MockProviderConfig  # noqa: E402
+
+
+def make_configs(n: int) -> list[dict]:
+    return [{"model": "gpt-4o-mini", "training_file": "train.jsonl", "training_file_oai_id": "file-train",
+             "hyperparameters": {"batch_size": 2 ** i}} for i in range(n)]
+
+
+@pytest.fixture
+def provider():
+    with MockProvider(MockProviderConfig(training_seconds=0.2)) as provider:
+        clients.configure_clients(api_key="test", base_url=provider.base_url)
+        yield provider
+    clients.configure_clients()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(experiment_store, "_store", None)
+    yield experiment_store.configure_experiment_store(tmp_path / "experiments.sqlite", json_path=None)
+    experiment_store.get_experiment_store().close()
+
+
+def make_submitter(tmp_path, **kwargs) -> JobSubmitter:
+    return JobSubmitter(**{"max_concurrent_jobs": 10,
+                           "max_estimated_spend": None,
+                           "hourly_prices": {"gpt-4o-mini": 10.0},
+                           "estimated_training_hours": 1.0,
+                           "poll_interval": 0.05,
+                           "queue_path": tmp_path / "queue.json",
+                           **kwargs})
+
+
+def test_configurations_over_the_budget_are_skipped(provider, store, tmp_path):
+    submitter = make_submitter(tmp_path, max_estimated_spend=25.0)
+    submitter.enqueue(make_configs(3))
+
+    experiments = submitter.run()
+
+    assert len(experiments) == 2
+    assert submitter.queue["estimated_spend"] == pytest.approx(20.0)
+    assert submitter.queue["skipped"] == make_configs(3)[2:]
+
+
+def test_jobs_wait_for_a_free_slot(provider, store, tmp_path, monkeypatch):
+    submitter = make_submitter(tmp_path, max_concurrent_jobs=1)
+    submitter.enqueue(make_configs(3))
+    run_finetuning = finetuning.run_finetuning
+    active_at_submission = []
+
+    def record_active(**kwargs):
+        active_at_submission.append(len(submitter.queue["active"]))
+        return run_finetuning(**kwargs)
+
+    monkeypatch.setattr(finetuning, "run_finetuning", record_active)
+
+    assert len(submitter.run()) == 3
+    assert active_at_submission == [0, 0, 0]
+
+
+def test_interrupted_submission_is_reconciled_instead_of_resubmitted(provider, store, tmp_path, monkeypatch):
+    submitter = make_submitter(tmp_path)
+    submitter.enqueue(make_configs(2))
+    run_finetuning = finetuning.run_finetuning
+
+    def crash_after_creation(**kwargs):
+        run_finetuning(**kwargs)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(finetuning, "run_finetuning", crash_after_creation)
+    with pytest.raises(KeyboardInterrupt):
+        submitter.run()
+    assert has_pending_submissions(tmp_path / "queue.json")
+    with open(tmp_path / "queue.json") as f:
+        assert len(json.load(f)["submitting"]) == 1
+
+    monkeypatch.setattr(finetuning, "run_finetuning", run_finetuning)
+    resumed = make_submitter(tmp_path)
+    resumed.load()
+    experiments = resumed.run()
+
+    assert len(experiments) == 2
+    assert len(provider._jobs) == 2
+    assert {experiment["ft_job_id"] for experiment in experiments.values()} == set(provider._jobs)
+    assert not has_pending_submissions(tmp_path / "queue.json")
+
+
+def test_job_created_despite_a_timeout_is_recorded(provider, store, tmp_path, monkeypatch):
+    submitter = make_submitter(tmp_path)
+    submitter.enqueue(make_configs(2))
+    run_finetuning = finetuning.run_finetuning
+
+    def time_out(**kwargs):
+        if kwargs["ft_method_config"]["supervised"]["hyperparameters"]["batch_size"] == 1:
+            run_finetuning(**kwargs)
+        raise openai.APITimeoutError(request=None)
+
+    monkeypatch.setattr(finetuning, "run_finetuning", time_out)
+    experiments = submitter.run()
+
+    assert len(experiments) == 1
+    assert submitter.queue["skipped"] == make_configs(2)[1:]
+    assert submitter.queue["estimated_spend"] == pytest.approx(10.0)
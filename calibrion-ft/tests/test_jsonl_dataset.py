@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from calibrion_ft.dataset_config import DatasetRegistry
+from calibrion_ft.jsonl_dataset import JsonlDataset
+
+
+def write_examples(path, n: int, trailing_newline: bool = True) -> list[dict]:
+    examples = [{"messages": [{"role": "user", "content": f"question {i}"},
+                              {"role": "assistant", "content": f"answer {i}"}]} for i in range(n)]
+    text = "\n".join(json.dumps(example) for example in examples)
+    path.write_text(text + ("\n" if trailing_newline and examples else ""))
+    return examples
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_index_gives_random_access_to_every_line(tmp_path, trailing_newline):
+    path = tmp_path / "split.jsonl"
+    examples = write_examples(path, 7, trailing_newline)
+
+    with JsonlDataset(path) as dataset:
+        assert len(dataset) == 7
+        assert dataset[3] == examples[3]
+        assert dataset[-1] == examples[-1]
+        assert dataset[5:] == examples[5:]
+        assert dataset.get_example(0) == {"datapoint_id": 1, "user_prompt": "question 0",
+                                          "expected_response": "answer 0"}
+        assert dataset.sha256 == hashlib.sha256(path.read_bytes()).hexdigest()
+        with pytest.raises(IndexError):
+            dataset.get(7)
+
+
+def test_index_is_reused_until_the_file_changes(tmp_path):
+    path = tmp_path / "split.jsonl"
+    write_examples(path, 3)
+    with JsonlDataset(path) as dataset:
+        sha256 = dataset.sha256
+    index_mtime = os.stat(dataset.index_path).st_mtime_ns
+
+    with JsonlDataset(path) as dataset:
+        assert dataset.sha256 == sha256
+    assert os.stat(dataset.index_path).st_mtime_ns == index_mtime
+
+    write_examples(path, 5)
+    with JsonlDataset(path) as dataset:
+        assert len(dataset) == 5
+        assert dataset.sha256 == hashlib.sha256(path.read_bytes()).hexdigest() != sha256
+
+
+@pytest.mark.parametrize("lines, num_shards", [(10, 3), (2, 4), (0, 2), (7, 1)])
+def test_shards_cover_every_line_once(tmp_path, lines, num_shards):
+    path = tmp_path / "split.jsonl"
+    write_examples(path, lines)
+
+    with JsonlDataset(path) as dataset:
+        bounds = [dataset.shard_bounds(i, num_shards) for i in range(num_shards)]
+        ids = [example["datapoint_id"] for i in range(num_shards) for example in dataset.iter_shard(i, num_shards)]
+        with pytest.raises(ValueError):
+            dataset.shard_bounds(num_shards, num_shards)
+
+    assert bounds[0][0] == 0 and bounds[-1][1] == lines
+    assert all(stop == start for (_, stop), (start, _) in zip(bounds, bounds[1:]))
+    assert max(stop - start for start, stop in bounds) - min(stop - start for start, stop in bounds) <= 1
+    assert ids == list(range(1, lines + 1))
+
+
+def test_file_metadata_includes_chat_stats_and_is_cached_next_to_the_file(tmp_path):
+    path = tmp_path / "split.jsonl"
+    write_examples(path, 4)
+    with open(path, "a") as f:
+        f.write("not json\n")
+    registry = DatasetRegistry(tmp_path / "versions.yaml", tmp_path)
+
+    metadata = registry.file_metadata(path)
+
+    assert metadata["line_count"] == 5
+    assert metadata["sha256"] == hashlib.sha256(path.read_bytes()).hexdigest()
+    assert metadata["chat_stats"]["examples"] == 4
+    assert metadata["chat_stats"]["invalid_json"] == 1
+    with open(tmp_path / "split.jsonl.meta.json") as f:
+        assert json.load(f) == metadata
+    assert DatasetRegistry(tmp_path / "versions.yaml", tmp_path).file_metadata(path) == metadata
@@ -0,0 +1,62 @@
+import threading
+
+from calibrion_ft.evaluation.memo import EvaluatorResultCache
+
+
+def test_evaluator_results_round_trip(tmp_path):
+    cache = EvaluatorResultCache(path=tmp_path / "results.sqlite")
+    key = cache.make_key("counting", "1", {"text": "abc"})
+    other = cache.make_key("counting", "2", {"text": "abc"})
+    result = {"errors": 1, "lengths": (3, 1)}
+
+    assert cache.get_many([key]) == {}
+    cache.put_many([(key, "counting", "1", result)])
+
+    reopened = EvaluatorResultCache(path=tmp_path / "results.sqlite")
+    assert reopened.get_many([key, other, key]) == {key: result}
+    assert reopened.stats()["hits"] == 2
+    assert reopened.stats()["misses"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["writes"] == 1
+
+
+def test_evaluator_result_cache_modes(tmp_path):
+    path = tmp_path / "results.sqlite"
+    key = EvaluatorResultCache.make_key("counting", "1", {"text": "abc"})
+
+    EvaluatorResultCache(path=path, mode="read_only").put_many([(key, "counting", "1", {"errors": 0})])
+    assert EvaluatorResultCache(path=path).get_many([key]) == {}
+
+    EvaluatorResultCache(path=path).put_many([(key, "counting", "1", {"errors": 0})])
+    refresh = EvaluatorResultCache(path=path, mode="refresh")
+    assert refresh.get_many([key]) == {}
+    assert refresh.stats()["misses"] == 1
+
+
+def test_unpicklable_results_are_not_stored(tmp_path):
+    cache = EvaluatorResultCache(path=tmp_path / "results.sqlite")
+    key = cache.make_key("counting", "1", {"text": "abc"})
+
+    cache.put_many([(key, "counting", "1", {"callback": lambda: None})])
+
+    assert cache.get_many([key]) == {}
+    assert cache.stats()["writes"] == 0
+
+
+def test_counters_are_exact_under_concurrent_lookups(tmp_path):
+    cache = EvaluatorResultCache(path=tmp_path / "results.sqlite")
+    key = cache.make_key("counting", "1", {"text": "abc"})
+    cache.put_many([(key, "counting", "1", {"errors": 0})])
+    missing = cache.make_key("counting", "1", {"text": "xyz"})
+
+    def look_up():
+        for _ in range(200):
+            cache.get_many([key, missing])
+
+    threads = [threading.Thread(target=look_up) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 8 * 200
@@ -0,0 +1,138 @@
+import asyncio
+import sqlite3
+import threading
+
+import openai
+import pytest
+
+from calibrion_ft.rate_limiter import RateLimiter, _bucket, _observe, _take, is_retryable
+
+HEADERS = {
+    "x-ratelimit-limit-requests": "60",
+    "x-ratelimit-limit-tokens": "6000",
+}
+
+
+def make_state(now: float) -> dict:
+    state = {}
+    _observe(state, HEADERS, refund=0, margin=0.0, now=now)
+    return state
+
+
+def test_take_waits_for_the_refill_of_the_short_bucket():
+    state = make_state(now=0.0)
+
+    assert _take(state, 5000, now=0.0) == 0.0
+    assert state["tokens"]["level"] == pytest.approx(1000)
+    assert state["requests"]["level"] == pytest.approx(59)
+
+    # 6000 tokens per minute refill 100 tokens per second, so 2000 tokens are 10 seconds away
+    assert _take(state, 2000, now=0.0) == pytest.approx(10.0)
+    assert state["tokens"]["level"] == pytest.approx(1000)
+    assert _take(state, 2000, now=10.0) == 0.0
+    assert state["tokens"]["level"] == pytest.approx(0)
+
+
+def test_refill_stops_at_capacity():
+    state = make_state(now=0.0)
+    _take(state, 6000, now=0.0)
+
+    assert _take(state, 0, now=3600.0) == 0.0
+    assert state["tokens"]["level"] == pytest.approx(state["tokens"]["capacity"])
+
+
+def test_observe_refunds_overestimated_tokens_and_follows_remaining():
+    state = make_state(now=0.0)
+    _take(state, 3000, now=0.0)
+
+    _observe(state, HEADERS, refund=1000, margin=0.0, now=0.0)
+    assert state["tokens"]["level"] == pytest.approx(4000)
+
+    _observe(state, {**HEADERS, "x-ratelimit-remaining-tokens": "2500"}, refund=0, margin=0.0, now=0.0)
+    assert state["tokens"]["level"] == pytest.approx(2500)
+
+
+def test_safety_margin_shrinks_the_buckets():
+    bucket = _bucket(1000, margin=0.05)
+
+    assert bucket["capacity"] == pytest.approx(950)
+    assert bucket["rate"] == pytest.approx(950 / 60)
+
+
+def test_limiter_gives_back_unused_tokens(tmp_path):
+    limiter = RateLimiter(shared_path=tmp_path / "rate_limits.sqlite")
+    limiter.observe("model", HEADERS)
+
+    assert limiter.try_acquire("model", 5000) == 0.0
+    assert limiter.try_acquire("model", 5000) > 0
+    limiter.observe("model", HEADERS, estimated_tokens=5000, used_tokens=500)
+    assert limiter.try_acquire("model", 4000) == 0.0
+    limiter.close()
+
+
+def connection_error(error_class, cause: Exception) -> Exception:
+    """Return an openai connection error raised from `cause`, as the client raises it."""
+    try:
+        try:
+            raise cause
+        except Exception as e:
+            raise error_class(request=None) from e
+    except Exception as e:
+        return e
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize("status_code, idempotent, retried", [
+    (429, True, True),
+    (500, True, True),
+    (408, True, True),
+    (409, True, False),
+    (400, True, False),
+    (429, False, True),
+    (500, False, False),
+    (408, False, False),
+])
+def test_status_codes_are_retried_by_idempotency(status_code, idempotent, retried):
+    assert is_retryable(StatusError(status_code), idempotent) == retried
+
+
+def test_creations_are_only_retried_when_the_connection_was_refused():
+    refused = connection_error(openai.APIConnectionError, ConnectionRefusedError("refused"))
+    reset = connection_error(openai.APIConnectionError, ConnectionResetError("reset"))
+    timeout = connection_error(openai.APITimeoutError, TimeoutError("read timeout"))
+
+    assert [is_retryable(error) for error in (refused, reset, timeout)] == [True, True, True]
+    assert [is_retryable(error, idempotent=False) for error in (refused, reset, timeout)] == [True, False, False]
+
+
+def test_shared_buckets_do_not_block_the_event_loop(tmp_path):
+    path = tmp_path / "rate_limits.sqlite"
+    limiter = RateLimiter(shared_path=path)
+    limiter.observe("model", HEADERS)
+    # Another worker holds the database lock for a while
+    other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.5, other.execute, ("COMMIT",)).start()
+
+    async def ticks_while_acquiring() -> int:
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await limiter.acquire_async("model", 100)
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(ticks_while_acquiring()) >= 10
+    limiter.close()
+    other.close()
@@ -0,0 +1,24 @@
+from calibrion_ft.response_cache import ResponseCache
+
+REQUEST = {"model": "ft:model", "messages": [{"role": "user", "content": "Draw a chart"}], "temperature": 0}
+
+
+def test_responses_round_trip(tmp_path):
+    cache = ResponseCache(path=tmp_path / "responses.sqlite")
+    response = {"choices": [{"message": {"content": "<s-chart></s-chart>"}}]}
+
+    assert cache.get(REQUEST) is None
+    cache.put(REQUEST, response)
+
+    assert cache.get(REQUEST) == response
+    assert cache.get({**REQUEST, "temperature": 1}) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_expired_responses_are_misses(tmp_path):
+    cache = ResponseCache(path=tmp_path / "responses.sqlite", max_age_seconds=-1)
+    cache.put(REQUEST, {"choices": []})
+
+    assert cache.get(REQUEST) is None
+    assert cache.stats()["misses"] == 1
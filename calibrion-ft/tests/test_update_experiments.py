@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import pytest
+
+from calibrion_ft import step_2_update_experiments
+from calibrion_ft.step_2_update_experiments import (BACKOFF_FACTOR, MAX_POLL_INTERVAL, MIN_POLL_INTERVAL,
+                                                    STATUS_POLL_INTERVALS, next_poll_delay)
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(step_2_update_experiments.time, "time", lambda: NOW)
+
+
+def job(status: str = "running", estimated_finish: float = None) -> SimpleNamespace:
+    return SimpleNamespace(status=status, estimated_finish=estimated_finish)
+
+
+def test_delay_is_the_earliest_estimated_finish():
+    assert next_poll_delay([job(estimated_finish=NOW + 400), job(estimated_finish=NOW + 120)]) == 120
+
+
+def test_jobs_without_estimate_use_the_default_of_their_status():
+    assert next_poll_delay([job("queued")]) == STATUS_POLL_INTERVALS["queued"]
+    assert next_poll_delay([job("queued"), job("validating_files")]) == STATUS_POLL_INTERVALS["validating_files"]
+    assert next_poll_delay([job("unknown_status")]) == MIN_POLL_INTERVAL
+
+
+def test_unchanged_polls_back_off():
+    assert next_poll_delay([job("running")], unchanged_polls=2) == STATUS_POLL_INTERVALS["running"] * BACKOFF_FACTOR ** 2
+
+
+@pytest.mark.parametrize("jobs, unchanged_polls, expected", [
+    ([], 0, MIN_POLL_INTERVAL),
+    ([job(estimated_finish=NOW - 60)], 0, MIN_POLL_INTERVAL),
+    ([job(estimated_finish=NOW + 5)], 0, MIN_POLL_INTERVAL),
+    ([job(estimated_finish=NOW + 10 * MAX_POLL_INTERVAL)], 0, MAX_POLL_INTERVAL),
+    ([job("queued")], 10, MAX_POLL_INTERVAL),
+])
+def test_delay_is_clamped(jobs, unchanged_polls, expected):
+    assert next_poll_delay(jobs, unchanged_polls) == expected
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from calibrion_ft.work_queue import (STAGE_INFERENCE, STATUS_DONE, STATUS_FAILED, STATUS_LEASED, STATUS_PENDING,
+                                     WorkQueue)
+
+
+def make_queue(tmp_path, **kwargs) -> WorkQueue:
+    queue = WorkQueue(path=tmp_path / "queue.sqlite", **kwargs)
+    queue.submit(["ft:model"], "test.jsonl", num_shards=1, stages=(STAGE_INFERENCE,))
+    return queue
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05)
+
+    first = queue.claim("worker-1")
+    assert first.attempts == 1
+    assert queue.claim("worker-2") is None
+
+    time.sleep(0.1)
+    second = queue.claim("worker-2")
+
+    assert second.id == first.id
+    assert second.attempts == 2
+    assert not queue.renew(first, "worker-1")
+    assert not queue.complete(first, "worker-1")
+    assert queue.complete(second, "worker-2")
+    assert queue.counts() == {(STAGE_INFERENCE, STATUS_DONE): 1}
+
+
+def test_renewed_lease_is_not_reclaimed(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.2)
+
+    item = queue.claim("worker-1")
+    time.sleep(0.1)
+    assert queue.renew(item, "worker-1")
+    time.sleep(0.15)
+
+    assert queue.claim("worker-2") is None
+    assert queue.counts() == {(STAGE_INFERENCE, STATUS_LEASED): 1}
+
+
+def test_expired_lease_on_the_last_attempt_fails_the_item(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05, max_attempts=2)
+
+    assert queue.claim("worker-1").attempts == 1
+    time.sleep(0.1)
+    assert queue.claim("worker-2").attempts == 2
+    time.sleep(0.1)
+
+    assert queue.claim("worker-3") is None
+    assert queue.counts() == {(STAGE_INFERENCE, STATUS_FAILED): 1}
+    assert queue.retry_failed() == 1
+    assert queue.counts() == {(STAGE_INFERENCE, STATUS_PENDING): 1}
+
+
+def test_retried_shards_are_merged_again(tmp_path):
+    queue = WorkQueue(path=tmp_path / "queue.sqlite", max_attempts=1)
+    queue.submit(["ft:model"], "test.jsonl", num_shards=2, stages=(STAGE_INFERENCE,))
+    first, second = queue.claim("worker"), queue.claim("worker")
+    queue.complete(first, "worker")
+    queue.fail(second, "worker", "RuntimeError: boom")
+    queue.mark_merged("ft:model", STAGE_INFERENCE)
+    queue.mark_merged("ft:other", STAGE_INFERENCE)
+
+    assert queue.retry_failed() == 1
+
+    assert not queue.is_merged("ft:model", STAGE_INFERENCE)
+    assert queue.is_merged("ft:other", STAGE_INFERENCE)
+    assert queue.claim("worker").id == second.id
+
+
+def test_model_cannot_be_queued_on_another_test_file(tmp_path):
+    queue = make_queue(tmp_path)
+
+    assert queue.submit(["ft:model"], "test.jsonl", num_shards=1, stages=(STAGE_INFERENCE,)) == 0
+    with pytest.raises(ValueError, match="already queued on"):
+        queue.submit(["ft:model"], "other/test.jsonl", num_shards=1, stages=(STAGE_INFERENCE,))
+    assert queue.submit(["ft:other"], "other/test.jsonl", num_shards=1, stages=(STAGE_INFERENCE,)) == 1